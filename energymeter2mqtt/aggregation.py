@@ -0,0 +1,73 @@
+AGGREGATES = {
+    # name -> verbose name of the extra sensor
+    'mean': 'Mean',
+    'min': 'Min',
+    'max': 'Max',
+    'twa': 'Time-weighted average',
+}
+
+
+class RunningAggregate:
+    """
+    Running aggregates of one parameter over a time window, with O(1) memory.
+
+    The time-weighted average holds every value until the next sample,
+    so irregular poll times are weighted correctly.
+
+    >>> aggregate = RunningAggregate(window=10)
+    >>> aggregate.add(100, now=0)
+    >>> aggregate.add(200, now=2)
+    >>> aggregate.add(100, now=4)
+    >>> aggregate.add(100, now=10)
+    {'last': 100, 'mean': 125.0, 'min': 100, 'max': 200, 'twa': 120.0}
+    >>> aggregate.add(300, now=15)
+    >>> aggregate.add(300, now=20)
+    {'last': 300, 'mean': 300.0, 'min': 300, 'max': 300, 'twa': 200.0}
+    """
+
+    __slots__ = ('window', 'window_start', 'count', 'sum', 'min', 'max', 'integral', 'last', 'last_time')
+
+    def __init__(self, *, window: int | float):
+        assert window > 0, f'Invalid aggregate window: {window!r}'
+        self.window = window
+        self.last = None
+        self.last_time = None
+        self._reset(now=None)
+
+    def _reset(self, *, now):
+        self.window_start = now
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.integral = 0
+
+    def add(self, value, *, now) -> dict | None:
+        """
+        Add one sample. Returns the aggregates if the window is complete.
+        """
+        if self.window_start is None:
+            self.window_start = now
+        elif self.last_time is not None:
+            self.integral += self.last * (now - self.last_time)
+
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+        self.last_time = now
+
+        duration = now - self.window_start
+        if duration < self.window:
+            return None
+
+        result = {
+            'last': value,
+            'mean': self.sum / self.count,
+            'min': self.min,
+            'max': self.max,
+            'twa': self.integral / duration,
+        }
+        self._reset(now=now)
+        return result
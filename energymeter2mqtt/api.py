@@ -1,37 +1,58 @@
 import logging
-from decimal import Decimal
+import time
 
 # from ha_services.mqtt4homeassistant.data_classes import HaValue
 from pymodbus import FramerType
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
+from pymodbus.client import ModbusSerialClient, ModbusTcpClient
+from pymodbus.client.base import ModbusBaseSyncClient
+from pymodbus.exceptions import ModbusException, ModbusIOException
 from pymodbus.pdu import ExceptionResponse
 from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
 from rich.pretty import pprint
 
-from energymeter2mqtt.user_settings import EnergyMeter
+from energymeter2mqtt.decode_plan import DecodeBlock, compile_decode_plan
+from energymeter2mqtt.device_health import DeviceHealth
+from energymeter2mqtt.metrics import MODBUS_ERRORS, MODBUS_READ_SECONDS, MODBUS_RETRIES
+from energymeter2mqtt.serial_cache import SerialConnectionCache
+from energymeter2mqtt.user_settings import TRANSPORT_SERIAL, TRANSPORT_TCP, TRANSPORTS, EnergyMeter
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_modbus_client(energy_meter: EnergyMeter, definitions: dict, verbosity: int) -> ModbusSerialClient:
-    conn_settings = definitions['connection']
+def get_modbus_client(energy_meter: EnergyMeter, definitions: dict, verbosity: int) -> ModbusBaseSyncClient:
+    assert energy_meter.transport in TRANSPORTS, f'Unknown transport: {energy_meter.transport!r}'
 
-    print(f'Connect to {energy_meter.port}...')
-    conn_kwargs = dict(
-        baudrate=conn_settings['baudrate'],
-        bytesize=conn_settings['bytesize'],
-        parity=conn_settings['parity'],
-        stopbits=conn_settings['stopbits'],
-        timeout=energy_meter.timeout,
-        retries=energy_meter.retries,
-    )
+    print(f'Connect to {energy_meter.bus} ({energy_meter.transport})...')
+    if energy_meter.transport == TRANSPORT_SERIAL:
+        conn_settings = SerialConnectionCache().get_connection(
+            energy_meter.port, name=energy_meter.name, definitions=definitions
+        )
+        conn_kwargs = dict(
+            baudrate=conn_settings['baudrate'],
+            bytesize=conn_settings['bytesize'],
+            parity=conn_settings['parity'],
+            stopbits=conn_settings['stopbits'],
+            timeout=energy_meter.timeout,
+            retries=energy_meter.retries,
+        )
+    else:
+        conn_kwargs = dict(
+            port=energy_meter.tcp_port,
+            timeout=energy_meter.timeout,
+            retries=energy_meter.retries,
+        )
     if verbosity:
         print('Connection arguments:')
         pprint(conn_kwargs)
 
-    client = ModbusSerialClient(energy_meter.port, framer=FramerType.RTU, **conn_kwargs)
+    if energy_meter.transport == TRANSPORT_SERIAL:
+        client = ModbusSerialClient(energy_meter.port, framer=FramerType.RTU, **conn_kwargs)
+    else:
+        # Modbus TCP gateways use the MBAP header, transparent serial servers just forward the RTU frames:
+        framer = FramerType.SOCKET if energy_meter.transport == TRANSPORT_TCP else FramerType.RTU
+        client = ModbusTcpClient(energy_meter.host, framer=framer, **conn_kwargs)
+
     if verbosity > 1:
         print('connected:', client.connect())
         print(client)
@@ -39,7 +60,117 @@ def get_modbus_client(energy_meter: EnergyMeter, definitions: dict, verbosity: i
     return client
 
 
-def get_ha_values(*, client: ModbusSerialClient, parameters, device_id: int) -> dict:
+def group_by_bus(energy_meters: list[EnergyMeter]) -> dict[str, list[EnergyMeter]]:
+    bus2energy_meters = {}
+    for energy_meter in energy_meters:
+        bus2energy_meters.setdefault(energy_meter.bus, []).append(energy_meter)
+    return bus2energy_meters
+
+
+def get_modbus_clients(energy_meters: list[EnergyMeter], verbosity: int) -> dict[str, ModbusBaseSyncClient]:
+    """
+    Create one client per bus (serial port or TCP gateway), shared by all energy meters on this bus.
+    The connection settings are taken from the first energy meter on a bus.
+    """
+    bus2client = {}
+    for bus, bus_energy_meters in group_by_bus(energy_meters).items():
+        energy_meter = bus_energy_meters[0]
+        definitions = energy_meter.get_definitions()
+        for other_energy_meter in bus_energy_meters[1:]:
+            if other_energy_meter.transport != energy_meter.transport or (
+                energy_meter.transport == TRANSPORT_SERIAL
+                and other_energy_meter.get_definitions()['connection'] != definitions['connection']
+            ):
+                logger.warning(
+                    'Connection settings of %r on %s differ from %r -> ignored!',
+                    other_energy_meter.name,
+                    bus,
+                    energy_meter.name,
+                )
+        bus2client[bus] = get_modbus_client(energy_meter, definitions, verbosity)
+    return bus2client
+
+
+def parse_block_response(*, block: DecodeBlock, response, device_id: int, bus: str = '') -> dict:
+    """
+    Decode the values of all parameters from the response of one block read.
+    Returns an empty dict on errors.
+    """
+    if isinstance(response, (ExceptionResponse, ModbusException)):
+        logger.error(
+            'Error read register %i (dez, count: %i, slave id: %i): %s',
+            block.address,
+            block.count,
+            device_id,
+            response,
+        )
+        if isinstance(response, ExceptionResponse):
+            error = f'exception_{response.exception_code}'
+        elif isinstance(response, ModbusIOException):
+            error = 'timeout'
+        else:
+            error = 'error'
+        MODBUS_ERRORS.inc(bus, device_id, block.address, error)
+        return {}
+
+    assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
+    if retries := getattr(response, 'retries', 0):
+        MODBUS_RETRIES.inc(bus, device_id, amount=retries)
+
+    registers = response.registers
+    if len(registers) < block.count:
+        logger.error(
+            'Incomplete response for register %i (dez, count: %i, slave id: %i): %r',
+            block.address,
+            block.count,
+            device_id,
+            registers,
+        )
+        MODBUS_ERRORS.inc(bus, device_id, block.address, 'incomplete')
+        return {}
+
+    return block.decode(registers)
+
+
+def read_values(
+    *,
+    client,
+    decode_plan: tuple[DecodeBlock, ...],
+    device_id: int,
+    bus: str = '',
+    device_health: DeviceHealth | None = None,
+    raw_registers: dict | None = None,
+) -> dict:
+    """
+    Read all blocks of a compiled decode plan and return the decoded values by register.
+    The response times are collected in "device_health", if given.
+    The raw registers of the decoded values are stored by register in "raw_registers", if given.
+    """
+    register2values = {}
+    for block in decode_plan:
+        start = time.perf_counter()
+        try:
+            response = client.read_holding_registers(address=block.address, count=block.count, device_id=device_id)
+        except ModbusIOException:
+            # No response after all retries:
+            MODBUS_ERRORS.inc(bus, device_id, block.address, 'timeout')
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            MODBUS_READ_SECONDS.observe(duration, bus, device_id, block.address)
+        if device_health is not None and not getattr(response, 'retries', 0):
+            # The duration of retried requests contains the timeouts
+            device_health.add_response_time(duration)
+        values = parse_block_response(block=block, response=response, device_id=device_id, bus=bus)
+        if values and raw_registers is not None:
+            registers = response.registers
+            for decoder in block.decoders:
+                raw_registers[decoder.register] = registers[decoder.offset : decoder.offset + decoder.count]
+        register2values.update(values)
+    return register2values
+
+
+def get_ha_values(*, client, parameters, device_id: int, max_gap: int = 0) -> dict:
     # parameters = [{'register': 28,
     #                 'reg_count': 2,
     #                 'name': 'Energy Counter Total',
@@ -48,33 +179,5 @@ def get_ha_values(*, client: ModbusSerialClient, parameters, device_id: int) ->
     #                 'uom': 'kWh',
     #                 'scale': 0.01},
     #                {...
-    register2values = {}
-    for parameter in parameters:
-        logger.debug('Parameters: %r', parameter)
-        parameter_name = parameter['name']
-        address = parameter['register']
-        count = parameter.get('count', 1)
-        logger.debug('Read register %i (dez, count: %i, slave id: %i)', address, count, device_id)
-
-        response = client.read_holding_registers(address=address, count=count, device_id=device_id)
-        if isinstance(response, (ExceptionResponse, ModbusException)):
-            logger.error(
-                'Error read register %i (dez, count: %i, slave id: %i): %s', address, count, device_id, response
-            )
-        else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            registers = response.registers
-            logger.debug('Register values: %r', registers)
-            value = registers[0]
-            if count > 1:
-                value += registers[1] * 65536
-
-            if scale := parameter.get('scale'):
-                logger.debug('Scale %s: %r * %r', parameter_name, value, scale)
-                scale = Decimal(str(scale))
-                value = float(value * scale)
-                logger.debug('Scaled %s results in: %r', parameter_name, value)
-
-            register2values[address] = value
-            logger.debug('%s address %r has value: %r', parameter_name, address, value)
-    return register2values
+    decode_plan = compile_decode_plan(parameters, max_gap=max_gap)
+    return read_values(client=client, decode_plan=decode_plan, device_id=device_id)
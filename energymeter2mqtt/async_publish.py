@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from cli_base.cli_tools.verbosity import setup_logging
+from pymodbus import FramerType
+from pymodbus.client import AsyncModbusSerialClient, AsyncModbusTcpClient
+from pymodbus.client.base import ModbusBaseClient
+from pymodbus.exceptions import ModbusIOException
+
+from energymeter2mqtt.api import group_by_bus, parse_block_response
+from energymeter2mqtt.bus_worker import STATS_LOG_INTERVAL
+from energymeter2mqtt.decode_plan import DecodeBlock, DecodePlanCache, compile_decode_plan
+from energymeter2mqtt.device_health import DeviceHealth, DeviceHealthRegistry, update_device_health
+from energymeter2mqtt.last_values import LAST_VALUES
+from energymeter2mqtt.metrics import MODBUS_ERRORS, MODBUS_READ_SECONDS, POLL_CYCLE_SECONDS, start_metrics_server
+from energymeter2mqtt.mqtt_handler import EnergyMeterMqttHandler
+from energymeter2mqtt.mqtt_publish import MAIN_DEVICE_INTERVAL
+from energymeter2mqtt.scheduler import PollScheduler, group_by_energy_meter
+from energymeter2mqtt.serial_cache import SerialConnectionCache
+from energymeter2mqtt.user_settings import (
+    TRANSPORT_SERIAL,
+    TRANSPORT_TCP,
+    TRANSPORTS,
+    AdaptiveTimeoutSettings,
+    EnergyMeter,
+    UserSettings,
+    get_user_settings,
+)
+from energymeter2mqtt.value_validation import ValidatorRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_async_modbus_client(energy_meter: EnergyMeter, definitions: dict) -> ModbusBaseClient:
+    assert energy_meter.transport in TRANSPORTS, f'Unknown transport: {energy_meter.transport!r}'
+
+    if energy_meter.transport == TRANSPORT_SERIAL:
+        conn_settings = SerialConnectionCache().get_connection(
+            energy_meter.port, name=energy_meter.name, definitions=definitions
+        )
+        return AsyncModbusSerialClient(
+            energy_meter.port,
+            framer=FramerType.RTU,
+            baudrate=conn_settings['baudrate'],
+            bytesize=conn_settings['bytesize'],
+            parity=conn_settings['parity'],
+            stopbits=conn_settings['stopbits'],
+            timeout=energy_meter.timeout,
+            retries=energy_meter.retries,
+        )
+    return AsyncModbusTcpClient(
+        energy_meter.host,
+        port=energy_meter.tcp_port,
+        framer=FramerType.SOCKET if energy_meter.transport == TRANSPORT_TCP else FramerType.RTU,
+        timeout=energy_meter.timeout,
+        retries=energy_meter.retries,
+    )
+
+
+async def async_read_values(
+    *,
+    client,
+    decode_plan: tuple[DecodeBlock, ...],
+    device_id: int,
+    bus: str = '',
+    device_health: DeviceHealth | None = None,
+) -> dict:
+    """
+    Same as api.read_values() but for the pymodbus async clients.
+    """
+    register2values = {}
+    for block in decode_plan:
+        start = time.perf_counter()
+        try:
+            response = await client.read_holding_registers(
+                address=block.address, count=block.count, device_id=device_id
+            )
+        except ModbusIOException:
+            MODBUS_ERRORS.inc(bus, device_id, block.address, 'timeout')
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            MODBUS_READ_SECONDS.observe(duration, bus, device_id, block.address)
+        if device_health is not None and not getattr(response, 'retries', 0):
+            device_health.add_response_time(duration)
+        register2values.update(parse_block_response(block=block, response=response, device_id=device_id, bus=bus))
+    return register2values
+
+
+async def async_get_ha_values(*, client, parameters, device_id: int, max_gap: int = 0) -> dict:
+    """
+    Same as api.get_ha_values() but for the pymodbus async clients.
+    """
+    decode_plan = compile_decode_plan(parameters, max_gap=max_gap)
+    return await async_read_values(client=client, decode_plan=decode_plan, device_id=device_id)
+
+
+def publish_results(energymeter_mqtt_handler: EnergyMeterMqttHandler, results: list[tuple[EnergyMeter, dict]]):
+    for energy_meter, register2values in results:
+        energymeter_mqtt_handler.collect(energy_meter, register2values)
+    energymeter_mqtt_handler.flush()
+
+
+async def poll_bus(
+    *,
+    client,
+    energy_meters: list[EnergyMeter],
+    energymeter_mqtt_handler: EnergyMeterMqttHandler,
+    publish_executor: Executor,
+    adaptive_timeout: AdaptiveTimeoutSettings | None = None,
+):
+    """
+    Poll all energy meters on one bus in a endless loop. Only the due parameters are read.
+    A timeout of one bus doesn't block the other buses.
+
+    The values are published in the "publish_executor" thread, because waiting for the MQTT broker
+    and the value buffer I/O would block the event loop and so the polling of all buses.
+    """
+    loop = asyncio.get_running_loop()
+    scheduler = PollScheduler()
+    decode_plans = DecodePlanCache()
+    device_health_registry = DeviceHealthRegistry(adaptive_timeout)
+    validators = ValidatorRegistry()
+    for energy_meter in energy_meters:
+        definitions = energy_meter.get_definitions()
+        scheduler.add(energy_meter, definitions['parameters'], now=time.monotonic())
+
+    next_stats_log = time.monotonic() + STATS_LOG_INTERVAL
+    while True:
+        now = time.monotonic()
+        if now >= next_stats_log:
+            scheduler.log_stats()
+            next_stats_log = now + STATS_LOG_INTERVAL
+
+        jobs = scheduler.pop_due(now=now)
+        cycle_start = time.perf_counter()
+        results = []
+        for energy_meter, energy_meter_jobs in group_by_energy_meter(jobs):
+            device_health = device_health_registry.get(energy_meter)
+            if device_health is not None:
+                if not device_health.is_available(now=time.monotonic()):
+                    logger.debug('Skip failing %s (device id: %i)', energy_meter.bus, energy_meter.device_id)
+                    continue
+                device_health.configure_client(client)
+
+            decode_plan = decode_plans.get(energy_meter=energy_meter, jobs=energy_meter_jobs)
+            try:
+                register2values = await async_read_values(
+                    client=client,
+                    decode_plan=decode_plan,
+                    device_id=energy_meter.device_id,
+                    bus=energy_meter.bus,
+                    device_health=device_health,
+                )
+                # Same as BusWorker.validate(): Read implausible values once again
+                validator = validators.get(energy_meter)
+                if rejected := validator.validate(register2values, now=time.monotonic()):
+                    values = await async_read_values(
+                        client=client,
+                        decode_plan=validator.get_decode_plan(rejected),
+                        device_id=energy_meter.device_id,
+                        bus=energy_meter.bus,
+                    )
+                    validator.validate(values, now=time.monotonic())
+                    register2values.update(values)
+            except Exception as err:
+                logger.exception('Error collect values from %s: %s', energy_meter.bus, err)
+                register2values = {}
+            else:
+                LAST_VALUES.update(energy_meter, register2values)
+                results.append((energy_meter, register2values))
+            if device_health is not None:
+                update_device_health(energy_meter, device_health=device_health, register2values=register2values)
+        if jobs:
+            POLL_CYCLE_SECONDS.observe(time.perf_counter() - cycle_start, energy_meters[0].bus)
+            await loop.run_in_executor(publish_executor, publish_results, energymeter_mqtt_handler, results)
+
+        if (next_due := scheduler.next_due()) is None:
+            logger.warning('No parameters to poll on %s', energy_meters[0].bus)
+            return
+        await asyncio.sleep(max(next_due - time.monotonic(), 0))
+
+
+async def publish_main_device(
+    *, energymeter_mqtt_handler: EnergyMeterMqttHandler, publish_executor: Executor, interval
+):
+    loop = asyncio.get_running_loop()
+    while True:
+        # Collecting the system information may block (e.g.: wifi info via subprocess)
+        await loop.run_in_executor(publish_executor, energymeter_mqtt_handler.publish_main_device)
+        await asyncio.sleep(interval)
+
+
+async def async_publish(*, user_settings: UserSettings, verbosity: int):
+    energymeter_mqtt_handler = EnergyMeterMqttHandler(
+        user_settings=user_settings,
+        verbosity=verbosity,
+    )
+
+    # One thread for all MQTT publishing, because the MQTT handler is not thread-safe:
+    publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='MqttPublish')
+    async with asyncio.TaskGroup() as task_group:
+        task_group.create_task(
+            publish_main_device(
+                energymeter_mqtt_handler=energymeter_mqtt_handler,
+                publish_executor=publish_executor,
+                interval=MAIN_DEVICE_INTERVAL,
+            )
+        )
+        for bus, energy_meters in group_by_bus(user_settings.get_energy_meters()).items():
+            client = get_async_modbus_client(energy_meters[0], energy_meters[0].get_definitions())
+            logger.info('Connect to %s: %s', bus, await client.connect())
+            task_group.create_task(
+                poll_bus(
+                    client=client,
+                    energy_meters=energy_meters,
+                    energymeter_mqtt_handler=energymeter_mqtt_handler,
+                    publish_executor=publish_executor,
+                    adaptive_timeout=user_settings.adaptive_timeout,
+                )
+            )
+
+
+def async_publish_forever(*, verbosity: int):
+    """
+    Publish all values via MQTT to Home Assistant in a endless asyncio event loop.
+    """
+    setup_logging(verbosity=verbosity)
+
+    user_settings: UserSettings = get_user_settings(verbosity)
+    assert not user_settings.gateway.enabled, 'The Modbus gateway is not supported with --async'
+    logger.warning('Changed settings and definitions are not reloaded with --async: Restart after changes!')
+    if user_settings.metrics.enabled:
+        start_metrics_server(host=user_settings.metrics.host, port=user_settings.metrics.port)
+    asyncio.run(async_publish(user_settings=user_settings, verbosity=verbosity))
@@ -0,0 +1,256 @@
+import dataclasses
+import json
+import logging
+import platform
+import resource
+import socketserver
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+from ha_services.mqtt4homeassistant.data_classes import MqttSettings
+
+import energymeter2mqtt
+from energymeter2mqtt.api import get_modbus_client, parse_block_response
+from energymeter2mqtt.decode_plan import compile_decode_plan
+from energymeter2mqtt.mqtt_handler import EnergyMeterMqttHandler
+from energymeter2mqtt.simulator import SimulatedBus, SimulatorThread, get_simulator_context
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, ValueBufferSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+MQTT_CONNECT = 0x10
+MQTT_CONNACK = b'\x20\x02\x00\x00'
+MQTT_PUBLISH = 0x30
+MQTT_PINGREQ = 0xC0
+MQTT_PINGRESP = b'\xd0\x00'
+MQTT_DISCONNECT = 0xE0
+
+
+class StandInBrokerHandler(socketserver.BaseRequestHandler):
+    """
+    Accept one MQTT client connection and count the published messages.
+    """
+
+    def read_exactly(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Connection closed')
+            data += chunk
+        return data
+
+    def read_packet(self) -> tuple[int, bytes]:
+        packet_type = self.read_exactly(1)[0]
+        remaining_length = 0
+        for shift in range(0, 28, 7):
+            byte = self.read_exactly(1)[0]
+            remaining_length += (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+        return packet_type, self.read_exactly(remaining_length)
+
+    def handle(self):
+        broker: StandInBroker = self.server
+        try:
+            while True:
+                packet_type, payload = self.read_packet()
+                kind = packet_type & 0xF0
+                if kind == MQTT_CONNECT:
+                    self.request.sendall(MQTT_CONNACK)
+                elif kind == MQTT_PUBLISH:
+                    broker.count_message(qos=(packet_type >> 1) & 0x03, payload=payload)
+                    if (packet_type >> 1) & 0x03:
+                        # QoS 1: Send PUBACK with the packet id behind the topic:
+                        topic_length = int.from_bytes(payload[:2], 'big')
+                        packet_id = payload[2 + topic_length : 4 + topic_length]
+                        self.request.sendall(b'\x40\x02' + packet_id)
+                elif kind == MQTT_PINGREQ:
+                    self.request.sendall(MQTT_PINGRESP)
+                elif kind == MQTT_DISCONNECT:
+                    return
+        except ConnectionError:
+            pass
+
+
+class StandInBroker(socketserver.ThreadingTCPServer):
+    """
+    A minimal local MQTT broker, that accepts all messages without forwarding them.
+    Enough to measure the publishing via a real paho MQTT client.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), StandInBrokerHandler)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.payload_bytes = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count_message(self, *, qos: int, payload: bytes):
+        with self.lock:
+            self.messages += 1
+            self.payload_bytes += len(payload)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, name='StandInBroker', daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+
+
+def get_percentiles(values: list[float]) -> dict:
+    """
+    Latency statistics in milliseconds.
+
+    >>> get_percentiles([0.001, 0.002, 0.003, 0.004])
+    {'count': 4, 'p50': 2.5, 'p90': 3.7, 'p99': 3.97, 'max': 4.0}
+    """
+    if len(values) < 2:
+        return {'count': len(values)}
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'count': len(values),
+        'p50': round(quantiles[49] * 1000, 3),
+        'p90': round(quantiles[89] * 1000, 3),
+        'p99': round(quantiles[98] * 1000, 3),
+        'max': round(max(values) * 1000, 3),
+    }
+
+
+@dataclasses.dataclass
+class BenchmarkSettings:
+    name: str = 'saia_pcd_ald1d5fd'  # Definition file of the simulated energy meters
+    device_count: int = 1
+    transport: str = 'tcp'
+    duration: float = 10.0  # seconds
+    latency: float = 0.0  # Response latency of the simulated energy meters
+    baudrate: int = 0  # Emulated baud rate (0 = off)
+    max_read_gap: int = 0
+
+
+def run_benchmark(settings: BenchmarkSettings) -> dict:
+    """
+    Poll simulated energy meters as fast as possible for the given duration and publish
+    all values via a real MQTT client to a stand-in broker. Returns the measurements.
+    """
+    energy_meter = EnergyMeter(name=settings.name)
+    definitions = energy_meter.get_definitions()
+    decode_plan = compile_decode_plan(definitions['parameters'], max_gap=settings.max_read_gap)
+
+    context = get_simulator_context(
+        definitions=definitions,
+        device_ids=range(1, settings.device_count + 1),
+        bus=SimulatedBus(latency=settings.latency, baudrate=settings.baudrate),
+    )
+    with SimulatorThread(context=context, transport=settings.transport) as simulator, StandInBroker() as broker:
+        energy_meter = dataclasses.replace(
+            energy_meter,
+            transport=settings.transport,
+            host='127.0.0.1',
+            tcp_port=simulator.port,
+            max_read_gap=settings.max_read_gap,
+        )
+        user_settings = UserSettings(
+            mqtt=MqttSettings(host='127.0.0.1', port=broker.port, main_uid='benchmark'),
+            energy_meter=energy_meter,
+            additional_energy_meters=[{'device_id': device_id} for device_id in range(2, settings.device_count + 1)],
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        energy_meters = user_settings.get_energy_meters()
+        handler = EnergyMeterMqttHandler(user_settings=user_settings, verbosity=0)
+        client = get_modbus_client(energy_meter, definitions, verbosity=0)
+
+        read_latencies = []
+        decode_latencies = []
+        publish_latencies = []
+        cycle_latencies = []
+        values_count = 0
+        cycles = 0
+        try:
+            usage_start = resource.getrusage(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            end = start + settings.duration
+            while time.perf_counter() < end:
+                cycle_start = time.perf_counter()
+                for meter in energy_meters:
+                    register2values = {}
+                    for block in decode_plan:
+                        read_start = time.perf_counter()
+                        response = client.read_holding_registers(
+                            address=block.address, count=block.count, device_id=meter.device_id
+                        )
+                        decode_start = time.perf_counter()
+                        register2values.update(
+                            parse_block_response(block=block, response=response, device_id=meter.device_id)
+                        )
+                        decode_end = time.perf_counter()
+                        read_latencies.append(decode_start - read_start)
+                        decode_latencies.append(decode_end - decode_start)
+
+                    publish_start = time.perf_counter()
+                    handler(meter, register2values)
+                    publish_latencies.append(time.perf_counter() - publish_start)
+                    values_count += len(register2values)
+                cycle_latencies.append(time.perf_counter() - cycle_start)
+                cycles += 1
+            duration = time.perf_counter() - start
+            usage_end = resource.getrusage(resource.RUSAGE_SELF)
+
+            time.sleep(0.2)  # Let the paho network thread send the last messages
+        finally:
+            client.close()
+            handler.mqtt_client.disconnect()
+            handler.mqtt_client.loop_stop()
+
+    cpu_seconds = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    return {
+        'version': energymeter2mqtt.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': dataclasses.asdict(settings),
+        'duration': round(duration, 3),
+        'cycles': cycles,
+        'reads': len(read_latencies),
+        'reads_per_second': round(len(read_latencies) / duration, 1),
+        'values_per_second': round(values_count / duration, 1),
+        'mqtt_messages': broker.messages,
+        'mqtt_messages_per_second': round(broker.messages / duration, 1),
+        'latency_ms': {
+            'read': get_percentiles(read_latencies),
+            'decode': get_percentiles(decode_latencies),
+            'publish': get_percentiles(publish_latencies),
+            'cycle': get_percentiles(cycle_latencies),
+        },
+        'cpu_seconds': round(cpu_seconds, 3),
+        'cpu_percent': round(cpu_seconds / duration * 100, 1),
+        'max_rss_kb': usage_end.ru_maxrss,  # Peak resident set size of the whole process (Linux: in KiB)
+    }
+
+
+def main():
+    """
+    Run the benchmark in a fresh process: The dev CLI activates the typeguard import hook,
+    that would slow down all energymeter2mqtt functions.
+
+    usage: python -m energymeter2mqtt.benchmark <settings as JSON> <output JSON file>
+    """
+    settings_json, output_path = sys.argv[1:]
+    results = run_benchmark(BenchmarkSettings(**json.loads(settings_json)))
+    Path(output_path).write_text(json.dumps(results, indent=4, sort_keys=True) + '\n', encoding='UTF-8')
+
+
+if __name__ == '__main__':
+    main()
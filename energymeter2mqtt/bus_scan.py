@@ -0,0 +1,134 @@
+import concurrent.futures
+import dataclasses
+import logging
+from collections.abc import Callable, Iterable
+
+from pymodbus.exceptions import ModbusException
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from energymeter2mqtt.api import get_modbus_client
+from energymeter2mqtt.device_health import set_client_timeout
+from energymeter2mqtt.read_plan import MAX_REGISTER_COUNT
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+logger = logging.getLogger(__name__)
+
+
+def find_readable_ranges(
+    is_readable: Callable[[int, int], bool],
+    *,
+    start: int,
+    end: int,
+    max_count: int = MAX_REGISTER_COUNT,
+    min_split: int = 8,
+) -> list[tuple[int, int]]:
+    """
+    Find all readable registers between start and end with as few requests as possible:
+    Read big blocks and split them into halves, if the block can't be read.
+    Every unreadable register needs its own request, so keep "end" near the expected register map.
+    Returns (address, count) of the readable ranges.
+
+    >>> readable = set(range(0, 60)) | set(range(70, 90))
+    >>> requests = []
+    >>> def is_readable(address, count):
+    ...     requests.append((address, count))
+    ...     return set(range(address, address + count)) <= readable
+    >>> find_readable_ranges(is_readable, start=0, end=100)
+    [(0, 60), (70, 20)]
+    >>> len(requests)  # A register by register scan needs 100 requests
+    47
+    """
+    ranges = []
+    blocks = [(address, min(max_count, end - address)) for address in range(start, end, max_count)]
+    blocks.reverse()
+    while blocks:
+        address, count = blocks.pop()
+        if is_readable(address, count):
+            if ranges and ranges[-1][0] + ranges[-1][1] == address:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + count)
+            else:
+                ranges.append((address, count))
+        elif count > min_split:
+            half = count // 2
+            blocks.append((address + half, count - half))
+            blocks.append((address, half))
+        elif count > 1:
+            # Splitting small blocks into halves needs more requests than reading every register:
+            blocks.extend((address + offset, 1) for offset in reversed(range(count)))
+    return ranges
+
+
+def read_registers(client, *, device_id: int, address: int, count: int) -> bool:
+    try:
+        response = client.read_holding_registers(address=address, count=count, device_id=device_id)
+    except ModbusException:
+        return False
+    return isinstance(response, ReadHoldingRegistersResponse) and len(response.registers) == count
+
+
+def probe_device_id(client, *, device_id: int, address: int) -> bool:
+    """
+    Any response, also an exception response (e.g.: "illegal address"), means: the device exists.
+    """
+    try:
+        response = client.read_holding_registers(address=address, count=1, device_id=device_id)
+    except ModbusException:
+        return False
+    return not isinstance(response, ModbusException)
+
+
+@dataclasses.dataclass
+class BusScanResult:
+    bus: str
+    device_id2ranges: dict = dataclasses.field(default_factory=dict)  # {device_id: [(address, count), ...]}
+    error: str = ''
+
+
+def scan_bus(
+    energy_meter: EnergyMeter,
+    *,
+    device_ids: Iterable[int],
+    max_register: int,
+    timeout: float,
+    scan_registers: bool = True,
+) -> BusScanResult:
+    """
+    Probe all device ids on the bus of the given energy meter (with short timeouts and without retries)
+    and find the readable holding registers of the responding devices.
+    The connection settings are taken from the definitions of the energy meter or the detected ones.
+    """
+    result = BusScanResult(bus=energy_meter.bus)
+    definitions = energy_meter.get_definitions()
+    probe_address = min(parameter['register'] for parameter in definitions['parameters'])
+
+    client = get_modbus_client(energy_meter, definitions, verbosity=0)
+    try:
+        set_client_timeout(client, timeout=timeout, retries=0)
+        for device_id in device_ids:
+            if probe_device_id(client, device_id=device_id, address=probe_address):
+                logger.info('Device id %i responds on %s', device_id, energy_meter.bus)
+                result.device_id2ranges[device_id] = []
+
+        if scan_registers:
+            for device_id, ranges in result.device_id2ranges.items():
+
+                def is_readable(address: int, count: int) -> bool:
+                    return read_registers(client, device_id=device_id, address=address, count=count)
+
+                ranges.extend(find_readable_ranges(is_readable, start=0, end=max_register))
+    except Exception as err:
+        logger.exception('Scan %s failed: %s', energy_meter.bus, err)
+        result.error = str(err)
+    finally:
+        client.close()
+    return result
+
+
+def scan_buses(energy_meters: list[EnergyMeter], **scan_kwargs) -> list[BusScanResult]:
+    """
+    Scan all buses in parallel: One thread per bus, because the requests on one bus can't overlap.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(energy_meters) or 1) as executor:
+        futures = [executor.submit(scan_bus, energy_meter, **scan_kwargs) for energy_meter in energy_meters]
+        return [future.result() for future in futures]
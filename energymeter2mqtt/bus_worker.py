@@ -0,0 +1,224 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from energymeter2mqtt.api import read_values
+from energymeter2mqtt.decode_plan import DecodePlanCache
+from energymeter2mqtt.device_health import DeviceHealthRegistry, update_device_health
+from energymeter2mqtt.gateway import read_registers
+from energymeter2mqtt.last_values import LAST_VALUES
+from energymeter2mqtt.metrics import POLL_CYCLE_SECONDS
+from energymeter2mqtt.register_cache import RegisterCache
+from energymeter2mqtt.scheduler import PollJob, PollScheduler, group_by_energy_meter
+from energymeter2mqtt.user_settings import AdaptiveTimeoutSettings, EnergyMeter
+from energymeter2mqtt.value_validation import ValidatorRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+STATS_LOG_INTERVAL = 5 * 60  # Log the achieved poll timing every X seconds
+
+
+class BusWorker(threading.Thread):
+    """
+    Poll all energy meters on one bus and put the values into the result queue.
+
+    Every bus has its own worker, so a slow or dead bus doesn't stall the other ones.
+    """
+
+    def __init__(
+        self,
+        *,
+        bus: str,
+        client,
+        energy_meters: list[EnergyMeter],
+        result_queue: queue.Queue,
+        adaptive_timeout: AdaptiveTimeoutSettings | None = None,
+        register_cache: RegisterCache | None = None,
+    ):
+        super().__init__(name=f'BusWorker {bus}', daemon=True)
+        self.bus = bus
+        self.client = client
+        self.energy_meters = energy_meters
+        self.result_queue = result_queue
+        self.register_cache = register_cache  # Raw registers for the Modbus gateway
+        self.scheduler = PollScheduler()
+        self.decode_plans = DecodePlanCache()
+        self.device_health = DeviceHealthRegistry(adaptive_timeout)
+        self.validators = ValidatorRegistry()
+
+        self.key2meter = {}  # {(bus, device_id): (energy_meter, definitions)} of the scheduled energy meters
+        self.reload_queue = queue.SimpleQueue()
+        self.request_queue = queue.SimpleQueue()  # Read requests of the Modbus gateway
+        self.stop_event = threading.Event()
+        self.wakeup_event = threading.Event()
+
+    def reload(self, energy_meters: list[EnergyMeter]):
+        """
+        Thread-safe: The new energy meters are applied before the next poll run.
+        """
+        self.reload_queue.put(energy_meters)
+        self.wakeup_event.set()  # The worker may wait without a timeout, if no energy meter is scheduled
+
+    def forward(self, *, device_id: int, func_code: int, address: int, count: int) -> Future:
+        """
+        Thread-safe: Send a read request of a Modbus gateway client to the bus, between the poll runs.
+        The future is resolved with the registers or the ExcCodes of the failed request.
+        """
+        future = Future()
+        self.request_queue.put((future, dict(device_id=device_id, func_code=func_code, address=address, count=count)))
+        self.wakeup_event.set()
+        return future
+
+    def handle_requests(self):
+        while not self.request_queue.empty():
+            future, kwargs = self.request_queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue  # The gateway client gave up
+            try:
+                future.set_result(read_registers(self.client, **kwargs))
+            except Exception as err:
+                logger.exception('Error forward %r to %s: %s', kwargs, self.bus, err)
+                future.set_exception(err)
+
+    def apply_energy_meters(self, energy_meters: list[EnergyMeter], *, now):
+        """
+        Schedule new energy meters and reschedule only the changed ones.
+        Unchanged energy meters keep their schedule, decode plans and device health.
+        """
+        key2meter = {}
+        for energy_meter in energy_meters:
+            assert energy_meter.bus == self.bus, f'{energy_meter=} is not on {self.bus}'
+            key = (energy_meter.bus, energy_meter.device_id)
+            key2meter[key] = (energy_meter, energy_meter.get_definitions())
+
+        for key, (energy_meter, definitions) in self.key2meter.items():
+            if key2meter.get(key) != (energy_meter, definitions):
+                logger.info('Remove %s (device id: %i) from the schedule', self.bus, energy_meter.device_id)
+                self.scheduler.remove(energy_meter)
+                self.decode_plans.remove(energy_meter)
+                self.device_health.remove(energy_meter)
+                self.validators.remove(energy_meter)
+                LAST_VALUES.remove(energy_meter)
+
+        for key, (energy_meter, definitions) in key2meter.items():
+            if self.key2meter.get(key) != (energy_meter, definitions):
+                logger.info('Add %s (device id: %i) to the schedule', self.bus, energy_meter.device_id)
+                self.scheduler.add(energy_meter, definitions['parameters'], now=now)
+
+        self.key2meter = key2meter
+        self.energy_meters = energy_meters
+
+    def poll(self, jobs: list[PollJob]):
+        start = time.perf_counter()
+        for energy_meter, energy_meter_jobs in group_by_energy_meter(jobs):
+            device_health = self.device_health.get(energy_meter)
+            if device_health is not None:
+                if not device_health.is_available(now=time.monotonic()):
+                    logger.debug('Skip failing %s (device id: %i)', self.bus, energy_meter.device_id)
+                    continue
+                device_health.configure_client(self.client)
+
+            decode_plan = self.decode_plans.get(energy_meter=energy_meter, jobs=energy_meter_jobs)
+            raw_registers = {}
+            try:
+                register2values = read_values(
+                    client=self.client,
+                    decode_plan=decode_plan,
+                    device_id=energy_meter.device_id,
+                    bus=self.bus,
+                    device_health=device_health,
+                    raw_registers=raw_registers,
+                )
+                self.validate(energy_meter, register2values, raw_registers=raw_registers)
+            except Exception as err:
+                logger.exception('Error collect values from %s: %s', self.bus, err)
+                register2values = {}
+            else:
+                LAST_VALUES.update(energy_meter, register2values)
+                self.update_register_cache(energy_meter, register2values, raw_registers=raw_registers)
+                self.result_queue.put((energy_meter, register2values))
+            if device_health is not None:
+                update_device_health(energy_meter, device_health=device_health, register2values=register2values)
+        POLL_CYCLE_SECONDS.observe(time.perf_counter() - start, self.bus)
+
+    def validate(self, energy_meter: EnergyMeter, register2values: dict, *, raw_registers: dict):
+        """
+        Remove implausible values. They are read once again, because most of them are glitches or torn reads.
+        """
+        validator = self.validators.get(energy_meter)
+        if rejected := validator.validate(register2values, now=time.monotonic()):
+            values = read_values(
+                client=self.client,
+                decode_plan=validator.get_decode_plan(rejected),
+                device_id=energy_meter.device_id,
+                bus=self.bus,
+                raw_registers=raw_registers,
+            )
+            validator.validate(values, now=time.monotonic())
+            register2values.update(values)
+
+    def update_register_cache(self, energy_meter: EnergyMeter, register2values: dict, *, raw_registers: dict):
+        """
+        Only the registers of accepted values are served by the Modbus gateway.
+        """
+        if self.register_cache is None:
+            return
+        for register in register2values:
+            self.register_cache.update(
+                bus=self.bus, device_id=energy_meter.device_id, address=register, registers=raw_registers[register]
+            )
+
+    def run(self):
+        logger.info('Start polling %i energy meters on %s', len(self.energy_meters), self.bus)
+        now = time.monotonic()
+        self.apply_energy_meters(self.energy_meters, now=now)
+
+        next_stats_log = now + STATS_LOG_INTERVAL
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            while not self.reload_queue.empty():
+                self.apply_energy_meters(self.reload_queue.get(), now=now)
+            self.handle_requests()
+            if jobs := self.scheduler.pop_due(now=now):
+                self.poll(jobs)
+            if now >= next_stats_log:
+                self.scheduler.log_stats()
+                next_stats_log = now + STATS_LOG_INTERVAL
+            if (next_due := self.scheduler.next_due()) is None:
+                timeout = None  # Wait for a reload, a gateway request or the stop
+            else:
+                timeout = max(next_due - time.monotonic(), 0)
+            self.wakeup_event.wait(timeout)
+            self.wakeup_event.clear()
+        logger.info('Polling %s stopped', self.bus)
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup_event.set()
+
+
+def start_bus_workers(
+    *,
+    bus2client: dict,
+    energy_meters: list[EnergyMeter],
+    result_queue: queue.Queue,
+    adaptive_timeout: AdaptiveTimeoutSettings | None = None,
+    register_cache: RegisterCache | None = None,
+):
+    workers = []
+    for bus, client in bus2client.items():
+        worker = BusWorker(
+            bus=bus,
+            client=client,
+            energy_meters=[energy_meter for energy_meter in energy_meters if energy_meter.bus == bus],
+            result_queue=result_queue,
+            adaptive_timeout=adaptive_timeout,
+            register_cache=register_cache,
+        )
+        worker.start()
+        workers.append(worker)
+    return workers
@@ -1,27 +1,28 @@
+import dataclasses
 import logging
+import time
+from pathlib import Path
 from pprint import pp
 from typing import Annotated
 
 import tyro
 from cli_base.cli_tools.verbosity import setup_logging
 from cli_base.tyro_commands import TyroVerbosityArgType
-from pymodbus.exceptions import ModbusIOException
-from pymodbus.pdu import ExceptionResponse
-from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
 from rich import (
     get_console,  # noqa
     print,  # noqa; noqa
 )
 from rich.pretty import pprint
 
-from energymeter2mqtt.api import get_modbus_client
 from energymeter2mqtt.cli_app import app
-from energymeter2mqtt.probe_usb_ports import print_parameter_values, probe_one_port
-from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, get_user_settings
+from energymeter2mqtt.constants import MAX_DEVICE_ID
+from energymeter2mqtt.user_settings import TRANSPORT_SERIAL, EnergyMeter, UserSettings, get_user_settings
 
 
 logger = logging.getLogger(__name__)
 
+# pymodbus etc. are imported in the commands, to keep the startup of all other commands fast.
+
 
 TyroMaxPortArgType = Annotated[
     int,
@@ -47,27 +48,105 @@ def _get_energy_meter(verbosity: int) -> EnergyMeter:
 
 @app.command
 def probe_usb_ports(
-    verbosity: TyroVerbosityArgType, max_port: TyroMaxPortArgType, port_template: TyroPortTemplateArgType
+    verbosity: TyroVerbosityArgType,
+    max_port: TyroMaxPortArgType,
+    port_template: TyroPortTemplateArgType,
+    timeout: float = 0.3,
 ):
     """
-    Probe through the USB ports and print the values from definition
+    Probe through the USB ports and print the values from definition.
+    The serial settings (baud rate, parity, stop bits) are detected on all ports in parallel
+    and cached for the next starts.
     """
+    from energymeter2mqtt.probe_usb_ports import probe_one_port
+    from energymeter2mqtt.serial_detect import detect_ports
+
     setup_logging(verbosity=verbosity)
 
     energy_meter: EnergyMeter = _get_energy_meter(verbosity)
     definitions = energy_meter.get_definitions()
 
-    for port_number in range(0, max_port):
-        port = port_template.format(i=port_number)
-        print(f'Probe port: {port}...')
-
-        energy_meter.port = port
+    ports = [port_template.format(i=port_number) for port_number in range(0, max_port)]
+    ports = [port for port in ports if Path(port).exists()]
+    print(f'Probe ports: {", ".join(ports) or "-"}...')
+
+    port2connection = detect_ports(
+        ports=ports,
+        name=energy_meter.name,
+        definitions=definitions,
+        device_id=energy_meter.device_id,
+        timeout=timeout,
+    )
+    for port, connection in port2connection.items():
+        if connection is None:
+            print(f'[red]{port}: No response from device id {energy_meter.device_id}')
+            continue
+
+        print(f'[green]{port}: {connection}')
         try:
-            probe_one_port(energy_meter, definitions, verbosity)
+            probe_one_port(
+                dataclasses.replace(energy_meter, transport=TRANSPORT_SERIAL, port=port),
+                {**definitions, 'connection': connection},
+                verbosity,
+            )
         except Exception as err:
             print(f'ERROR: {err}')
 
 
+@app.command
+def scan_bus(
+    verbosity: TyroVerbosityArgType,
+    ports: tuple[str, ...] = (),
+    first_device_id: int = 1,
+    last_device_id: int = MAX_DEVICE_ID,
+    max_register: int = 1000,
+    timeout: float = 0.1,
+    registers: bool = True,
+):
+    """
+    Discover the responding device ids and their readable holding registers.
+    Scans the serial "--ports" or the buses of all configured energy meters, all buses in parallel.
+    """
+    from rich.table import Table
+
+    from energymeter2mqtt.api import group_by_bus
+    from energymeter2mqtt.bus_scan import scan_buses
+
+    setup_logging(verbosity=verbosity)
+
+    user_settings: UserSettings = get_user_settings(verbosity)
+    if ports:
+        energy_meters = [
+            dataclasses.replace(user_settings.energy_meter, transport=TRANSPORT_SERIAL, port=port) for port in ports
+        ]
+    else:
+        energy_meters = [meters[0] for meters in group_by_bus(user_settings.get_energy_meters()).values()]
+
+    print(f'Scan device ids {first_device_id}-{last_device_id} on {len(energy_meters)} bus(es)...')
+    start_time = time.monotonic()
+    results = scan_buses(
+        energy_meters,
+        device_ids=range(first_device_id, last_device_id + 1),
+        max_register=max_register,
+        timeout=timeout,
+        scan_registers=registers,
+    )
+
+    table = Table(title=f'Scan results ({time.monotonic() - start_time:.1f} sec.)')
+    table.add_column('Bus')
+    table.add_column('Device id')
+    table.add_column('Readable registers (dez)')
+    for result in results:
+        if result.error:
+            table.add_row(result.bus, '-', f'[red]Error: {result.error}')
+        elif not result.device_id2ranges:
+            table.add_row(result.bus, '-', '[yellow]No device found')
+        for device_id, ranges in result.device_id2ranges.items():
+            ranges_info = ', '.join(f'{address}-{address + count - 1}' for address, count in ranges)
+            table.add_row(result.bus, str(device_id), ranges_info or '-')
+    print(table)
+
+
 @app.command
 def print_definitions(verbosity: TyroVerbosityArgType):
     """
@@ -85,6 +164,9 @@ def print_values(verbosity: TyroVerbosityArgType):
     """
     Print all values from the definition in endless loop
     """
+    from energymeter2mqtt.api import get_modbus_client
+    from energymeter2mqtt.probe_usb_ports import print_parameter_values
+
     setup_logging(verbosity=verbosity)
 
     energy_meter: EnergyMeter = _get_energy_meter(verbosity)
@@ -100,7 +182,7 @@ def print_values(verbosity: TyroVerbosityArgType):
     print(f'{device_id=}')
 
     while True:
-        print_parameter_values(client, parameters, device_id, verbosity)
+        print_parameter_values(client, parameters, device_id, verbosity, max_gap=energy_meter.max_read_gap)
 
 
 @app.command
@@ -108,6 +190,12 @@ def print_registers(verbosity: TyroVerbosityArgType):
     """
     Print RAW modbus register data
     """
+    from pymodbus.exceptions import ModbusIOException
+    from pymodbus.pdu import ExceptionResponse
+    from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+    from energymeter2mqtt.api import get_modbus_client
+
     setup_logging(verbosity=verbosity)
 
     energy_meter: EnergyMeter = _get_energy_meter(verbosity)
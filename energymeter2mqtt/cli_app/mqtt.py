@@ -1,5 +1,7 @@
 import logging
+from typing import Annotated
 
+import tyro
 from cli_base.cli_tools.verbosity import setup_logging
 from cli_base.tyro_commands import TyroVerbosityArgType
 from rich import (
@@ -7,16 +9,50 @@ from rich import (
     )
 
 from energymeter2mqtt.cli_app import app
-from energymeter2mqtt.mqtt_publish import publish_forever
 
 
 logger = logging.getLogger(__name__)
 
+# pymodbus etc. are imported in the commands, to keep the startup of all other commands fast.
+
+
+TyroAsyncArgType = Annotated[
+    bool,
+    tyro.conf.arg(
+        name='async',
+        help='Poll the energy meters with the pymodbus async clients in one asyncio event loop',
+    ),
+]
+
+
+TyroWorkersArgType = Annotated[
+    int,
+    tyro.conf.arg(
+        help='Distribute the buses to X worker processes (Each one has its own MQTT connection)',
+    ),
+]
+
 
 @app.command
-def publish_loop(verbosity: TyroVerbosityArgType):
+def publish_loop(
+    verbosity: TyroVerbosityArgType,
+    use_async: TyroAsyncArgType = False,
+    workers: TyroWorkersArgType = 1,
+):
     """
     Publish all values via MQTT to Home Assistant in a endless loop.
     """
     setup_logging(verbosity=verbosity)
-    publish_forever(verbosity=verbosity)
+    if workers > 1:
+        assert not use_async, '--workers is not supported with --async'
+        from energymeter2mqtt.mqtt_publish import publish_sharded_forever
+
+        publish_sharded_forever(verbosity=verbosity, workers=workers)
+    elif use_async:
+        from energymeter2mqtt.async_publish import async_publish_forever
+
+        async_publish_forever(verbosity=verbosity)
+    else:
+        from energymeter2mqtt.mqtt_publish import publish_forever
+
+        publish_forever(verbosity=verbosity)
@@ -0,0 +1,67 @@
+import dataclasses
+import json
+import logging
+import sys
+import tempfile
+from pathlib import Path
+
+from cli_base.cli_tools.subprocess_utils import verbose_check_call
+from cli_base.cli_tools.verbosity import setup_logging
+from cli_base.tyro_commands import TyroVerbosityArgType
+from rich import print  # noqa
+from rich.pretty import pprint
+
+from energymeter2mqtt.benchmark import BenchmarkSettings
+from energymeter2mqtt.cli_dev import app
+
+
+logger = logging.getLogger(__name__)
+
+
+@app.command
+def benchmark(
+    verbosity: TyroVerbosityArgType,
+    name: str = 'saia_pcd_ald1d5fd',
+    device_count: int = 1,
+    transport: str = 'tcp',
+    duration: float = 10.0,
+    latency: float = 0.0,
+    baudrate: int = 0,
+    max_read_gap: int = 0,
+    output: str = '',
+):
+    """
+    Benchmark the poll -> decode -> publish pipeline against simulated energy meters and a stand-in MQTT broker.
+    Store the results as JSON via "--output", to compare them across versions.
+    """
+    setup_logging(verbosity=verbosity)
+
+    settings = BenchmarkSettings(
+        name=name,
+        device_count=device_count,
+        transport=transport,
+        duration=duration,
+        latency=latency,
+        baudrate=baudrate,
+        max_read_gap=max_read_gap,
+    )
+    print(f'Run benchmark for {duration} seconds...')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results_path = Path(temp_dir) / 'results.json'
+        # Run in a new process without the typeguard import hook of the dev CLI:
+        verbose_check_call(
+            sys.executable,
+            '-m',
+            'energymeter2mqtt.benchmark',
+            json.dumps(dataclasses.asdict(settings)),
+            str(results_path),
+            verbose=verbosity > 0,
+            exit_on_error=True,
+        )
+        results = json.loads(results_path.read_text(encoding='UTF-8'))
+    pprint(results)
+
+    if output:
+        output_path = Path(output)
+        output_path.write_text(json.dumps(results, indent=4, sort_keys=True) + '\n', encoding='UTF-8')
+        print(f'Results written to: {output_path}')
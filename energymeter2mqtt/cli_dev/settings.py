@@ -13,7 +13,7 @@ from tomlkit import TOMLDocument
 
 from energymeter2mqtt.cli_dev import app
 from energymeter2mqtt.constants import SETTINGS_DIR_NAME, SETTINGS_FILE_NAME
-from energymeter2mqtt.user_settings import UserSettings
+from energymeter2mqtt.user_settings import BaseUserSettings
 
 
 logger = logging.getLogger(__name__)
@@ -28,7 +28,7 @@ def create_default_settings(force: bool = False):
         print('We are not running in CI pipeline and "--force" not used -> Abort.')
         sys.exit(-1)
 
-    settings_dataclass = UserSettings()
+    settings_dataclass = BaseUserSettings()
     toml_settings = TomlSettings(
         dir_name=SETTINGS_DIR_NAME,
         file_name=SETTINGS_FILE_NAME,
@@ -0,0 +1,53 @@
+import logging
+import time
+
+from cli_base.cli_tools.verbosity import setup_logging
+from cli_base.tyro_commands import TyroVerbosityArgType
+from rich import print  # noqa
+
+from energymeter2mqtt.cli_dev import app
+from energymeter2mqtt.simulator import SimulatedBus, SimulatorThread, get_simulator_context
+from energymeter2mqtt.user_settings import parse_definition
+
+
+logger = logging.getLogger(__name__)
+
+
+@app.command
+def simulate_meter(
+    verbosity: TyroVerbosityArgType,
+    name: str = 'saia_pcd_ald1d5fd',
+    device_count: int = 1,
+    transport: str = 'rtu-over-tcp',
+    host: str = '127.0.0.1',
+    port: int = 5020,
+    latency: float = 0.0,
+    baudrate: int = 0,
+    error_rate: float = 0.0,
+    no_response_rate: float = 0.0,
+):
+    """
+    Run simulated energy meters (device ids 1..N) via Modbus TCP or RTU-over-TCP, for tests without hardware.
+    The registers are served from "energymeter2mqtt/definitions/<name>.toml".
+    """
+    setup_logging(verbosity=verbosity)
+
+    bus = SimulatedBus(
+        latency=latency,
+        baudrate=baudrate,
+        error_rate=error_rate,
+        no_response_rate=no_response_rate,
+    )
+    context = get_simulator_context(
+        definitions=parse_definition(name),
+        device_ids=range(1, device_count + 1),
+        bus=bus,
+    )
+    with SimulatorThread(context=context, transport=transport, host=host, port=port) as simulator:
+        print(f'Simulate {device_count} x {name!r} via {transport} on {host}:{simulator.port} (Abort with Ctrl-C)')
+        try:
+            while True:
+                time.sleep(10)
+                print(f'{bus.requests} requests, {bus.errors} injected errors')
+        except KeyboardInterrupt:
+            print('Bye')
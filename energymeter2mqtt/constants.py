@@ -5,6 +5,8 @@ import energymeter2mqtt
 
 CLI_EPILOG = 'Project Homepage: https://github.com/jedie/energymeter2mqtt'
 
+MAX_DEVICE_ID = 247  # Highest Modbus device id, 248-255 are reserved
+
 SETTINGS_DIR_NAME = 'energymeter2mqtt'
 SETTINGS_FILE_NAME = 'energymeter2mqtt'
 
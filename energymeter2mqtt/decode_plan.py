@@ -0,0 +1,190 @@
+import struct
+from decimal import Decimal
+
+from energymeter2mqtt.read_plan import get_register_count, plan_reads
+
+
+# data type -> (struct format, register count)
+DATA_TYPES = {
+    'uint16': ('H', 1),
+    'int16': ('h', 1),
+    'uint32': ('I', 2),
+    'int32': ('i', 2),
+    'float32': ('f', 2),
+    'uint64': ('Q', 4),
+    'int64': ('q', 4),
+    'float64': ('d', 4),
+}
+DEFAULT_DATA_TYPES = {1: 'uint16', 2: 'uint32', 4: 'uint64'}
+
+# The low word comes first in the registers of the Saia meters, so "little" is the default:
+DEFAULT_WORD_ORDER = 'little'
+DEFAULT_BYTE_ORDER = 'big'
+ORDERS = ('big', 'little')
+
+
+class RegisterDecoder:
+    """
+    Decode the value of one parameter from the registers of a block read.
+    Compiled once from the parameter definition, so decoding needs no dict lookups.
+
+    >>> RegisterDecoder({'register': 28, 'reg_count': 2, 'scale': 0.01}, offset=0).decode([1, 1])
+    655.37
+    >>> RegisterDecoder({'register': 1, 'data_type': 'int16'}, offset=1).decode([0, 0xFFFE])
+    -2
+    >>> parameter = {'register': 1, 'reg_count': 2, 'data_type': 'float32', 'word_order': 'big'}
+    >>> RegisterDecoder(parameter, offset=0).decode([0x4366, 0x199A])
+    230.10000610351562
+    """
+
+    __slots__ = (
+        'register',
+        'offset',
+        'count',
+        'scale',
+        'ndigits',
+        'is_float',
+        'reverse_words',
+        'words_struct',
+        'value_struct',
+    )
+
+    def __init__(self, parameter: dict, *, offset: int):
+        self.register = parameter['register']
+        self.offset = offset
+        self.count = get_register_count(parameter)
+
+        data_type = parameter.get('data_type') or DEFAULT_DATA_TYPES.get(self.count)
+        assert data_type in DATA_TYPES, f'Unsupported data_type {data_type!r} in {parameter=}'
+        value_format, count = DATA_TYPES[data_type]
+        assert count == self.count, f'data_type {data_type!r} needs reg_count={count} in {parameter=}'
+
+        word_order = parameter.get('word_order', DEFAULT_WORD_ORDER)
+        byte_order = parameter.get('byte_order', DEFAULT_BYTE_ORDER)
+        assert word_order in ORDERS, f'Invalid word_order in {parameter=}'
+        assert byte_order in ORDERS, f'Invalid byte_order in {parameter=}'
+
+        if data_type == 'uint16' and byte_order == 'big':
+            # Fast path: The register value is already the result
+            self.words_struct = None
+            self.value_struct = None
+        else:
+            self.words_struct = struct.Struct(f'{">" if byte_order == "big" else "<"}{self.count}H')
+            self.value_struct = struct.Struct(f'>{value_format}')
+        self.reverse_words = word_order == 'little' and self.count > 1
+        self.is_float = value_format in 'fd'
+
+        if scale := parameter.get('scale'):
+            self.scale = float(scale)
+            if self.is_float:
+                self.ndigits = None
+            else:
+                # Round away the floating point noise, e.g.: 12 * 0.1 -> 1.2 and not 1.2000000000000002
+                self.ndigits = max(-Decimal(str(scale)).as_tuple().exponent, 0)
+        else:
+            self.scale = None
+            self.ndigits = None
+
+    def decode(self, registers: list):
+        if self.words_struct is None:
+            value = registers[self.offset]
+        else:
+            words = registers[self.offset : self.offset + self.count]
+            if self.reverse_words:
+                words = words[::-1]
+            value = self.value_struct.unpack(self.words_struct.pack(*words))[0]
+
+        if self.scale is not None:
+            value *= self.scale
+            if self.ndigits is not None:
+                value = round(value, self.ndigits)
+        return value
+
+    def encode(self, value) -> list[int]:
+        """
+        The reverse of decode(), e.g.: for simulated energy meters.
+
+        >>> decoder = RegisterDecoder({'register': 28, 'reg_count': 2, 'scale': 0.01}, offset=0)
+        >>> decoder.encode(655.37)
+        [1, 1]
+        """
+        if self.scale is not None:
+            value /= self.scale
+        if not self.is_float:
+            value = round(value)
+        if self.words_struct is None:
+            return [value]
+
+        words = list(self.words_struct.unpack(self.value_struct.pack(value)))
+        if self.reverse_words:
+            words.reverse()
+        return words
+
+
+class DecodeBlock:
+    """
+    One Modbus read request and the decoders of all parameters in it.
+    """
+
+    __slots__ = ('address', 'count', 'decoders')
+
+    def __init__(self, *, address: int, count: int, decoders: tuple):
+        self.address = address
+        self.count = count
+        self.decoders = decoders
+
+    def decode(self, registers: list) -> dict:
+        return {decoder.register: decoder.decode(registers) for decoder in self.decoders}
+
+
+def compile_decode_plan(parameters: list, *, max_gap: int = 0) -> tuple[DecodeBlock, ...]:
+    """
+    Compile the parameter definitions into the read requests and the decoders.
+
+    >>> parameters = [{'register': 28, 'reg_count': 2, 'scale': 0.01}, {'register': 30, 'data_type': 'int16'}]
+    >>> decode_plan = compile_decode_plan(parameters)
+    >>> [(block.address, block.count) for block in decode_plan]
+    [(28, 3)]
+    >>> decode_plan[0].decode([2, 0, 0xFFFF])
+    {28: 0.02, 30: -1}
+    """
+    return tuple(
+        DecodeBlock(
+            address=block.address,
+            count=block.count,
+            decoders=tuple(
+                RegisterDecoder(parameter, offset=parameter['register'] - block.address)
+                for parameter in block.parameters
+            ),
+        )
+        for block in plan_reads(parameters, max_gap=max_gap)
+    )
+
+
+class DecodePlanCache:
+    """
+    The due parameters of an energy meter change with the poll intervals, but only
+    a few combinations exist. Compile the decode plan once per combination of PollJobs.
+    """
+
+    def __init__(self):
+        self._plans = {}
+
+    def get(self, *, energy_meter, jobs: list) -> tuple[DecodeBlock, ...]:
+        # The PollJob objects live as long as the scheduler, so their id() is a stable key:
+        key = (energy_meter.bus, energy_meter.device_id, tuple(id(job) for job in jobs))
+        try:
+            return self._plans[key]
+        except KeyError:
+            parameters = [parameter for job in jobs for parameter in job.parameters]
+            decode_plan = compile_decode_plan(parameters, max_gap=energy_meter.max_read_gap)
+            self._plans[key] = decode_plan
+            return decode_plan
+
+    def remove(self, energy_meter):
+        """
+        Forget the plans of the energy meter, because the id() of removed PollJobs can be reused.
+        """
+        for key in list(self._plans):
+            if key[:2] == (energy_meter.bus, energy_meter.device_id):
+                del self._plans[key]
@@ -0,0 +1,145 @@
+import collections
+import logging
+import statistics
+import time
+
+import backoff
+
+from energymeter2mqtt.metrics import MODBUS_TIMEOUT_SECONDS
+from energymeter2mqtt.user_settings import AdaptiveTimeoutSettings, EnergyMeter
+
+
+logger = logging.getLogger(__name__)
+
+
+def set_client_timeout(client, *, timeout: float, retries: int):
+    """
+    Change the response timeout and the retries of a sync or async pymodbus client,
+    before the requests to one energy meter.
+    """
+    client.comm_params.timeout_connect = timeout
+    transaction = client.transaction if hasattr(client, 'transaction') else client.ctx
+    transaction.comm_params.timeout_connect = timeout
+    transaction.retries = retries
+
+
+class DeviceHealth:
+    """
+    Response time statistics and circuit breaker of one energy meter.
+
+    The timeout is derived from the observed response times: p99 x factor,
+    but not lower than "min_timeout" and not higher than the configured "timeout".
+    After "failure_threshold" failed reads in a row, the energy meter is skipped
+    for an exponential growing time. Then one read without retries is tried.
+
+    >>> energy_meter = EnergyMeter(timeout=0.5, retries=3)
+    >>> health = DeviceHealth(energy_meter, AdaptiveTimeoutSettings(min_samples=3))
+    >>> health.get_timeout(), health.get_retries()
+    (0.5, 3)
+    >>> for seconds in (0.02, 0.03, 0.025):
+    ...     health.add_response_time(seconds)
+    >>> health.get_timeout()
+    0.09
+    >>> health.failed(now=100), health.failed(now=101), health.failed(now=102)
+    (None, None, 1)
+    >>> health.is_available(now=102.5), health.is_available(now=103), health.get_retries()
+    (False, True, 0)
+    >>> health.failed(now=103)
+    2
+    >>> health.is_available(now=104), health.is_available(now=105)
+    (False, True)
+    >>> health.succeeded()
+    >>> health.is_available(now=105), health.get_retries()
+    (True, 3)
+    """
+
+    def __init__(self, energy_meter: EnergyMeter, settings: AdaptiveTimeoutSettings):
+        self.energy_meter = energy_meter
+        self.settings = settings
+        self.response_times = collections.deque(maxlen=settings.window)
+
+        self.failures = 0  # Failed reads in a row
+        self.skip_until = 0
+        self.backoff_delays = None
+
+    def add_response_time(self, seconds: float):
+        self.response_times.append(seconds)
+
+    def get_timeout(self) -> float:
+        if len(self.response_times) < self.settings.min_samples:
+            return self.energy_meter.timeout
+        p99 = statistics.quantiles(self.response_times, n=100, method='inclusive')[98]
+        timeout = max(p99 * self.settings.factor, self.settings.min_timeout)
+        return round(min(timeout, self.energy_meter.timeout), 3)
+
+    def get_retries(self) -> int:
+        if self.backoff_delays is not None:
+            # Don't waste bus time with retries of a energy meter that didn't respond in the last reads
+            return 0
+        return self.energy_meter.retries
+
+    def is_available(self, *, now: float) -> bool:
+        return now >= self.skip_until
+
+    def configure_client(self, client):
+        timeout = self.get_timeout()
+        set_client_timeout(client, timeout=timeout, retries=self.get_retries())
+        MODBUS_TIMEOUT_SECONDS.set(timeout, self.energy_meter.bus, self.energy_meter.device_id)
+
+    def succeeded(self):
+        self.failures = 0
+        self.skip_until = 0
+        self.backoff_delays = None
+
+    def failed(self, *, now: float) -> float | None:
+        """
+        Count a failed read. Returns the seconds the energy meter will be skipped, if any.
+        """
+        self.failures += 1
+        if self.failures < self.settings.failure_threshold:
+            return None
+
+        if self.backoff_delays is None:
+            self.backoff_delays = backoff.expo(max_value=self.settings.max_backoff)
+            next(self.backoff_delays)  # Advance the generator to the first delay
+        delay = next(self.backoff_delays)
+        self.skip_until = now + delay
+        return delay
+
+
+class DeviceHealthRegistry:
+    """
+    The DeviceHealth of all energy meters on one bus, created on demand.
+    """
+
+    def __init__(self, settings: AdaptiveTimeoutSettings | None):
+        self.settings = settings
+        self.device_id2health = {}
+
+    def get(self, energy_meter: EnergyMeter) -> DeviceHealth | None:
+        if self.settings is None or not self.settings.enabled:
+            return None
+        try:
+            return self.device_id2health[energy_meter.device_id]
+        except KeyError:
+            health = self.device_id2health[energy_meter.device_id] = DeviceHealth(energy_meter, self.settings)
+            return health
+
+    def remove(self, energy_meter: EnergyMeter):
+        self.device_id2health.pop(energy_meter.device_id, None)
+
+
+def update_device_health(energy_meter: EnergyMeter, *, device_health: DeviceHealth, register2values: dict):
+    """
+    A read without any value (no response or only error responses) counts as failure.
+    """
+    if register2values:
+        device_health.succeeded()
+    elif delay := device_health.failed(now=time.monotonic()):
+        logger.warning(
+            'Skip %s (device id: %i) for %s sec. after %i failed reads',
+            energy_meter.bus,
+            energy_meter.device_id,
+            delay,
+            device_health.failures,
+        )
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import threading
+
+from pymodbus import FramerType
+from pymodbus.constants import ExcCodes
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.datastore.context import ModbusBaseDeviceContext
+from pymodbus.exceptions import ModbusException, NoSuchIdException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.server import ModbusTcpServer
+
+from energymeter2mqtt.metrics import GATEWAY_REQUESTS
+from energymeter2mqtt.register_cache import RegisterCache
+from energymeter2mqtt.user_settings import GatewaySettings
+
+
+logger = logging.getLogger(__name__)
+
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+REQUEST_TIMEOUT = 10  # Max. seconds to wait for the bus worker
+
+
+def read_registers(client, *, device_id: int, func_code: int, address: int, count: int) -> list[int] | ExcCodes:
+    """
+    Send a read request of a gateway client to the bus. Called in the bus worker thread.
+    """
+    if func_code == READ_HOLDING_REGISTERS:
+        read = client.read_holding_registers
+    else:
+        read = client.read_input_registers
+    try:
+        response = read(address=address, count=count, device_id=device_id)
+    except ModbusException as err:
+        logger.info('Gateway request to device id %i: %s', device_id, err)
+        return ExcCodes.GATEWAY_NO_RESPONSE
+    if isinstance(response, ExceptionResponse):
+        return ExcCodes(response.exception_code)
+    if isinstance(response, ModbusException):
+        return ExcCodes.GATEWAY_NO_RESPONSE
+    return response.registers[:count]
+
+
+class ModbusGateway:
+    """
+    Answer read requests of other Modbus clients: From the register cache, if the registers are polled anyway,
+    otherwise via the bus worker, so the requests never overlap with the poll runs.
+    Requests for unknown device ids are send to the bus, if there is only one.
+    """
+
+    def __init__(self, *, bus2worker: dict, register_cache: RegisterCache, max_age: float):
+        self.bus2worker = bus2worker  # Updated on hot reload
+        self.register_cache = register_cache
+        self.max_age = max_age
+
+    def get_worker(self, device_id: int):
+        workers = list(self.bus2worker.values())
+        for worker in workers:
+            if any(worker_device_id == device_id for _, worker_device_id in worker.key2meter):
+                return worker
+        if len(workers) == 1:
+            return workers[0]
+        return None
+
+    async def read(self, *, device_id: int, func_code: int, address: int, count: int) -> list[int] | ExcCodes:
+        if func_code not in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            return ExcCodes.ILLEGAL_FUNCTION  # The energy meters are read-only
+        worker = self.get_worker(device_id)
+        if worker is None:
+            GATEWAY_REQUESTS.inc(device_id, 'unknown_device')
+            return ExcCodes.GATEWAY_PATH_UNAVAILABLE
+
+        if func_code == READ_HOLDING_REGISTERS:
+            registers = self.register_cache.get(
+                bus=worker.bus, device_id=device_id, address=address, count=count, max_age=self.max_age
+            )
+            if registers is not None:
+                GATEWAY_REQUESTS.inc(device_id, 'cache')
+                return registers
+
+        future = worker.forward(device_id=device_id, func_code=func_code, address=address, count=count)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=REQUEST_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            result = ExcCodes.GATEWAY_NO_RESPONSE
+        if isinstance(result, ExcCodes):
+            GATEWAY_REQUESTS.inc(device_id, 'error')
+            return result
+
+        GATEWAY_REQUESTS.inc(device_id, 'forwarded')
+        return result
+
+
+class GatewayDevice(ModbusBaseDeviceContext):
+    def __init__(self, *, gateway: ModbusGateway, device_id: int):
+        self.gateway = gateway
+        self.device_id = device_id
+
+    def reset(self):
+        pass
+
+    async def async_getValues(self, func_code: int, address: int, count: int = 1) -> list[int] | ExcCodes:
+        return await self.gateway.read(device_id=self.device_id, func_code=func_code, address=address, count=count)
+
+    def getValues(self, func_code: int, address: int, count: int = 1) -> list[int] | ExcCodes:
+        return ExcCodes.ILLEGAL_FUNCTION  # Only the async API is used by the pymodbus server
+
+    def setValues(self, func_code: int, address: int, values: list) -> ExcCodes:
+        return ExcCodes.ILLEGAL_FUNCTION  # Energy meters are read-only
+
+
+class GatewayContext(ModbusServerContext):
+    """
+    The device contexts are created on demand, because the energy meters may change on hot reload.
+    """
+
+    def __init__(self, gateway: ModbusGateway):
+        super().__init__(devices={}, single=False)
+        self.gateway = gateway
+
+    def __contains__(self, device_id):
+        return self.gateway.get_worker(device_id) is not None
+
+    def __getitem__(self, device_id):
+        if device_id not in self:
+            raise NoSuchIdException(f'Unknown {device_id=}')
+        return GatewayDevice(gateway=self.gateway, device_id=device_id)
+
+
+class GatewayThread(threading.Thread):
+    """
+    Run the Modbus TCP server of the gateway in a background thread, with its own event loop.
+    """
+
+    def __init__(self, *, gateway: ModbusGateway, host: str, port: int):
+        super().__init__(name=f'ModbusGateway {host}:{port}', daemon=True)
+        self.context = GatewayContext(gateway)
+        self.host = host
+        self.port = port  # 0 = use a free port
+
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self.started = threading.Event()
+
+    async def serve(self):
+        self.server = ModbusTcpServer(self.context, address=(self.host, self.port), framer=FramerType.SOCKET)
+        await self.server.serve_forever(background=True)
+        self.port = self.server.transport.sockets[0].getsockname()[1]
+        logger.info('Modbus gateway listen on %s:%i', self.host, self.port)
+        self.started.set()
+        await self.server.serving
+
+    def run(self):
+        self.loop.run_until_complete(self.serve())
+
+    def start(self):
+        super().start()
+        assert self.started.wait(timeout=10), 'Modbus gateway not started'
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.shutdown(), self.loop).result(timeout=10)
+        self.join(timeout=10)
+        self.loop.close()
+
+
+def start_gateway(*, settings: GatewaySettings, bus2worker: dict, register_cache: RegisterCache) -> GatewayThread:
+    gateway = ModbusGateway(bus2worker=bus2worker, register_cache=register_cache, max_age=settings.max_age)
+    thread = GatewayThread(gateway=gateway, host=settings.host, port=settings.port)
+    thread.start()
+    return thread
@@ -0,0 +1,161 @@
+import logging
+import queue
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+from energymeter2mqtt.api import get_modbus_client, group_by_bus
+from energymeter2mqtt.bus_worker import BusWorker
+from energymeter2mqtt.mqtt_handler import EnergyMeterMqttHandler
+from energymeter2mqtt.register_cache import RegisterCache
+from energymeter2mqtt.sharding import Shard
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, get_definition_path
+
+
+logger = logging.getLogger(__name__)
+
+
+RELOAD_CHECK_INTERVAL = 5  # Check the settings and definition files for changes every X seconds
+
+
+class FileWatcher:
+    """
+    Detect modified files by polling their modification time.
+    Works everywhere, without inotify, and the few stat() calls are cheap.
+    """
+
+    def __init__(self, paths: Iterable[Path]):
+        self.path2mtime = {}
+        self.set_paths(paths)
+
+    @staticmethod
+    def get_mtime(path: Path) -> int | None:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def set_paths(self, paths: Iterable[Path]):
+        """
+        Watch the given files. The already watched files keep their last seen modification time.
+        """
+        self.path2mtime = {path: self.path2mtime.get(path, self.get_mtime(path)) for path in paths}
+
+    def changed(self) -> list[Path]:
+        """
+        Returns all files that were modified, created or deleted since the last call.
+        """
+        changed = []
+        for path, last_mtime in self.path2mtime.items():
+            mtime = self.get_mtime(path)
+            if mtime != last_mtime:
+                self.path2mtime[path] = mtime
+                changed.append(path)
+        return changed
+
+
+def get_watched_paths(settings_path: Path, energy_meters: list[EnergyMeter]) -> list[Path]:
+    paths = [settings_path]
+    for energy_meter in energy_meters:
+        path = get_definition_path(energy_meter.name)
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+class SettingsReloader:
+    """
+    Apply changed settings and definitions to the running publish loop:
+    The bus workers reschedule only the changed energy meters and the MQTT handler
+    recreates only the changed sensors. The Modbus and MQTT connections stay open.
+    """
+
+    def __init__(
+        self,
+        *,
+        settings_path: Path,
+        load_settings: Callable[[], UserSettings],
+        user_settings: UserSettings,
+        energymeter_mqtt_handler: EnergyMeterMqttHandler,
+        bus2worker: dict[str, BusWorker],
+        result_queue: queue.Queue,
+        verbosity: int,
+        shard: Shard | None = None,
+        register_cache: RegisterCache | None = None,
+    ):
+        self.settings_path = settings_path
+        self.load_settings = load_settings
+        self.user_settings = user_settings
+        self.energymeter_mqtt_handler = energymeter_mqtt_handler
+        self.bus2worker = bus2worker
+        self.result_queue = result_queue
+        self.verbosity = verbosity
+        self.shard = shard  # Poll only the buses of this shard
+        self.register_cache = register_cache
+
+        self.watcher = FileWatcher(get_watched_paths(settings_path, user_settings.get_energy_meters()))
+        self.next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+
+    def check(self) -> bool:
+        """
+        Reload, if a watched file was modified. Returns True if the new settings were applied.
+        """
+        if time.monotonic() < self.next_check:
+            return False
+        self.next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+
+        if changed := self.watcher.changed():
+            logger.info('Modified: %s', ', '.join(str(path) for path in changed))
+            return self.reload()
+        return False
+
+    def reload(self) -> bool:
+        try:
+            user_settings = self.load_settings()
+            energy_meters = user_settings.get_energy_meters()
+            for energy_meter in energy_meters:
+                energy_meter.get_definitions()  # Validate all definitions, before anything is changed
+        except Exception as err:
+            logger.exception('Invalid settings or definitions, keep the current ones: %s', err)
+            return False
+
+        # Needs new connections or a new setup, so they can't be applied while running:
+        for section in ('mqtt', 'publish', 'value_buffer', 'adaptive_timeout', 'metrics', 'gateway'):
+            if getattr(user_settings, section) != getattr(self.user_settings, section):
+                logger.warning('Changed [%s] settings are applied after a restart', section)
+
+        self.energymeter_mqtt_handler.update_energy_meters(energy_meters)
+
+        if self.shard is not None:
+            # New buses are assigned to a shard after a restart
+            energy_meters = self.shard.get_energy_meters(energy_meters)
+        bus2energy_meters = group_by_bus(energy_meters)
+        for bus, worker in list(self.bus2worker.items()):
+            if bus not in bus2energy_meters:
+                logger.info('No energy meters left on %s: Stop polling', bus)
+                worker.stop()
+                worker.join()
+                worker.client.close()
+                del self.bus2worker[bus]
+
+        for bus, bus_energy_meters in bus2energy_meters.items():
+            if worker := self.bus2worker.get(bus):
+                worker.reload(bus_energy_meters)
+            else:
+                energy_meter = bus_energy_meters[0]
+                client = get_modbus_client(energy_meter, energy_meter.get_definitions(), self.verbosity)
+                worker = BusWorker(
+                    bus=bus,
+                    client=client,
+                    energy_meters=bus_energy_meters,
+                    result_queue=self.result_queue,
+                    adaptive_timeout=self.user_settings.adaptive_timeout,
+                    register_cache=self.register_cache,
+                )
+                worker.start()
+                self.bus2worker[bus] = worker
+
+        self.watcher.set_paths(get_watched_paths(self.settings_path, energy_meters))
+        self.user_settings = user_settings
+        logger.info('Settings reloaded: %i energy meters on %i buses', len(energy_meters), len(self.bus2worker))
+        return True
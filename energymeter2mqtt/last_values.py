@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+CONTENT_TYPE = 'application/json'
+STALE_AFTER = 3  # A value is "stale", if it's not updated in X poll intervals
+
+# Quality of a value:
+GOOD = 'good'
+STALE = 'stale'
+
+
+class LastValues:
+    """
+    Thread-safe table of the last read (and validated) values of all energy meters.
+    Updated by the bus workers, before the values are published,
+    so local consumers get them without touching the bus or the MQTT broker.
+
+    >>> last_values = LastValues()
+    >>> energy_meter = EnergyMeter(port='/dev/ttyUSB0', poll_interval=10)
+    >>> last_values.update(energy_meter, {35: 230, 999: 1}, now=1000.0)
+    >>> [row] = last_values.get_values(now=1020.0)
+    >>> row['register'], row['name'], row['value'], row['unit'], row['timestamp'], row['quality']
+    (35, 'Voltage', 230, 'V', 1000.0, 'good')
+    >>> last_values.get_values(now=1031.0)[0]['quality']
+    'stale'
+    >>> last_values.remove(energy_meter)
+    >>> last_values.get_values()
+    []
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key2parameters = {}  # {(bus, device_id): {register: parameter}}
+        self.key2values = {}  # {(bus, device_id): {register: (value, timestamp)}}
+        self.key2energy_meter = {}
+
+    def get_parameters(self, energy_meter: EnergyMeter) -> dict:
+        key = (energy_meter.bus, energy_meter.device_id)
+        try:
+            return self.key2parameters[key]
+        except KeyError:
+            parameters = self.key2parameters[key] = {
+                parameter['register']: parameter for parameter in energy_meter.get_definitions()['parameters']
+            }
+            return parameters
+
+    def update(self, energy_meter: EnergyMeter, register2values: dict, *, now: float | None = None):
+        if not register2values:
+            return
+        if now is None:
+            now = time.time()
+        key = (energy_meter.bus, energy_meter.device_id)
+        with self.lock:
+            parameters = self.get_parameters(energy_meter)
+            values = self.key2values.setdefault(key, {})
+            for register, value in register2values.items():
+                if register in parameters:
+                    values[register] = (value, now)
+            self.key2energy_meter[key] = energy_meter
+
+    def remove(self, energy_meter: EnergyMeter):
+        """
+        Forget a removed or changed energy meter, e.g.: after a hot reload.
+        """
+        key = (energy_meter.bus, energy_meter.device_id)
+        with self.lock:
+            self.key2parameters.pop(key, None)
+            self.key2values.pop(key, None)
+            self.key2energy_meter.pop(key, None)
+
+    def get_values(self, *, now: float | None = None) -> list[dict]:
+        if now is None:
+            now = time.time()
+        rows = []
+        with self.lock:
+            for key, values in sorted(self.key2values.items()):
+                bus, device_id = key
+                energy_meter = self.key2energy_meter[key]
+                parameters = self.key2parameters[key]
+                for register, (value, timestamp) in sorted(values.items()):
+                    parameter = parameters[register]
+                    interval = parameter.get('poll_interval', energy_meter.poll_interval)
+                    rows.append(
+                        {
+                            'bus': bus,
+                            'device_id': device_id,
+                            'register': register,
+                            'name': parameter['name'],
+                            'value': value,
+                            'unit': parameter.get('uom'),
+                            'timestamp': timestamp,
+                            'quality': GOOD if now - timestamp <= interval * STALE_AFTER else STALE,
+                        }
+                    )
+        return rows
+
+    def render(self) -> str:
+        return json.dumps(self.get_values(), separators=(',', ':'))
+
+
+LAST_VALUES = LastValues()
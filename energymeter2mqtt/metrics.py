@@ -0,0 +1,287 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from energymeter2mqtt import last_values
+
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = '') -> str:
+    """
+    >>> format_labels(('bus', 'device_id'), ('/dev/ttyUSB0', 1), extra='le="0.1"')
+    '{bus="/dev/ttyUSB0",device_id="1",le="0.1"}'
+    >>> format_labels(('name',), ('a "b"',))
+    '{name="a \\\\"b\\\\""}'
+    """
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+
+class Metric:
+    """
+    Base class of all metrics: Thread-safe values per combination of label values.
+    """
+
+    type_name = None
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.type_name}']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.extend(self.render_value(label_values, value))
+        return lines
+
+    def render_value(self, label_values: tuple, value) -> list[str]:
+        return [f'{self.name}{format_labels(self.label_names, label_values)} {value}']
+
+
+class Counter(Metric):
+    """
+    >>> counter = Counter('errors_total', 'Number of errors', label_names=('bus',))
+    >>> counter.inc('/dev/ttyUSB0')
+    >>> counter.inc('/dev/ttyUSB0', amount=2)
+    >>> counter.get('/dev/ttyUSB0')
+    3
+    >>> print('\\n'.join(counter.render()))
+    # HELP errors_total Number of errors
+    # TYPE errors_total counter
+    errors_total{bus="/dev/ttyUSB0"} 3
+    """
+
+    type_name = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def get(self, *label_values):
+        return self.values.get(label_values)
+
+
+class Histogram(Metric):
+    """
+    >>> histogram = Histogram('read_seconds', 'Read duration', buckets=(0.1, 1))
+    >>> histogram.observe(0.05)
+    >>> histogram.observe(0.5)
+    >>> print('\\n'.join(histogram.render()))
+    # HELP read_seconds Read duration
+    # TYPE read_seconds histogram
+    read_seconds_bucket{le="0.1"} 1
+    read_seconds_bucket{le="1"} 2
+    read_seconds_bucket{le="+Inf"} 2
+    read_seconds_sum 0.55
+    read_seconds_count 2
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            try:
+                data = self.values[label_values]
+            except KeyError:
+                # Counts per bucket, sum, count:
+                data = self.values[label_values] = [[0] * len(self.buckets), 0, 0]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    data[0][index] += 1
+                    break
+            data[1] += value
+            data[2] += 1
+
+    def render_value(self, label_values: tuple, value) -> list[str]:
+        bucket_counts, value_sum, count = value
+        lines = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            labels = format_labels(self.label_names, label_values, extra=f'le="{upper_bound}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = format_labels(self.label_names, label_values, extra='le="+Inf"')
+        lines.append(f'{self.name}_bucket{labels} {count}')
+        labels = format_labels(self.label_names, label_values)
+        lines.append(f'{self.name}_sum{labels} {round(value_sum, 6)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+MODBUS_READ_SECONDS = REGISTRY.register(
+    Histogram(
+        'energymeter2mqtt_modbus_read_seconds',
+        'Duration of Modbus block reads, by start register',
+        label_names=('bus', 'device_id', 'register'),
+    )
+)
+MODBUS_ERRORS = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_modbus_errors_total',
+        'Failed Modbus block reads: timeout (incl. CRC errors), exception response or incomplete response',
+        label_names=('bus', 'device_id', 'register', 'error'),
+    )
+)
+MODBUS_RETRIES = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_modbus_retries_total',
+        'Retries of successful Modbus requests',
+        label_names=('bus', 'device_id'),
+    )
+)
+MODBUS_TIMEOUT_SECONDS = REGISTRY.register(
+    Gauge(
+        'energymeter2mqtt_modbus_timeout_seconds',
+        'Current (adaptive) response timeout of the energy meter',
+        label_names=('bus', 'device_id'),
+    )
+)
+POLL_CYCLE_SECONDS = REGISTRY.register(
+    Histogram(
+        'energymeter2mqtt_poll_cycle_seconds',
+        'Duration of reading all due parameters of one bus',
+        label_names=('bus',),
+    )
+)
+POLL_OVERRUNS = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_poll_overruns_total',
+        'Skipped poll runs, because the bus was behind schedule',
+        label_names=('bus', 'device_id'),
+    )
+)
+VALUE_REJECTIONS = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_value_rejections_total',
+        'Implausible values that are not published, by reason (min_value, max_value, decrease, rate)',
+        label_names=('bus', 'device_id', 'register', 'reason'),
+    )
+)
+COUNTER_ROLLOVERS = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_counter_rollovers_total',
+        'Detected wrap arounds of monotonic counters',
+        label_names=('bus', 'device_id', 'register'),
+    )
+)
+MQTT_PUBLISH_SECONDS = REGISTRY.register(
+    Histogram(
+        'energymeter2mqtt_mqtt_publish_seconds',
+        'Duration of processing the values of one energy meter read for publishing',
+        label_names=('bus', 'device_id'),
+    )
+)
+MQTT_FLUSH_SECONDS = REGISTRY.register(
+    Histogram(
+        'energymeter2mqtt_mqtt_flush_seconds',
+        'Duration of publishing all collected MQTT messages of one poll cycle',
+    )
+)
+MQTT_INFLIGHT_MESSAGES = REGISTRY.register(
+    Gauge(
+        'energymeter2mqtt_mqtt_inflight_messages',
+        'Number of published MQTT messages, waiting for their completion',
+    )
+)
+PUBLISH_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        'energymeter2mqtt_publish_queue_depth',
+        'Number of energy meter reads, waiting to be published',
+    )
+)
+
+PUBLISH_QUEUE_DROPPED = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_publish_queue_dropped_total',
+        'Read values that are dropped or overwritten, because the publish queue was full',
+        label_names=('bus', 'device_id'),
+    )
+)
+GATEWAY_REQUESTS = REGISTRY.register(
+    Counter(
+        'energymeter2mqtt_gateway_requests_total',
+        'Read requests of Modbus gateway clients, by result (cache, forwarded, error, unknown_device)',
+        label_names=('device_id', 'result'),
+    )
+)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = REGISTRY.render()
+            content_type = CONTENT_TYPE
+        elif self.path == '/values':
+            body = last_values.LAST_VALUES.render()
+            content_type = last_values.CONTENT_TYPE
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+def start_metrics_server(*, host: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+    logger.info('Serve metrics on http://%s:%i/metrics', host, server.server_address[1])
+    logger.info('Serve last values on http://%s:%i/values', host, server.server_address[1])
+    return server
@@ -1,45 +1,59 @@
+import json
 import logging
+import time
 
 from ha_services.mqtt4homeassistant.components.sensor import Sensor
 from ha_services.mqtt4homeassistant.data_classes import MqttSettings
 from ha_services.mqtt4homeassistant.device import MainMqttDevice, MqttDevice
 from ha_services.mqtt4homeassistant.mqtt import get_connected_client
 from ha_services.mqtt4homeassistant.utilities.string_utils import slugify
+from paho.mqtt.client import Client
 
 import energymeter2mqtt
-from energymeter2mqtt.user_settings import EnergyMeter, UserSettings
+from energymeter2mqtt.aggregation import AGGREGATES, RunningAggregate
+from energymeter2mqtt.metrics import MQTT_PUBLISH_SECONDS
+from energymeter2mqtt.publish_batch import JsonStateSensor, PublishBatch
+from energymeter2mqtt.publish_filter import get_publish_filter
+from energymeter2mqtt.sharding import Shard
+from energymeter2mqtt.user_settings import EnergyMeter, PublishSettings, UserSettings, ValueBufferSettings
+from energymeter2mqtt.value_buffer import ValueBuffer
 
 
 logger = logging.getLogger(__name__)
 
 
-class EnergyMeterMqttHandler:
-    def __init__(self, user_settings: UserSettings, verbosity: int):
-        self.user_settings = user_settings
-        energy_meter: EnergyMeter = self.user_settings.energy_meter
+# The buffered values are removed only after the broker acknowledged them, so they need min. QoS 1:
+REPLAY_MIN_QOS = 1
 
-        mqtt_settings: MqttSettings = user_settings.mqtt
 
-        self.mqtt_client = get_connected_client(settings=mqtt_settings, verbosity=verbosity)
-        self.mqtt_client.loop_start()
+class EnergyMeterMqttDevice:
+    """
+    MQTT device with one sensor per register of one energy meter.
+    """
+
+    def __init__(
+        self,
+        *,
+        main_device: MainMqttDevice,
+        energy_meter: EnergyMeter,
+        uid: str,
+        name: str,
+        publish_settings: PublishSettings | None = None,
+    ):
+        self.energy_meter = energy_meter
+        self.publish_settings = publish_settings or PublishSettings()
 
-        self.main_device = MainMqttDevice(
-            name='energymeter2mqtt',
-            uid=mqtt_settings.main_uid,
-            manufacturer='energymeter2mqtt',
-            sw_version=energymeter2mqtt.__version__,
-            config_throttle_sec=mqtt_settings.publish_config_throttle_seconds,
-        )
         self.mqtt_device = MqttDevice(
-            main_device=self.main_device,
-            name=energy_meter.verbose_name,
-            uid=energy_meter.name,
+            main_device=main_device,
+            name=name,
+            uid=uid,
             manufacturer=energy_meter.manufacturer,
             sw_version=None,
-            config_throttle_sec=mqtt_settings.publish_config_throttle_seconds,
+            config_throttle_sec=main_device.config_throttle_sec,
         )
 
-        #################################################################################
+        self.uid = uid
+        self.name = name
 
         definitions: dict = energy_meter.get_definitions()
         # definitions = {'connection': {'baudrate': 19200, 'bytesize': 8, 'parity': 'N', 'stopbits': 2},
@@ -52,29 +66,341 @@ class EnergyMeterMqttHandler:
         #                              'scale': 0.01},
         #                             {...
 
+        self.register2parameter = {}
         self.register2sensor = {}
+        self.register2filter = {}
+        self.register2aggregate = {}
+        self.register2aggregate_sensors = {}
         for parameter in definitions['parameters']:
-            sensor = Sensor(
-                device=self.mqtt_device,
-                name=parameter['name'],
-                uid=slugify(parameter['name'].lower(), sep='_'),
-                device_class=parameter.get('class'),
-                state_class=parameter['state_class'],
-                unit_of_measurement=parameter['uom'],
-                suggested_display_precision=parameter.get('suggested_display_precision'),
-                min_value=parameter.get('min_value'),
-                max_value=parameter.get('max_value'),
-            )
-            self.register2sensor[parameter['register']] = sensor
+            self.add_parameter(parameter)
 
-    def __call__(self, register2values: dict):
-        logger.debug('Process: %r', register2values)
+    def add_parameter(self, parameter: dict):
+        register = parameter['register']
+        self.register2parameter[register] = parameter
 
-        self.main_device.poll_and_publish(self.mqtt_client)
+        uid = slugify(parameter['name'].lower(), sep='_')
+        self.register2sensor[register] = self.get_sensor(parameter, name=parameter['name'], uid=uid)
+        if publish_filter := get_publish_filter(parameter):
+            self.register2filter[register] = publish_filter
+
+        if aggregate_window := parameter.get('aggregate_window'):
+            # Publish only the aggregated values of each window, as extra sensors:
+            assert parameter['state_class'] == 'measurement', f'Only measurements can be aggregated: {parameter=}'
+            self.register2aggregate[register] = RunningAggregate(window=aggregate_window)
+            self.register2aggregate_sensors[register] = {
+                aggregate: self.get_sensor(
+                    parameter,
+                    name=f'{parameter["name"]} {verbose_name}',
+                    uid=f'{uid}_{aggregate}',
+                )
+                for aggregate, verbose_name in AGGREGATES.items()
+            }
 
+    def remove_parameter(self, register: int) -> list[Sensor]:
+        """
+        Remove the parameter and unregister its sensors from the MQTT device. Returns the removed sensors.
+        """
+        del self.register2parameter[register]
+        self.register2filter.pop(register, None)
+        self.register2aggregate.pop(register, None)
+        sensors = [self.register2sensor.pop(register)]
+        sensors += self.register2aggregate_sensors.pop(register, {}).values()
+        for sensor in sensors:
+            self.mqtt_device.components.pop(sensor.uid, None)
+        return sensors
+
+    def update(self, *, energy_meter: EnergyMeter, mqtt_client: Client) -> set[int]:
+        """
+        Apply changed definitions: Only the sensors of new or changed parameters are recreated,
+        unchanged sensors keep their publish filter and aggregate state.
+        Home Assistant entities of removed sensors are deleted by an empty discovery config.
+        Returns the registers of all changed parameters.
+        """
+        self.energy_meter = energy_meter
+        definitions: dict = energy_meter.get_definitions()
+        register2parameter = {parameter['register']: parameter for parameter in definitions['parameters']}
+
+        changed = {
+            register
+            for register in self.register2parameter.keys() | register2parameter.keys()
+            if self.register2parameter.get(register) != register2parameter.get(register)
+        }
+        removed_sensors = []
+        for register in sorted(changed & self.register2parameter.keys()):
+            removed_sensors += self.remove_parameter(register)
+        for register in sorted(changed & register2parameter.keys()):
+            self.add_parameter(register2parameter[register])
+
+        # Unchanged parameters may use the changed poll interval of the energy meter:
+        for register, parameter in self.register2parameter.items():
+            throttle_sec = self.get_throttle_sec(parameter)
+            sensors = [self.register2sensor[register], *self.register2aggregate_sensors.get(register, {}).values()]
+            for sensor in sensors:
+                sensor.throttle_sec = throttle_sec
+
+        for sensor in removed_sensors:
+            if sensor.uid not in self.mqtt_device.components:
+                self.remove_sensor_config(mqtt_client, sensor=sensor)
+        return changed
+
+    def remove(self, mqtt_client: Client):
+        """
+        Remove all sensors, because the energy meter is removed from the settings.
+        """
+        for register in list(self.register2parameter):
+            for sensor in self.remove_parameter(register):
+                self.remove_sensor_config(mqtt_client, sensor=sensor)
+
+    @staticmethod
+    def remove_sensor_config(mqtt_client: Client, *, sensor: Sensor):
+        logger.info('Remove sensor %r from Home Assistant', sensor.uid)
+        config = sensor.get_config()
+        mqtt_client.publish(topic=config.topic, payload='', qos=config.qos, retain=True)
+
+    def get_sensor(self, parameter: dict, *, name: str, uid: str) -> Sensor:
+        sensor_kwargs = dict(
+            device=self.mqtt_device,
+            name=name,
+            uid=uid,
+            device_class=parameter.get('class'),
+            state_class=parameter['state_class'],
+            unit_of_measurement=parameter['uom'],
+            suggested_display_precision=parameter.get('suggested_display_precision'),
+            min_value=parameter.get('min_value'),
+            max_value=parameter.get('max_value'),
+        )
+        if self.publish_settings.json_state:
+            sensor = JsonStateSensor(json_key=uid, **sensor_kwargs)
+        else:
+            sensor = Sensor(**sensor_kwargs)
+        sensor.qos = self.publish_settings.qos
+        sensor.retain = self.publish_settings.retain
+        sensor.throttle_sec = self.get_throttle_sec(parameter)
+        return sensor
+
+    def get_throttle_sec(self, parameter: dict) -> float:
+        """
+        Min. seconds between two published states of a sensor: The default of the MQTT device (1 sec.),
+        but max. the half poll interval, so the values of fast polled parameters are not dropped.
+        """
+        poll_interval = parameter.get('poll_interval', self.energy_meter.poll_interval)
+        return min(self.mqtt_device.throttle_sec, poll_interval / 2)
+
+    def publish(self, mqtt_client: Client | PublishBatch, register2values: dict):
+        now = time.monotonic()
         for register, value in register2values.items():
-            if sensor := self.register2sensor.get(register):
+            sensor = self.register2sensor.get(register)
+            if sensor is None:
+                logger.warning('No sensor found for register %i', register)
+                continue
+
+            if aggregate := self.register2aggregate.get(register):
+                if aggregates := aggregate.add(value, now=now):
+                    self.publish_aggregates(mqtt_client, register=register, aggregates=aggregates)
+                continue
+
+            publish_filter = self.register2filter.get(register)
+            if publish_filter is None:
+                sensor.set_state(value)
+                sensor.publish(mqtt_client)
+            elif publish_filter.should_publish(value, now=now):
                 sensor.set_state(value)
-                sensor.publish(self.mqtt_client)
+                config_info, state_info = sensor.publish(mqtt_client)
+                if state_info is not None:  # Not throttled
+                    publish_filter.published(value, now=now)
             else:
-                logger.warning('No sensor found for register %i', register)
+                # Unchanged value: Only keep the Home Assistant discovery config alive
+                sensor.publish_config(mqtt_client)
+
+    def get_replay_topic(self, register: int) -> str | None:
+        """
+        Buffered values are published with their read time to this topic, not as current state.
+        """
+        if sensor := self.register2sensor.get(register):
+            return f'{sensor.topic_prefix}/replay'
+
+    def publish_aggregates(self, mqtt_client: Client | PublishBatch, *, register: int, aggregates: dict):
+        sensor = self.register2sensor[register]
+        sensor.set_state(aggregates['last'])
+        sensor.publish(mqtt_client)
+        for aggregate, aggregate_sensor in self.register2aggregate_sensors[register].items():
+            aggregate_sensor.set_state(aggregates[aggregate])
+            aggregate_sensor.publish(mqtt_client)
+
+
+class EnergyMeterMqttHandler:
+    def __init__(self, user_settings: UserSettings, verbosity: int, shard: Shard | None = None):
+        self.user_settings = user_settings
+        self.shard = shard  # Publish only the energy meters of this shard
+        self.replay_after_id = 0  # Buffered values up to this id are skipped, because their sensor is unknown
+
+        mqtt_settings: MqttSettings = user_settings.mqtt
+
+        self.mqtt_client = get_connected_client(settings=mqtt_settings, verbosity=verbosity)
+        self.mqtt_client.loop_start()
+
+        self.main_device = MainMqttDevice(
+            name='energymeter2mqtt',
+            uid=mqtt_settings.main_uid,
+            manufacturer='energymeter2mqtt',
+            sw_version=energymeter2mqtt.__version__,
+            config_throttle_sec=mqtt_settings.publish_config_throttle_seconds,
+        )
+
+        #################################################################################
+
+        publish_settings: PublishSettings = user_settings.publish
+        self.publish_batch = PublishBatch(
+            self.mqtt_client,
+            max_inflight=publish_settings.max_inflight,
+            timeout=publish_settings.timeout,
+        )
+
+        self.meter_devices = {}
+        self.update_energy_meters(user_settings.get_energy_meters())
+
+        value_buffer_settings: ValueBufferSettings = user_settings.value_buffer
+        if value_buffer_settings.enabled:
+            self.value_buffer = ValueBuffer(
+                path=value_buffer_settings.get_path(),
+                max_rows=value_buffer_settings.max_rows,
+            )
+            self.replay_batch_size = value_buffer_settings.replay_batch_size
+        else:
+            self.value_buffer = None
+
+    def update_energy_meters(self, energy_meters: list[EnergyMeter]):
+        """
+        Create the MQTT devices of new energy meters, update the changed and remove the old ones.
+        """
+        self.replay_after_id = 0  # Skipped buffered values may belong to a new energy meter
+        key2device_info = {}
+        uids = set()
+        for energy_meter in energy_meters:
+            key = (energy_meter.bus, energy_meter.device_id)
+            assert key not in key2device_info, f'Duplicate energy meter: {key}'
+
+            uid = energy_meter.name
+            name = energy_meter.verbose_name
+            if uid in uids:
+                # More than one energy meter of the same type:
+                uid = f'{uid}_{energy_meter.device_id}'
+                name = f'{name} ({energy_meter.device_id})'
+            uids.add(uid)
+            if self.shard is not None and energy_meter.bus not in self.shard.buses:
+                # The uids depend on all energy meters, so they are the same in all worker processes
+                continue
+            key2device_info[key] = (energy_meter, uid, name)
+
+        for key, meter_device in list(self.meter_devices.items()):
+            device_info = key2device_info.get(key)
+            if device_info is None or device_info[1:] != (meter_device.uid, meter_device.name):
+                logger.info('Remove MQTT device %r', meter_device.uid)
+                meter_device.remove(self.mqtt_client)
+                del self.meter_devices[key]
+
+        for key, (energy_meter, uid, name) in key2device_info.items():
+            if meter_device := self.meter_devices.get(key):
+                if changed := meter_device.update(energy_meter=energy_meter, mqtt_client=self.mqtt_client):
+                    logger.info('MQTT device %r: %i parameters changed', uid, len(changed))
+            else:
+                self.meter_devices[key] = EnergyMeterMqttDevice(
+                    main_device=self.main_device,
+                    energy_meter=energy_meter,
+                    uid=uid,
+                    name=name,
+                    publish_settings=self.user_settings.publish,
+                )
+
+    def publish_main_device(self):
+        self.main_device.poll_and_publish(self.mqtt_client)
+
+    def __call__(self, energy_meter: EnergyMeter, register2values: dict):
+        self.collect(energy_meter, register2values)
+        self.flush()
+
+    def collect(self, energy_meter: EnergyMeter, register2values: dict):
+        """
+        Collect the MQTT messages of the read values. They are published by the next flush().
+        """
+        logger.debug('Process %s (device id: %i): %r', energy_meter.bus, energy_meter.device_id, register2values)
+
+        if self.value_buffer is not None:
+            if not self.mqtt_client.is_connected():
+                logger.warning('MQTT broker not connected: Store %i values in buffer', len(register2values))
+                self.value_buffer.store(
+                    bus=energy_meter.bus,
+                    device_id=energy_meter.device_id,
+                    timestamp=time.time(),
+                    register2values=register2values,
+                )
+                return
+            if not self.value_buffer.is_empty(after_id=self.replay_after_id):
+                self.replay_buffer()
+
+        meter_device = self.meter_devices.get((energy_meter.bus, energy_meter.device_id))
+        if meter_device is None:
+            # Values read before the energy meter was removed from the settings
+            logger.debug('Skip values of removed %s (device id: %i)', energy_meter.bus, energy_meter.device_id)
+            return
+        start = time.perf_counter()
+        meter_device.publish(self.publish_batch, register2values)
+        MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - start, energy_meter.bus, energy_meter.device_id)
+
+    def flush(self) -> int:
+        """
+        Publish all collected MQTT messages of the current poll cycle.
+        """
+        return self.publish_batch.flush()
+
+    def replay_buffer(self):
+        """
+        Publish one batch of buffered values: One message per sensor with a JSON list of the values
+        and their read time (unix timestamp), in the order they were read.
+        The values are removed from the buffer only after the broker acknowledged their message,
+        all other ones are published again by the next replay.
+        Values of unknown energy meters or registers (e.g.: removed from the settings) are kept, but skipped.
+        """
+        rows = self.value_buffer.get_batch(limit=self.replay_batch_size, after_id=self.replay_after_id)
+        topic2rows = {}
+        for row_id, timestamp, bus, device_id, register, value in rows:
+            meter_device = self.meter_devices.get((bus, device_id))
+            if meter_device is None or (topic := meter_device.get_replay_topic(register)) is None:
+                continue
+            topic2rows.setdefault(topic, []).append((row_id, {'timestamp': timestamp, 'value': value}))
+
+        qos = max(self.user_settings.publish.qos, REPLAY_MIN_QOS)
+        infos = []
+        for topic, topic_rows in topic2rows.items():
+            payload = json.dumps([values for _, values in topic_rows])
+            info = self.mqtt_client.publish(topic=topic, payload=payload, qos=qos)
+            infos.append((info, [row_id for row_id, _ in topic_rows]))
+
+        published_ids = []
+        failed_count = 0
+        timeout = self.user_settings.publish.timeout
+        for info, row_ids in infos:
+            try:
+                info.wait_for_publish(timeout=timeout)
+                published = info.is_published()
+            except (ValueError, RuntimeError) as err:
+                logger.debug('MQTT message %s: %s', info.mid, err)
+                published = False
+            if published:
+                published_ids.extend(row_ids)
+            else:
+                failed_count += len(row_ids)
+                timeout = 0  # Don't wait for the other messages, if the broker is gone again
+
+        self.value_buffer.remove(ids=published_ids)
+        if failed_count:
+            logger.warning('%i buffered values not acknowledged by the broker: Publish them again later', failed_count)
+        else:
+            # Skip the values of unknown energy meters on the next replay:
+            self.replay_after_id = rows[-1][0]
+        logger.info(
+            '%i buffered values published, %i skipped, %i left',
+            len(published_ids),
+            len(rows) - len(published_ids) - failed_count,
+            len(self.value_buffer),
+        )
@@ -1,67 +1,141 @@
 import logging
+import queue
 import time
 
 from cli_base.cli_tools.verbosity import setup_logging
-from pymodbus.client import ModbusSerialClient
+from pymodbus.client.base import ModbusBaseSyncClient
 
-from energymeter2mqtt.api import get_ha_values, get_modbus_client
+from energymeter2mqtt.api import get_modbus_clients
+from energymeter2mqtt.bus_worker import start_bus_workers
+from energymeter2mqtt.gateway import start_gateway
+from energymeter2mqtt.hot_reload import SettingsReloader
+from energymeter2mqtt.metrics import PUBLISH_QUEUE_DEPTH, start_metrics_server
 from energymeter2mqtt.mqtt_handler import EnergyMeterMqttHandler
-from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, get_user_settings
+from energymeter2mqtt.register_cache import RegisterCache
+from energymeter2mqtt.result_queue import ResultQueue
+from energymeter2mqtt.sharding import Shard, Supervisor, get_shards, set_mqtt_client_id_suffix
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, get_toml_settings, get_user_settings
 
 
 logger = logging.getLogger(__name__)
 
 
-def wait(*, sec: int, verbosity: int):
-    if verbosity > 1:
-        print('Wait', end='...')
-    for i in range(sec, 1, -1):
-        time.sleep(1)
-        if verbosity > 1:
-            print(i, end='...')
-    if verbosity > 1:
-        print('\n', flush=True)
+MAIN_DEVICE_INTERVAL = 10  # Publish the system information every X seconds
 
 
-def publish_forever(*, verbosity: int):
+def publish_values(
+    *,
+    energymeter_mqtt_handler: EnergyMeterMqttHandler,
+    result_queue: queue.Queue,
+    reloader: SettingsReloader | None = None,
+    publish_main_device: bool = True,
+):
+    """
+    Publish the values from all bus workers.
+    """
+    next_main_device_publish = 0
+    while True:
+        if reloader is not None:
+            reloader.check()
+
+        if publish_main_device and time.monotonic() >= next_main_device_publish:
+            energymeter_mqtt_handler.publish_main_device()
+            next_main_device_publish = time.monotonic() + MAIN_DEVICE_INTERVAL
+
+        try:
+            results = [result_queue.get(timeout=MAIN_DEVICE_INTERVAL)]
+        except queue.Empty:
+            logger.debug('No values received in the last %i seconds', MAIN_DEVICE_INTERVAL)
+            continue
+
+        PUBLISH_QUEUE_DEPTH.set(result_queue.qsize())
+        # Publish all values that are read in the meantime in one batch:
+        while True:
+            try:
+                results.append(result_queue.get_nowait())
+            except queue.Empty:
+                break
+        for energy_meter, register2values in results:
+            energymeter_mqtt_handler.collect(energy_meter, register2values)
+        energymeter_mqtt_handler.flush()
+
+
+def publish_forever(*, verbosity: int, shard: Shard | None = None):
     """
     Publish all values via MQTT to Home Assistant in a endless loop.
+    With a shard: Publish only the energy meters of its buses (in a worker process, see sharding.Supervisor)
     """
     setup_logging(verbosity=verbosity)
 
-    user_settings: UserSettings = get_user_settings(verbosity)
+    def load_settings() -> UserSettings:
+        user_settings: UserSettings = get_user_settings(verbosity)
+        if shard is not None:
+            user_settings = shard.get_user_settings(user_settings)
+        return user_settings
+
+    user_settings = load_settings()
+    if user_settings.metrics.enabled:
+        start_metrics_server(host=user_settings.metrics.host, port=user_settings.metrics.port)
 
+    if shard is not None:
+        set_mqtt_client_id_suffix(f'worker {shard.number}')
     energymeter_mqtt_handler = EnergyMeterMqttHandler(
         user_settings=user_settings,
         verbosity=verbosity,
+        shard=shard,
+    )
+
+    energy_meters: list[EnergyMeter] = user_settings.get_energy_meters()
+    if shard is not None:
+        energy_meters = shard.get_energy_meters(energy_meters)
+    bus2client: dict[str, ModbusBaseSyncClient] = get_modbus_clients(energy_meters, verbosity)
+    for energy_meter in energy_meters:
+        logger.info('Slave ID: %r on %s', energy_meter.device_id, energy_meter.bus)
+
+    # One worker per bus, all values are published by this thread.
+    # The workers never wait for the publishing, a full queue drops values:
+    result_queue = ResultQueue(maxsize=user_settings.publish.queue_size, overflow=user_settings.publish.overflow)
+    register_cache = RegisterCache() if user_settings.gateway.enabled else None
+    workers = start_bus_workers(
+        bus2client=bus2client,
+        energy_meters=energy_meters,
+        result_queue=result_queue,
+        adaptive_timeout=user_settings.adaptive_timeout,
+        register_cache=register_cache,
     )
+    bus2worker = {worker.bus: worker for worker in workers}
 
-    energy_meter: EnergyMeter = user_settings.energy_meter
-    definitions = energy_meter.get_definitions()
+    if user_settings.gateway.enabled:
+        # Share the buses with other Modbus clients:
+        start_gateway(settings=user_settings.gateway, bus2worker=bus2worker, register_cache=register_cache)
 
-    client: ModbusSerialClient = get_modbus_client(energy_meter, definitions, verbosity)
+    # Apply changes of the settings file and the definitions, without restarting:
+    reloader = SettingsReloader(
+        settings_path=get_toml_settings().file_path,
+        load_settings=load_settings,
+        user_settings=user_settings,
+        energymeter_mqtt_handler=energymeter_mqtt_handler,
+        bus2worker=bus2worker,
+        result_queue=result_queue,
+        verbosity=verbosity,
+        shard=shard,
+        register_cache=register_cache,
+    )
+    publish_values(
+        energymeter_mqtt_handler=energymeter_mqtt_handler,
+        result_queue=result_queue,
+        reloader=reloader,
+        publish_main_device=shard is None or shard.number == 0,  # The system information only once
+    )
 
-    parameters = definitions['parameters']
-    # parameters = [{'register': 28,
-    #                 'reg_count': 2,
-    #                 'name': 'Energy Counter Total',
-    #                 'class': 'energy',
-    #                 'state_class': 'total',
-    #                 'uom': 'kWh',
-    #                 'scale': 0.01},
-    #                {...
 
-    device_id = energy_meter.device_id
-    logger.info('Slave ID: %r', device_id)
+def publish_sharded_forever(*, verbosity: int, workers: int):
+    """
+    Distribute the buses to worker processes, that poll and publish independently.
+    """
+    setup_logging(verbosity=verbosity)
 
-    while True:
-        # Collect information:
-        try:
-            register2values = get_ha_values(client=client, parameters=parameters, device_id=device_id)
-        except Exception as err:
-            logger.exception('Error collect values: %s', err)
-        else:
-            # Publish values:
-            energymeter_mqtt_handler(register2values)
-
-        wait(sec=10, verbosity=verbosity)
+    user_settings: UserSettings = get_user_settings(verbosity)
+    shards = get_shards(user_settings.get_energy_meters(), workers=workers)
+    logger.info('Use %i worker processes', len(shards))
+    Supervisor(shards=shards, target=publish_forever, verbosity=verbosity).run_forever()
@@ -1,36 +1,39 @@
 import logging
-from decimal import Decimal
 
 from pymodbus.exceptions import ModbusIOException
-from pymodbus.pdu import ExceptionResponse
-from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
 from rich import get_console, print  # noqa
 from rich.pretty import pprint
 
-from energymeter2mqtt.api import get_modbus_client
+from energymeter2mqtt.api import get_modbus_client, read_values
+from energymeter2mqtt.decode_plan import compile_decode_plan
+from energymeter2mqtt.read_plan import get_register_count
 
 
 logger = logging.getLogger(__name__)
 
 
-def print_parameter_values(client, parameters, device_id: int, verbosity):
+def print_parameter_values(client, parameters, device_id: int, verbosity, *, max_gap: int = 0):
+    """
+    Read and decode the values with the same decode plan as the published ones.
+    """
+    decode_plan = compile_decode_plan(parameters, max_gap=max_gap)
+    try:
+        register2values = read_values(client=client, decode_plan=decode_plan, device_id=device_id)
+    except ModbusIOException as err:
+        print('Error:', err)
+        register2values = {}
+
     for parameter in parameters:
         print(f'{parameter["name"]:>30}', end=' ')
         address = parameter['register']
-        count = parameter.get('count', 1)
         if verbosity:
+            count = get_register_count(parameter)
             print(f'(Register dez: {address:02} hex: {address:04x}, {count=})', end=' ')
-        response = client.read_holding_registers(address=address, count=count, device_id=device_id)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
+        try:
+            value = register2values[address]
+        except KeyError:
+            print('[red]Error (see log)')
         else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            value = response.registers[0]
-            if count > 1:
-                value += response.registers[1] * 65536
-
-            scale = Decimal(str(parameter['scale']))
-            value = value * scale
             print(f'{value} [blue]{parameter.get("uom", "")}')
     print('\n')
 
@@ -45,4 +48,4 @@ def probe_one_port(energy_meter, definitions, verbosity):
     device_id = energy_meter.device_id
     print(f'{device_id=}')
 
-    print_parameter_values(client, parameters, device_id, verbosity)
+    print_parameter_values(client, parameters, device_id, verbosity, max_gap=energy_meter.max_read_gap)
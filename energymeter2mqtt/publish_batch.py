@@ -0,0 +1,122 @@
+import collections
+import dataclasses
+import json
+import logging
+import time
+
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.data_classes import ComponentConfig, ComponentState
+from paho.mqtt.client import Client, MQTTMessageInfo
+
+from energymeter2mqtt.metrics import MQTT_FLUSH_SECONDS, MQTT_INFLIGHT_MESSAGES
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class PendingMessage:
+    topic: str
+    payload: object
+    qos: int
+    retain: bool
+
+
+class PublishBatch:
+    """
+    Collect the MQTT messages of one poll cycle and publish them with one flush():
+    Messages to the same topic are coalesced (the last one wins) and
+    dict payloads (see JsonStateSensor) are merged into one JSON object per topic.
+    Max. "max_inflight" published messages are waiting for their completion.
+    """
+
+    def __init__(self, client: Client, *, max_inflight: int, timeout: float):
+        assert max_inflight > 0, f'Invalid {max_inflight=}'
+        self.client = client
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+
+        self.topic2message = {}
+        self.topic2json = {}  # Last values of all JSON state topics, so every message contains all values
+        self.inflight = collections.deque()
+
+    def __len__(self):
+        return len(self.topic2message)
+
+    def publish(self, *, topic: str, payload, qos: int = 0, retain: bool = False) -> PendingMessage:
+        """
+        Same signature as paho.mqtt.client.Client.publish(), so the ha_services components can use it.
+        """
+        if isinstance(payload, dict):
+            json_values = self.topic2json.setdefault(topic, {})
+            json_values.update(payload)
+            payload = json_values
+        message = self.topic2message[topic] = PendingMessage(topic=topic, payload=payload, qos=qos, retain=retain)
+        return message
+
+    def flush(self) -> int:
+        """
+        Publish all collected messages. Returns the number of published messages.
+        """
+        messages = list(self.topic2message.values())
+        self.topic2message.clear()
+
+        start = time.perf_counter()
+        for message in messages:
+            self.wait_for_window(size=self.max_inflight - 1)
+            payload = message.payload
+            if isinstance(payload, dict):
+                payload = json.dumps(payload, sort_keys=True)
+            info = self.client.publish(topic=message.topic, payload=payload, qos=message.qos, retain=message.retain)
+            self.inflight.append(info)
+        MQTT_FLUSH_SECONDS.observe(time.perf_counter() - start)
+        MQTT_INFLIGHT_MESSAGES.set(len(self.inflight))
+        return len(messages)
+
+    def wait_for_window(self, *, size: int):
+        """
+        Wait until max. "size" published messages are not completed.
+        Messages that can't be published (e.g.: broker not connected) are dropped from the window.
+        """
+        if len(self.inflight) <= size:
+            return
+
+        inflight = collections.deque()
+        for info in self.inflight:
+            try:
+                if not info.is_published():
+                    inflight.append(info)
+            except (ValueError, RuntimeError) as err:
+                logger.debug('MQTT message %s: %s', info.mid, err)
+        self.inflight = inflight
+
+        while len(self.inflight) > size:
+            info: MQTTMessageInfo = self.inflight.popleft()
+            try:
+                info.wait_for_publish(timeout=self.timeout)
+            except (ValueError, RuntimeError) as err:
+                logger.debug('MQTT message %s: %s', info.mid, err)
+            else:
+                if not info.is_published():
+                    logger.warning('MQTT message %s not published after %s sec.', info.mid, self.timeout)
+
+
+class JsonStateSensor(Sensor):
+    """
+    Publish the state as value of a JSON object, that contains all values of the device.
+    Home Assistant extracts the value via "value_template".
+    """
+
+    def __init__(self, *, json_key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.json_key = json_key
+        self.state_topic = f'{self.device.topic_prefix}/{self.component}/{self.device.uid}/state'
+
+    def get_state(self) -> ComponentState:
+        return ComponentState(topic=self.state_topic, payload={self.json_key: self.state})
+
+    def get_config(self) -> ComponentConfig:
+        config = super().get_config()
+        config.payload['state_topic'] = self.state_topic
+        config.payload['value_template'] = f'{{{{ value_json.{self.json_key} }}}}'
+        return config
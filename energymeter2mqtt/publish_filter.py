@@ -0,0 +1,67 @@
+DEFAULT_MAX_SILENCE_SECONDS = 5 * 60  # Heartbeat, if only a "deadband" is set
+
+
+class PublishFilter:
+    """
+    Publish-on-change of one parameter: A value is only published, if it changed more than the "deadband"
+    since the last published value, or if nothing was published for "max_silence_seconds".
+
+    The "deadband" is an absolute value (e.g.: `5`) or a percent string (e.g.: `"2%"`)
+    relative to the last published value.
+
+    >>> publish_filter = PublishFilter(deadband='10%', max_silence_seconds=60)
+    >>> publish_filter.should_publish(100, now=0)
+    True
+    >>> publish_filter.published(100, now=0)
+    >>> publish_filter.should_publish(109, now=1)
+    False
+    >>> publish_filter.should_publish(111, now=1)
+    True
+    >>> publish_filter.should_publish(100, now=60)
+    True
+    """
+
+    def __init__(self, *, deadband: int | float | str = 0, max_silence_seconds: int | float | None = None):
+        self.percent = isinstance(deadband, str)
+        if self.percent:
+            assert deadband.endswith('%'), f'Invalid deadband: {deadband!r}'
+            deadband = float(deadband[:-1])
+        assert deadband >= 0, f'Invalid deadband: {deadband!r}'
+        self.deadband = deadband
+
+        assert max_silence_seconds is None or max_silence_seconds > 0, f'Invalid {max_silence_seconds=}'
+        self.max_silence_seconds = max_silence_seconds
+
+        self.last_value = None
+        self.last_publish = None
+
+    def is_changed(self, value) -> bool:
+        if self.last_value is None:
+            return True
+        deadband = self.deadband
+        if self.percent:
+            deadband = abs(self.last_value) * deadband / 100
+        return abs(value - self.last_value) > deadband
+
+    def should_publish(self, value, *, now) -> bool:
+        if self.is_changed(value):
+            return True
+        return self.max_silence_seconds is not None and now - self.last_publish >= self.max_silence_seconds
+
+    def published(self, value, *, now):
+        self.last_value = value
+        self.last_publish = now
+
+
+def get_publish_filter(parameter: dict) -> PublishFilter | None:
+    """
+    Create the PublishFilter from the "deadband" and "max_silence_seconds" of a definition parameter.
+    Without them every value will be published.
+    """
+    deadband = parameter.get('deadband')
+    max_silence_seconds = parameter.get('max_silence_seconds')
+    if deadband is None and max_silence_seconds is None:
+        return None
+    if max_silence_seconds is None:
+        max_silence_seconds = DEFAULT_MAX_SILENCE_SECONDS
+    return PublishFilter(deadband=deadband or 0, max_silence_seconds=max_silence_seconds)
@@ -0,0 +1,63 @@
+import dataclasses
+
+
+# Modbus allows max. 125 registers per "read holding registers" request:
+MAX_REGISTER_COUNT = 125
+
+
+def get_register_count(parameter: dict) -> int:
+    return parameter.get('reg_count', 1)
+
+
+@dataclasses.dataclass
+class ReadBlock:
+    """
+    One Modbus request that covers the registers of one or more parameters.
+    """
+
+    address: int
+    count: int
+    parameters: list = dataclasses.field(default_factory=list)
+
+    @property
+    def end(self) -> int:
+        return self.address + self.count
+
+
+def plan_reads(parameters: list, *, max_gap: int = 0, max_count: int = MAX_REGISTER_COUNT) -> list[ReadBlock]:
+    """
+    Group the parameters into as few read requests as possible.
+
+    Parameters are merged into one block, if the gap of unused registers between them
+    is not bigger than `max_gap` and the block doesn't exceed `max_count` registers.
+
+    >>> parameters = [
+    ...     {'register': 28, 'reg_count': 2},
+    ...     {'register': 30, 'reg_count': 2},
+    ...     {'register': 35},
+    ...     {'register': 36},
+    ... ]
+    >>> [(block.address, block.count) for block in plan_reads(parameters)]
+    [(28, 4), (35, 2)]
+    >>> [(block.address, block.count) for block in plan_reads(parameters, max_gap=3)]
+    [(28, 9)]
+    >>> [(block.address, block.count) for block in plan_reads(parameters, max_gap=3, max_count=4)]
+    [(28, 4), (35, 2)]
+    """
+    blocks = []
+    current_block = None
+    for parameter in sorted(parameters, key=lambda parameter: parameter['register']):
+        address = parameter['register']
+        end = address + get_register_count(parameter)
+        if (
+            current_block is not None
+            and address - current_block.end <= max_gap
+            and max(end, current_block.end) - current_block.address <= max_count
+        ):
+            current_block.count = max(end, current_block.end) - current_block.address
+            current_block.parameters.append(parameter)
+        else:
+            current_block = ReadBlock(address=address, count=end - address, parameters=[parameter])
+            blocks.append(current_block)
+
+    return blocks
@@ -0,0 +1,51 @@
+import threading
+import time
+
+
+class RegisterCache:
+    """
+    Thread-safe store of the raw registers of the last accepted values by bus and device id.
+    Used by the Modbus gateway, to answer reads of polled registers without a bus request.
+
+    >>> register_cache = RegisterCache()
+    >>> register_cache.update(bus='/dev/ttyUSB0', device_id=1, address=28, registers=[1, 2, 3], now=100)
+    >>> register_cache.get(bus='/dev/ttyUSB0', device_id=1, address=29, count=2, max_age=10, now=110)
+    [2, 3]
+    >>> register_cache.get(bus='/dev/ttyUSB0', device_id=1, address=29, count=3, max_age=10, now=110) is None
+    True
+    >>> register_cache.get(bus='/dev/ttyUSB0', device_id=1, address=29, count=2, max_age=10, now=111) is None
+    True
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key2registers = {}  # {(bus, device_id): {address: (register, timestamp)}}
+
+    def update(self, *, bus: str, device_id: int, address: int, registers: list[int], now: float | None = None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            address2register = self.key2registers.setdefault((bus, device_id), {})
+            for offset, register in enumerate(registers):
+                address2register[address + offset] = (register, now)
+
+    def get(
+        self, *, bus: str, device_id: int, address: int, count: int, max_age: float, now: float | None = None
+    ) -> list[int] | None:
+        """
+        Returns the registers, if all of them are known and not older than "max_age" seconds.
+        """
+        if now is None:
+            now = time.monotonic()
+        registers = []
+        with self.lock:
+            address2register = self.key2registers.get((bus, device_id), {})
+            for register_address in range(address, address + count):
+                try:
+                    register, timestamp = address2register[register_address]
+                except KeyError:
+                    return None
+                if now - timestamp > max_age:
+                    return None
+                registers.append(register)
+        return registers
@@ -0,0 +1,63 @@
+import queue
+
+from energymeter2mqtt.metrics import PUBLISH_QUEUE_DROPPED
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+# Merge into a waiting read of the same energy meter: The latest value per register wins
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'  # Drop the oldest waiting read
+OVERFLOW_POLICIES = (OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST)
+
+
+class ResultQueue(queue.Queue):
+    """
+    Bounded queue of (energy_meter, register2values) between the bus workers and the MQTT publisher.
+    put() never blocks, so the buses are kept busy, if the publisher falls behind.
+    A full queue drops values by the overflow policy:
+
+    >>> energy_meter1, energy_meter2 = EnergyMeter(device_id=1), EnergyMeter(device_id=2)
+    >>> result_queue = ResultQueue(maxsize=2)
+    >>> result_queue.put((energy_meter1, {35: 230, 37: 100}))
+    >>> result_queue.put((energy_meter2, {35: 231}))
+    >>> result_queue.put((energy_meter1, {35: 232}))
+    >>> [(energy_meter.device_id, values) for energy_meter, values in result_queue.queue]
+    [(1, {35: 232, 37: 100}), (2, {35: 231})]
+
+    >>> result_queue = ResultQueue(maxsize=2, overflow=OVERFLOW_DROP_OLDEST)
+    >>> result_queue.put((energy_meter1, {35: 230, 37: 100}))
+    >>> result_queue.put((energy_meter2, {35: 231}))
+    >>> result_queue.put((energy_meter1, {35: 232}))
+    >>> [(energy_meter.device_id, values) for energy_meter, values in result_queue.queue]
+    [(2, {35: 231}), (1, {35: 232})]
+    """
+
+    def __init__(self, maxsize: int, overflow: str = OVERFLOW_COALESCE):
+        assert maxsize > 0, f'Invalid {maxsize=}'
+        assert overflow in OVERFLOW_POLICIES, f'Invalid {overflow=}, choose one of: {OVERFLOW_POLICIES}'
+        super().__init__(maxsize=maxsize)
+        self.overflow = overflow
+
+    def put(self, item: tuple[EnergyMeter, dict], block=True, timeout=None):
+        with self.mutex:
+            if self._qsize() < self.maxsize:
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+            else:
+                self._put_overflow(*item)
+
+    def _put_overflow(self, energy_meter: EnergyMeter, register2values: dict):
+        if self.overflow == OVERFLOW_COALESCE:
+            key = (energy_meter.bus, energy_meter.device_id)
+            for waiting_energy_meter, waiting_values in reversed(self.queue):
+                if (waiting_energy_meter.bus, waiting_energy_meter.device_id) == key:
+                    dropped = len(waiting_values.keys() & register2values.keys())
+                    waiting_values.update(register2values)
+                    PUBLISH_QUEUE_DROPPED.inc(energy_meter.bus, energy_meter.device_id, amount=dropped)
+                    return
+
+        # No waiting read of this energy meter -> make room by dropping the oldest one:
+        dropped_energy_meter, dropped_values = self.queue.popleft()
+        PUBLISH_QUEUE_DROPPED.inc(dropped_energy_meter.bus, dropped_energy_meter.device_id, amount=len(dropped_values))
+        self.queue.append((energy_meter, register2values))
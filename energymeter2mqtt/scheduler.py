@@ -0,0 +1,194 @@
+import dataclasses
+import heapq
+import itertools
+import logging
+
+from energymeter2mqtt.metrics import POLL_OVERRUNS
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class TimingStats:
+    """
+    Achieved timing of a PollJob, compared to its schedule.
+    """
+
+    runs: int = 0
+    overruns: int = 0  # Number of skipped runs, because we were behind schedule
+    last_start: float | None = None
+    period_sum: float = 0
+    jitter_sum: float = 0  # Sum of the delays between due time and real start time
+    max_jitter: float = 0
+
+    def add_run(self, *, due, now, missed: int):
+        if self.last_start is not None:
+            self.period_sum += now - self.last_start
+        self.last_start = now
+
+        jitter = now - due
+        self.jitter_sum += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+
+        self.runs += 1
+        self.overruns += missed
+
+    @property
+    def period(self) -> float | None:
+        """
+        Mean of the achieved periods
+        """
+        if self.runs > 1:
+            return self.period_sum / (self.runs - 1)
+
+    @property
+    def jitter(self) -> float | None:
+        """
+        Mean delay of the start times
+        """
+        if self.runs:
+            return self.jitter_sum / self.runs
+
+
+@dataclasses.dataclass
+class PollJob:
+    """
+    All parameters of one energy meter that should be read with the same interval.
+    """
+
+    energy_meter: EnergyMeter
+    parameters: list
+    interval: float
+    stats: TimingStats = dataclasses.field(default_factory=TimingStats)
+
+
+class PollScheduler:
+    """
+    Deadline based scheduling of parameter reads:
+    A priority queue holds the next due time of every PollJob.
+    The due times are on a fixed time.monotonic() cadence, so they don't drift by the time of the bus reads.
+
+    >>> energy_meter = EnergyMeter(poll_interval=10)
+    >>> scheduler = PollScheduler()
+    >>> scheduler.add(energy_meter, [{'register': 28}, {'register': 37, 'poll_interval': 1}], now=0)
+    >>> [job.interval for job in scheduler.pop_due(now=0)]
+    [10, 1]
+    >>> scheduler.next_due()
+    1
+    >>> [job.interval for job in scheduler.pop_due(now=1.2)]
+    [1]
+    >>> scheduler.next_due()
+    2
+    >>> scheduler.pop_due(now=1.5)
+    []
+    >>> [job.interval for job in scheduler.pop_due(now=2)]
+    [1]
+    >>> scheduler.remove(energy_meter)
+    >>> scheduler.jobs()
+    []
+    >>> scheduler.next_due() is None
+    True
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()  # Keep the insert order of jobs with the same due time
+
+    def add(self, energy_meter: EnergyMeter, parameters: list, *, now):
+        interval2parameters = {}
+        for parameter in parameters:
+            # Parameters without "poll_interval" in the definition are read with the energy meter interval:
+            interval = parameter.get('poll_interval', energy_meter.poll_interval)
+            assert interval > 0, f'Invalid poll_interval in {parameter=}'
+            interval2parameters.setdefault(interval, []).append(parameter)
+
+        for interval, parameters in interval2parameters.items():
+            job = PollJob(energy_meter=energy_meter, parameters=parameters, interval=interval)
+            self._push(due=now, job=job)
+
+    def remove(self, energy_meter: EnergyMeter):
+        """
+        Remove all jobs of the energy meter, e.g.: because its definitions have changed.
+        """
+        key = (energy_meter.bus, energy_meter.device_id)
+        self._queue = [
+            (due, count, job)
+            for due, count, job in self._queue
+            if (job.energy_meter.bus, job.energy_meter.device_id) != key
+        ]
+        heapq.heapify(self._queue)
+
+    def _push(self, *, due, job: PollJob):
+        heapq.heappush(self._queue, (due, next(self._counter), job))
+
+    def next_due(self):
+        """
+        The due time of the next job or None, if no job is scheduled (e.g.: all energy meters removed).
+        """
+        if not self._queue:
+            return None
+        return self._queue[0][0]
+
+    def jobs(self) -> list[PollJob]:
+        return [job for _, _, job in self._queue]
+
+    def pop_due(self, *, now) -> list[PollJob]:
+        """
+        Returns all jobs that are due and schedule their next run.
+        """
+        jobs = []
+        while self._queue and self._queue[0][0] <= now:
+            due, _, job = heapq.heappop(self._queue)
+            jobs.append((due, job))
+
+        for due, job in jobs:
+            missed = 0
+            next_due = due + job.interval
+            if next_due <= now:
+                # We are behind schedule (e.g.: slow bus) -> skip the missed runs:
+                missed = int((now - due) // job.interval)
+                next_due = due + (missed + 1) * job.interval
+                logger.warning(
+                    'Overrun: %i runs of %s (device id: %i, interval: %s sec.) skipped',
+                    missed,
+                    job.energy_meter.bus,
+                    job.energy_meter.device_id,
+                    job.interval,
+                )
+                POLL_OVERRUNS.inc(job.energy_meter.bus, job.energy_meter.device_id, amount=missed)
+            job.stats.add_run(due=due, now=now, missed=missed)
+            self._push(due=next_due, job=job)
+
+        return [job for due, job in jobs]
+
+    def log_stats(self):
+        for job in self.jobs():
+            stats = job.stats
+            if stats.period is None:
+                continue
+            logger.info(
+                '%s (device id: %i) interval %s sec.: period %.3f sec. jitter %.3f sec. (max: %.3f) overruns: %i',
+                job.energy_meter.bus,
+                job.energy_meter.device_id,
+                job.interval,
+                stats.period,
+                stats.jitter,
+                stats.max_jitter,
+                stats.overruns,
+            )
+
+
+def group_by_energy_meter(jobs: list[PollJob]) -> list[tuple[EnergyMeter, list[PollJob]]]:
+    """
+    Group all due jobs per energy meter, so their parameters can be read with block reads.
+    """
+    result = {}
+    for job in jobs:
+        key = (job.energy_meter.bus, job.energy_meter.device_id)
+        if key in result:
+            result[key][1].append(job)
+        else:
+            result[key] = (job.energy_meter, [job])
+    return list(result.values())
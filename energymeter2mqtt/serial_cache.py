@@ -0,0 +1,69 @@
+import json
+import logging
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+
+SERIAL_CACHE_PATH = '~/.cache/energymeter2mqtt/serial_connections.json'
+
+
+def get_cache_key(port: str, *, name: str) -> str:
+    """
+    The detected settings are only valid for the same energy meter type on the same port.
+
+    >>> get_cache_key('/dev/ttyUSB0', name='saia_pcd_ald1d5fd')
+    '/dev/ttyUSB0 saia_pcd_ald1d5fd'
+    """
+    return f'{port} {name}'
+
+
+class SerialConnectionCache:
+    """
+    The detected serial settings (baud rate, parity, etc.) per port and definition,
+    so the next starts don't need to probe again.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path or Path(SERIAL_CACHE_PATH).expanduser()
+
+    def load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text(encoding='UTF-8'))
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            logger.warning('Ignore invalid %s: %s', self.path, err)
+            return {}
+
+    def get(self, port: str, *, name: str) -> dict | None:
+        return self.load().get(get_cache_key(port, name=name))
+
+    def set(self, port: str, connection: dict, *, name: str):
+        data = self.load()
+        data[get_cache_key(port, name=name)] = connection
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps(data, indent=4, sort_keys=True), encoding='UTF-8')
+        temp_path.replace(self.path)
+        logger.info('Detected serial settings of %s stored in %s', port, self.path)
+
+    def get_connection(self, port: str, *, name: str, definitions: dict) -> dict:
+        """
+        Returns the detected serial settings or the [connection] of the definition file.
+        """
+        connection = definitions['connection']
+        detected = self.get(port, name=name)
+        if detected is None:
+            return connection
+        if detected != connection:
+            logger.warning(
+                'Use detected serial settings %r for %s instead of %r from the %r definition (see: %s)',
+                detected,
+                port,
+                connection,
+                name,
+                self.path,
+            )
+        return detected
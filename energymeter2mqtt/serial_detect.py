@@ -0,0 +1,110 @@
+import concurrent.futures
+import logging
+from collections.abc import Callable
+
+from pymodbus import FramerType
+from pymodbus.client import ModbusSerialClient
+
+from energymeter2mqtt.bus_scan import probe_device_id
+from energymeter2mqtt.serial_cache import SerialConnectionCache
+
+
+logger = logging.getLogger(__name__)
+
+
+# The most common settings first:
+BAUDRATES = (9600, 19200, 38400, 2400, 4800, 57600, 115200)
+FRAMINGS = (('N', 1), ('E', 1), ('N', 2), ('O', 1))  # (parity, stop bits) with 8 data bits
+
+
+def get_candidates(*connections: dict) -> list[dict]:
+    """
+    All serial settings to probe: The given connections first, then all common combinations.
+
+    >>> candidates = get_candidates({'baudrate': 19200, 'bytesize': 8, 'parity': 'N', 'stopbits': 2})
+    >>> [f"{c['baudrate']} {c['bytesize']}{c['parity']}{c['stopbits']}" for c in candidates[:6]]
+    ['19200 8N2', '9600 8N1', '9600 8E1', '9600 8N2', '9600 8O1', '19200 8N1']
+    >>> len(candidates)
+    28
+    """
+    candidates = list(connections)
+    for baudrate in BAUDRATES:
+        for parity, stopbits in FRAMINGS:
+            connection = {'baudrate': baudrate, 'bytesize': 8, 'parity': parity, 'stopbits': stopbits}
+            if connection not in candidates:
+                candidates.append(connection)
+    return candidates
+
+
+def probe_connection(port: str, connection: dict, *, device_id: int, address: int, timeout: float) -> bool:
+    """
+    Wrong serial settings result in no response or a corrupt one, that is dropped because of the CRC.
+    """
+    client = ModbusSerialClient(port, framer=FramerType.RTU, timeout=timeout, retries=0, **connection)
+    try:
+        return probe_device_id(client, device_id=device_id, address=address)
+    finally:
+        client.close()
+
+
+def detect_connection(
+    port: str,
+    *,
+    candidates: list[dict],
+    device_id: int,
+    address: int,
+    timeout: float,
+    probe: Callable = probe_connection,
+) -> dict | None:
+    """
+    Returns the first serial settings, the energy meter responds to.
+    """
+    for connection in candidates:
+        logger.debug('Probe %s with %r', port, connection)
+        if probe(port, connection, device_id=device_id, address=address, timeout=timeout):
+            logger.info('Device id %i on %s responds with %r', device_id, port, connection)
+            return connection
+    logger.info('No response from device id %i on %s', device_id, port)
+    return None
+
+
+def detect_ports(
+    *,
+    ports: list[str],
+    name: str,
+    definitions: dict,
+    device_id: int,
+    timeout: float,
+    cache: SerialConnectionCache | None = None,
+    probe: Callable = probe_connection,
+) -> dict:
+    """
+    Detect the serial settings of all ports in parallel and store the results in the cache,
+    per port and definition "name".
+    A cached result is probed first. Returns {port: connection or None}
+    """
+    if cache is None:
+        cache = SerialConnectionCache()
+    address = min(parameter['register'] for parameter in definitions['parameters'])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports) or 1) as executor:
+        port2future = {}
+        for port in ports:
+            connections = [definitions['connection']]
+            if cached := cache.get(port, name=name):
+                connections.insert(0, cached)
+            port2future[port] = executor.submit(
+                detect_connection,
+                port,
+                candidates=get_candidates(*connections),
+                device_id=device_id,
+                address=address,
+                timeout=timeout,
+                probe=probe,
+            )
+        port2connection = {port: future.result() for port, future in port2future.items()}
+
+    for port, connection in port2connection.items():
+        if connection is not None and connection != cache.get(port, name=name):
+            cache.set(port, connection, name=name)
+    return port2connection
@@ -0,0 +1,149 @@
+import dataclasses
+import logging
+import multiprocessing
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from ha_services.mqtt4homeassistant import mqtt as ha_mqtt
+
+from energymeter2mqtt.api import group_by_bus
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+SUPERVISE_INTERVAL = 1  # Check the worker processes every X seconds
+RESTART_DELAY = 5  # Wait X seconds before a crashed worker process is restarted
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """
+    The buses that are polled and published by one worker process.
+    """
+
+    number: int
+    buses: frozenset
+
+    def get_energy_meters(self, energy_meters: list[EnergyMeter]) -> list[EnergyMeter]:
+        return [energy_meter for energy_meter in energy_meters if energy_meter.bus in self.buses]
+
+    def get_user_settings(self, user_settings: UserSettings) -> UserSettings:
+        """
+        Every worker process needs its own value buffer file, metrics and Modbus gateway port.
+
+        >>> user_settings = Shard(number=2, buses=frozenset()).get_user_settings(UserSettings())
+        >>> user_settings.value_buffer.path
+        '~/.cache/energymeter2mqtt/value_buffer_2.sqlite3'
+        >>> user_settings.metrics.port, user_settings.gateway.port
+        (9114, 5022)
+        """
+        path = Path(user_settings.value_buffer.path)
+        return dataclasses.replace(
+            user_settings,
+            value_buffer=dataclasses.replace(
+                user_settings.value_buffer,
+                path=str(path.with_stem(f'{path.stem}_{self.number}')),
+            ),
+            metrics=dataclasses.replace(user_settings.metrics, port=user_settings.metrics.port + self.number),
+            gateway=dataclasses.replace(user_settings.gateway, port=user_settings.gateway.port + self.number),
+        )
+
+
+def get_shards(energy_meters: list[EnergyMeter], *, workers: int) -> list[Shard]:
+    """
+    Distribute the buses to max. "workers" shards, with about the same number of energy meters per shard.
+    The energy meters of one bus are always in the same shard, because their requests can't overlap.
+
+    >>> energy_meters = [
+    ...     EnergyMeter(port='/dev/ttyUSB0', device_id=1),
+    ...     EnergyMeter(port='/dev/ttyUSB0', device_id=2),
+    ...     EnergyMeter(port='/dev/ttyUSB1'),
+    ...     EnergyMeter(port='/dev/ttyUSB2'),
+    ... ]
+    >>> [sorted(shard.buses) for shard in get_shards(energy_meters, workers=2)]
+    [['/dev/ttyUSB0'], ['/dev/ttyUSB1', '/dev/ttyUSB2']]
+    >>> len(get_shards(energy_meters, workers=8))
+    3
+    """
+    assert workers > 0, f'Invalid {workers=}'
+    bus2energy_meters = group_by_bus(energy_meters)
+    shard_buses = [[] for _ in range(min(workers, len(bus2energy_meters)))]
+    shard_sizes = [0] * len(shard_buses)
+    for bus, bus_energy_meters in sorted(bus2energy_meters.items(), key=lambda item: -len(item[1])):
+        index = shard_sizes.index(min(shard_sizes))
+        shard_buses[index].append(bus)
+        shard_sizes[index] += len(bus_energy_meters)
+    return [Shard(number=number, buses=frozenset(buses)) for number, buses in enumerate(shard_buses)]
+
+
+def set_mqtt_client_id_suffix(suffix: str):
+    """
+    ha_services uses the same MQTT client id for all connections of one host,
+    but the broker disconnects a client, if another one connects with the same id.
+    Must be called in the worker process, before the MQTT connection is established.
+    """
+    get_client_id = ha_mqtt.get_client_id
+    ha_mqtt.get_client_id = lambda: f'{get_client_id()} {suffix}'
+
+
+class Supervisor:
+    """
+    Run one worker process per shard and restart crashed ones.
+    The processes are started via "spawn", so they don't inherit threads or connections.
+    """
+
+    def __init__(self, *, shards: list[Shard], target: Callable, verbosity: int, restart_delay=RESTART_DELAY):
+        self.shards = shards
+        self.target = target
+        self.verbosity = verbosity
+        self.restart_delay = restart_delay
+
+        self.context = multiprocessing.get_context('spawn')
+        self.number2process = {}
+        self.number2next_start = {}
+        self.restarts = 0
+
+    def check(self, *, now):
+        """
+        Start all worker processes, that are not running.
+        """
+        for shard in self.shards:
+            process = self.number2process.get(shard.number)
+            if process is not None:
+                if process.is_alive():
+                    continue
+                logger.error('Worker %i exited with code %s', shard.number, process.exitcode)
+                del self.number2process[shard.number]
+                self.number2next_start[shard.number] = now + self.restart_delay
+                self.restarts += 1
+
+            if now < self.number2next_start.get(shard.number, 0):
+                continue
+
+            logger.info('Start worker %i for: %s', shard.number, ', '.join(sorted(shard.buses)))
+            process = self.context.Process(
+                target=self.target,
+                kwargs=dict(verbosity=self.verbosity, shard=shard),
+                name=f'energymeter2mqtt worker {shard.number}',
+                daemon=True,
+            )
+            process.start()
+            self.number2process[shard.number] = process
+
+    def stop(self):
+        for process in self.number2process.values():
+            process.terminate()
+        for process in self.number2process.values():
+            process.join()
+        self.number2process.clear()
+
+    def run_forever(self):
+        try:
+            while True:
+                self.check(now=time.monotonic())
+                time.sleep(SUPERVISE_INTERVAL)
+        finally:
+            self.stop()
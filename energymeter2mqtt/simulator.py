@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import random
+import threading
+
+from pymodbus import FramerType
+from pymodbus.constants import ExcCodes
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.datastore.context import ModbusBaseDeviceContext
+from pymodbus.server import ModbusTcpServer
+
+from energymeter2mqtt.decode_plan import RegisterDecoder
+
+
+logger = logging.getLogger(__name__)
+
+
+READ_HOLDING_REGISTERS = 3
+BITS_PER_CHAR = 11  # Modbus RTU: start bit + 8 data bits + parity/stop bit + stop bit
+RTU_REQUEST_SIZE = 8  # device id + function code + address + count + CRC
+
+
+class SimulatedBus:
+    """
+    The timing of a simulated bus: Response latency, transfer time and injected errors.
+    All devices on one bus answer one after another, like on a real RS485 bus.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0,
+        baudrate: int = 0,  # Emulate the transfer time of Modbus RTU frames with this baud rate (0 = off)
+        error_rate: float = 0,  # Probability of a "device busy" exception response
+        no_response_rate: float = 0,  # Probability of a "gateway: no response" after no_response_delay
+        no_response_delay: float = 1,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.baudrate = baudrate
+        self.error_rate = error_rate
+        self.no_response_rate = no_response_rate
+        self.no_response_delay = no_response_delay
+        self.random = random.Random(seed)
+        self.lock = None  # Created in the running event loop
+
+        self.requests = 0
+        self.errors = 0
+
+    def get_transfer_time(self, count: int) -> float:
+        if not self.baudrate:
+            return 0
+        response_size = 5 + count * 2  # device id + function code + byte count + registers + CRC
+        return (RTU_REQUEST_SIZE + response_size) * BITS_PER_CHAR / self.baudrate
+
+    async def transfer(self, count: int) -> ExcCodes | None:
+        """
+        Simulate one request/response on the bus. Returns an error code for injected errors.
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            self.requests += 1
+            if self.no_response_rate and self.random.random() < self.no_response_rate:
+                self.errors += 1
+                await asyncio.sleep(self.no_response_delay)
+                return ExcCodes.GATEWAY_NO_RESPONSE
+
+            delay = self.latency + self.get_transfer_time(count)
+            if delay:
+                await asyncio.sleep(delay)
+
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return ExcCodes.DEVICE_BUSY
+
+
+class SimulatedParameter:
+    """
+    The value of one parameter: Counters (state_class "total...") increase on every read.
+    Measurements have a fixed value in the middle of "min_value" and "max_value".
+    """
+
+    def __init__(self, parameter: dict):
+        self.decoder = RegisterDecoder(parameter, offset=0)
+        self.is_counter = parameter.get('state_class', '').startswith('total')
+        self.increment = parameter.get('scale') or 1
+
+        min_value = parameter.get('min_value')
+        max_value = parameter.get('max_value')
+        if min_value is not None and max_value is not None and not self.is_counter:
+            self.value = (min_value + max_value) / 2
+        else:
+            self.value = min_value or 0
+
+    def get_registers(self) -> list[int]:
+        if self.is_counter:
+            self.value += self.increment
+        return self.decoder.encode(self.value)
+
+
+class SimulatedMeter(ModbusBaseDeviceContext):
+    """
+    Modbus device context of one energy meter, with the registers of the definition file.
+
+    >>> parameters = [
+    ...     {'register': 28, 'reg_count': 2, 'state_class': 'total', 'scale': 0.01, 'min_value': 0},
+    ...     {'register': 35, 'state_class': 'measurement', 'min_value': 200, 'max_value': 300},
+    ... ]
+    >>> meter = SimulatedMeter(definitions={'parameters': parameters}, bus=SimulatedBus())
+    >>> meter.get_registers(35, 1)
+    [250]
+    >>> meter.get_registers(28, 2)
+    [1, 0]
+    >>> meter.get_registers(28, 8)
+    [2, 0, 0, 0, 0, 0, 0, 250]
+    >>> meter.get_registers(1000, 2)
+    <ExcCodes.ILLEGAL_ADDRESS: 2>
+    """
+
+    def __init__(self, *, definitions: dict, bus: SimulatedBus):
+        self.bus = bus
+        self.address2parameter = {}
+        for parameter in definitions['parameters']:
+            self.address2parameter[parameter['register']] = SimulatedParameter(parameter)
+
+        self.min_address = min(self.address2parameter)
+        self.max_address = max(
+            address + parameter.decoder.count for address, parameter in self.address2parameter.items()
+        )
+
+    def reset(self):
+        pass
+
+    async def async_getValues(self, func_code: int, address: int, count: int = 1) -> list[int] | ExcCodes:
+        if error := await self.bus.transfer(count):
+            return error
+
+        if func_code != READ_HOLDING_REGISTERS:
+            return ExcCodes.ILLEGAL_FUNCTION
+        return self.get_registers(address, count)
+
+    def get_registers(self, address: int, count: int) -> list[int] | ExcCodes:
+        if address < self.min_address or address + count > self.max_address:
+            return ExcCodes.ILLEGAL_ADDRESS
+
+        registers = [0] * count  # Unused registers in a block read are zero
+        for offset in range(count):
+            if parameter := self.address2parameter.get(address + offset):
+                values = parameter.get_registers()
+                registers[offset : offset + len(values)] = values
+        return registers[:count]
+
+    def getValues(self, func_code: int, address: int, count: int = 1) -> list[int] | ExcCodes:
+        return ExcCodes.ILLEGAL_FUNCTION  # Only the async API is used by the pymodbus server
+
+    def setValues(self, func_code: int, address: int, values: list) -> ExcCodes:
+        return ExcCodes.ILLEGAL_FUNCTION  # Energy meters are read-only
+
+
+def get_simulator_context(*, definitions: dict, device_ids, bus: SimulatedBus) -> ModbusServerContext:
+    """
+    Simulate energy meters with the same definitions and the given Modbus device ids on one bus.
+    """
+    devices = {device_id: SimulatedMeter(definitions=definitions, bus=bus) for device_id in device_ids}
+    return ModbusServerContext(devices=devices, single=False)
+
+
+class SimulatorThread(threading.Thread):
+    """
+    Run the Modbus server of simulated energy meters in a background thread.
+
+    The server listens on TCP. The "rtu-over-tcp" transport uses Modbus RTU frames,
+    like a transparent serial server in front of real RTU meters: Requests to missing
+    device ids are not answered. Via "tcp" a gateway exception response is send.
+    """
+
+    def __init__(self, *, context: ModbusServerContext, transport: str = 'tcp', host='127.0.0.1', port: int = 0):
+        super().__init__(name=f'Simulator {host}:{port}', daemon=True)
+        self.context = context
+        self.framer = FramerType.SOCKET if transport == 'tcp' else FramerType.RTU
+        self.ignore_missing_devices = transport != 'tcp'
+        self.host = host
+        self.port = port  # 0 = use a free port
+
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self.started = threading.Event()
+
+    async def serve(self):
+        self.server = ModbusTcpServer(
+            self.context,
+            address=(self.host, self.port),
+            framer=self.framer,
+            ignore_missing_devices=self.ignore_missing_devices,
+        )
+        await self.server.serve_forever(background=True)
+        self.port = self.server.transport.sockets[0].getsockname()[1]
+        logger.info('Simulator listen on %s:%i', self.host, self.port)
+        self.started.set()
+        await self.server.serving
+
+    def run(self):
+        self.loop.run_until_complete(self.serve())
+
+    def start(self):
+        super().start()
+        assert self.started.wait(timeout=10), 'Simulator not started'
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.shutdown(), self.loop).result(timeout=10)
+        self.join(timeout=10)
+        self.loop.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -1,8 +1,13 @@
+import socket
+from contextlib import contextmanager
 from unittest import TestCase
+from unittest.mock import patch
 
 from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
 
-from energymeter2mqtt.api import get_ha_values
+from energymeter2mqtt.api import get_ha_values, get_modbus_client, get_modbus_clients
+from energymeter2mqtt.simulator import SimulatedBus, SimulatorThread, get_simulator_context
+from energymeter2mqtt.user_settings import EnergyMeter
 
 
 class ModbusClientMock:
@@ -18,6 +23,33 @@ class ModbusClientMock:
         return response
 
 
+def create_local_connection(address, timeout=None, source_address=None):
+    """
+    Replacement for the denied socket.create_connection() that allows only connections to localhost.
+    """
+    assert address[0] == '127.0.0.1', f'Deny connection to {address=}'
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(address)
+    return sock
+
+
+@contextmanager
+def simulated_meters(*, transport: str = 'tcp', device_ids=(1,), **bus_kwargs):
+    """
+    Run simulated Saia meters in a background thread and allow connections to them.
+    """
+    energy_meter = EnergyMeter()
+    context = get_simulator_context(
+        definitions=energy_meter.get_definitions(),
+        device_ids=device_ids,
+        bus=SimulatedBus(**bus_kwargs),
+    )
+    with SimulatorThread(context=context, transport=transport) as simulator:
+        with patch('socket.create_connection', create_local_connection):
+            yield simulator
+
+
 class ApiTestCase(TestCase):
     def test_get_ha_values(self):
         client = ModbusClientMock(mock_data={28: [1, 0]})
@@ -34,3 +66,62 @@ class ApiTestCase(TestCase):
         ]
         register2values = get_ha_values(client=client, parameters=parameters, device_id=0x001)
         self.assertEqual(register2values, {28: 0.01})
+
+    def test_get_ha_values_block_reads(self):
+        parameters = [
+            {'register': 28, 'reg_count': 2, 'name': 'Energy Counter Total', 'scale': 0.01},
+            {'register': 30, 'reg_count': 2, 'name': 'Energy Counter Partial', 'scale': 0.01},
+            {'register': 35, 'name': 'Voltage', 'scale': 1},
+            {'register': 36, 'name': 'Current', 'scale': 0.1},
+        ]
+
+        client = ModbusClientMock(mock_data={28: [1, 1, 2, 0], 35: [230, 12]})
+        register2values = get_ha_values(client=client, parameters=parameters, device_id=0x001)
+        self.assertEqual(register2values, {28: 655.37, 30: 0.02, 35: 230.0, 36: 1.2})
+        self.assertEqual(
+            client.calls,
+            [
+                {'address': 28, 'count': 4, 'device_id': 1},
+                {'address': 35, 'count': 2, 'device_id': 1},
+            ],
+        )
+
+        client = ModbusClientMock(mock_data={28: [1, 1, 2, 0, 0, 0, 0, 230, 12]})
+        register2values = get_ha_values(client=client, parameters=parameters, device_id=0x001, max_gap=3)
+        self.assertEqual(register2values, {28: 655.37, 30: 0.02, 35: 230.0, 36: 1.2})
+        self.assertEqual(client.calls, [{'address': 28, 'count': 9, 'device_id': 1}])
+
+    def test_tcp_transports(self):
+        parameters = [
+            {'register': 28, 'reg_count': 2, 'name': 'Energy Counter Total', 'scale': 0.01},
+            {'register': 35, 'name': 'Voltage', 'scale': 1},
+        ]
+        for transport in ('tcp', 'rtu-over-tcp'):
+            with self.subTest(transport), simulated_meters(transport=transport, device_ids=(2,)) as simulator:
+                energy_meter = EnergyMeter(transport=transport, host='127.0.0.1', tcp_port=simulator.port, device_id=2)
+                self.assertEqual(energy_meter.bus, f'127.0.0.1:{simulator.port}')
+
+                client = get_modbus_client(energy_meter, energy_meter.get_definitions(), verbosity=0)
+                try:
+                    register2values = get_ha_values(client=client, parameters=parameters, device_id=2)
+                finally:
+                    client.close()
+                self.assertEqual(register2values, {28: 0.01, 35: 250.0})
+
+    def test_get_modbus_clients_per_bus(self):
+        energy_meters = [
+            EnergyMeter(port='/dev/ttyUSB0', device_id=1),
+            EnergyMeter(port='/dev/ttyUSB0', device_id=2),
+            EnergyMeter(transport='tcp', host='192.168.1.10', device_id=1),
+            EnergyMeter(transport='tcp', host='192.168.1.10', device_id=2),
+            EnergyMeter(transport='rtu-over-tcp', host='192.168.1.11', tcp_port=4196, device_id=1),
+        ]
+        bus2client = get_modbus_clients(energy_meters, verbosity=0)
+        self.assertEqual(
+            {bus: type(client).__name__ for bus, client in bus2client.items()},
+            {
+                '/dev/ttyUSB0': 'ModbusSerialClient',
+                '192.168.1.10:502': 'ModbusTcpClient',
+                '192.168.1.11:4196': 'ModbusTcpClient',
+            },
+        )
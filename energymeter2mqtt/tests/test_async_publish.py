@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from ha_services.mqtt4homeassistant.data_classes import MqttSettings
+
+from energymeter2mqtt.async_publish import (
+    async_get_ha_values,
+    async_publish_forever,
+    get_async_modbus_client,
+    poll_bus,
+)
+from energymeter2mqtt.tests.test_api import ModbusClientMock, simulated_meters
+from energymeter2mqtt.tests.test_mqtt_handler import get_handler
+from energymeter2mqtt.user_settings import EnergyMeter, GatewaySettings, UserSettings, ValueBufferSettings
+
+
+class AsyncModbusClientMock(ModbusClientMock):
+    async def read_holding_registers(self, **kwargs):
+        return super().read_holding_registers(**kwargs)
+
+
+class AsyncPublishTestCase(IsolatedAsyncioTestCase):
+    async def test_async_get_ha_values(self):
+        parameters = [
+            {'register': 28, 'reg_count': 2, 'name': 'Energy Counter Total', 'scale': 0.01},
+            {'register': 35, 'name': 'Voltage', 'scale': 1},
+        ]
+        client = AsyncModbusClientMock(mock_data={28: [1, 0], 35: [230]})
+        register2values = await async_get_ha_values(client=client, parameters=parameters, device_id=0x001)
+        self.assertEqual(register2values, {28: 0.01, 35: 230.0})
+        self.assertEqual(
+            client.calls,
+            [
+                {'address': 28, 'count': 2, 'device_id': 1},
+                {'address': 35, 'count': 1, 'device_id': 1},
+            ],
+        )
+
+    async def test_poll_bus(self):
+        with simulated_meters(device_ids=(1, 2)) as simulator:
+            energy_meter = EnergyMeter(transport='tcp', host='127.0.0.1', tcp_port=simulator.port, poll_interval=1)
+            user_settings = UserSettings(
+                mqtt=MqttSettings(main_uid='poll_bus_test'),
+                energy_meter=energy_meter,
+                additional_energy_meters=[{'device_id': 2}],
+                value_buffer=ValueBufferSettings(enabled=False),
+            )
+            handler = get_handler(user_settings)
+
+            # A slow MQTT broker must not block the event loop:
+            flush = handler.flush
+
+            def slow_flush():
+                time.sleep(0.2)
+                return flush()
+
+            handler.flush = slow_flush
+
+            client = get_async_modbus_client(energy_meter, energy_meter.get_definitions())
+            self.assertTrue(await client.connect())
+            self.addCleanup(client.close)
+
+            with ThreadPoolExecutor(max_workers=1) as publish_executor:
+                task = asyncio.create_task(
+                    poll_bus(
+                        client=client,
+                        energy_meters=user_settings.get_energy_meters(),
+                        energymeter_mqtt_handler=handler,
+                        publish_executor=publish_executor,
+                    )
+                )
+                ticks = 0
+                start = time.monotonic()
+                while time.monotonic() - start < 0.5:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+
+        self.assertGreater(ticks, 20)
+        voltage_topics = {
+            message['topic'].removeprefix('homeassistant/sensor/')
+            for message in handler.mqtt_client.get_state_messages()
+            if message['topic'].endswith('-voltage/state')
+        }
+        self.assertEqual(
+            voltage_topics,
+            {
+                'poll_bus_test-saia_pcd_ald1d5fd/poll_bus_test-saia_pcd_ald1d5fd-voltage/state',
+                'poll_bus_test-saia_pcd_ald1d5fd_2/poll_bus_test-saia_pcd_ald1d5fd_2-voltage/state',
+            },
+        )
+
+    def test_gateway_not_supported(self):
+        user_settings = UserSettings(gateway=GatewaySettings(enabled=True))
+        with (
+            patch('energymeter2mqtt.async_publish.setup_logging'),
+            patch('energymeter2mqtt.async_publish.get_user_settings', return_value=user_settings),
+            patch('energymeter2mqtt.async_publish.async_publish') as async_publish_mock,
+            self.assertRaisesRegex(AssertionError, 'Modbus gateway is not supported'),
+        ):
+            async_publish_forever(verbosity=0)
+        async_publish_mock.assert_not_called()
@@ -0,0 +1,23 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from energymeter2mqtt.benchmark import BenchmarkSettings, run_benchmark
+from energymeter2mqtt.tests.test_api import create_local_connection
+
+
+class BenchmarkTestCase(TestCase):
+    def test_run_benchmark(self):
+        with patch('socket.create_connection', create_local_connection):
+            results = run_benchmark(BenchmarkSettings(device_count=2, duration=1.5, max_read_gap=5))
+
+        self.assertEqual(results['settings']['device_count'], 2)
+        self.assertGreater(results['cycles'], 1)  # The first cycle creates the sensors and is slow
+        # One block read per energy meter and cycle:
+        self.assertEqual(results['reads'], results['cycles'] * 2)
+        # The "duration" is rounded to milliseconds:
+        values_per_second = results['reads'] * 7 / results['duration']
+        self.assertAlmostEqual(results['values_per_second'], values_per_second, delta=values_per_second * 0.001)
+        self.assertGreater(results['mqtt_messages'], 2 * 7)  # At least the config and first state per sensor
+        self.assertEqual(set(results['latency_ms']), {'read', 'decode', 'publish', 'cycle'})
+        self.assertGreater(results['latency_ms']['cycle']['p50'], 0)
+        self.assertGreater(results['max_rss_kb'], 0)
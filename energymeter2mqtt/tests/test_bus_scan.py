@@ -0,0 +1,20 @@
+from unittest import TestCase
+
+from energymeter2mqtt.bus_scan import scan_buses
+from energymeter2mqtt.tests.test_api import simulated_meters
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+class BusScanTestCase(TestCase):
+    def test_scan_buses(self):
+        with simulated_meters(transport='rtu-over-tcp', device_ids=(1, 3)) as simulator:
+            energy_meter = EnergyMeter(transport='rtu-over-tcp', host='127.0.0.1', tcp_port=simulator.port)
+            with self.assertLogs('energymeter2mqtt', level='INFO'):
+                results = scan_buses([energy_meter], device_ids=range(1, 6), max_register=100, timeout=0.1)
+
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result.bus, energy_meter.bus)
+        self.assertEqual(result.error, '')
+        # The simulated Saia meter has the registers 28-39:
+        self.assertEqual(result.device_id2ranges, {1: [(28, 12)], 3: [(28, 12)]})
@@ -0,0 +1,106 @@
+import queue
+import time
+from unittest import TestCase
+
+from energymeter2mqtt.bus_worker import BusWorker, start_bus_workers
+from energymeter2mqtt.metrics import PUBLISH_QUEUE_DROPPED
+from energymeter2mqtt.result_queue import ResultQueue
+from energymeter2mqtt.tests.test_api import ModbusClientMock
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+class SlowModbusClientMock(ModbusClientMock):
+    def read_holding_registers(self, **kwargs):
+        time.sleep(0.2)
+        return super().read_holding_registers(**kwargs)
+
+
+class BusWorkerTestCase(TestCase):
+    def test_parallel_buses(self):
+        energy_meters = [
+            EnergyMeter(port='/dev/ttyUSB0', device_id=1),
+            EnergyMeter(port='/dev/ttyUSB0', device_id=2),
+            EnergyMeter(port='/dev/ttyUSB1', device_id=1),
+        ]
+        mock_data = {28: [1, 0, 2, 0], 35: [230, 10, 500, 100, 95]}
+        bus2client = {
+            '/dev/ttyUSB0': SlowModbusClientMock(mock_data=mock_data),
+            '/dev/ttyUSB1': SlowModbusClientMock(mock_data=mock_data),
+        }
+        result_queue = queue.Queue()
+
+        start_time = time.monotonic()
+        workers = start_bus_workers(
+            bus2client=bus2client,
+            energy_meters=energy_meters,
+            result_queue=result_queue,
+        )
+        results = [result_queue.get(timeout=5) for _ in range(3)]
+        duration = time.monotonic() - start_time
+        for worker in workers:
+            worker.stop()
+            worker.join()
+
+        # Two block reads per meter: The bus with two meters needs ~0.8 sec, the other one ~0.4 sec
+        self.assertLess(duration, 1.1)
+
+        self.assertEqual(
+            sorted((energy_meter.bus, energy_meter.device_id) for energy_meter, _ in results),
+            [('/dev/ttyUSB0', 1), ('/dev/ttyUSB0', 2), ('/dev/ttyUSB1', 1)],
+        )
+        energy_meter, register2values = results[0]
+        self.assertEqual(
+            register2values,
+            {28: 0.01, 30: 0.02, 35: 230.0, 36: 1.0, 37: 5000.0, 38: 1000.0, 39: 0.95},
+        )
+
+    def test_publisher_falls_behind(self):
+        energy_meter = EnergyMeter(port='/dev/ttyUSB9', poll_interval=0.01)
+        mock_data = {28: [1, 0, 2, 0], 35: [230, 10, 500, 100, 95]}
+        result_queue = ResultQueue(maxsize=2)
+        worker = BusWorker(
+            bus=energy_meter.bus,
+            client=ModbusClientMock(mock_data=mock_data),
+            energy_meters=[energy_meter],
+            result_queue=result_queue,
+        )
+        # Nobody publishes the values: The worker polls nevertheless without waiting
+        with self.assertLogs('energymeter2mqtt', level='INFO'):
+            worker.start()
+            time.sleep(0.3)
+            worker.stop()
+            worker.join()
+
+        runs = sum(job.stats.runs for job in worker.scheduler.jobs())
+        self.assertGreater(runs, 10)
+        self.assertEqual(result_queue.qsize(), 2)  # All further reads are coalesced into the waiting ones
+        self.assertGreater(PUBLISH_QUEUE_DROPPED.get('/dev/ttyUSB9', 1), 10 * 7)
+
+    def test_no_energy_meters(self):
+        energy_meter = EnergyMeter(port='/dev/ttyUSB8')
+        mock_data = {28: [1, 0, 2, 0], 35: [230, 10, 500, 100, 95]}
+        result_queue = queue.Queue()
+        worker = BusWorker(
+            bus=energy_meter.bus,
+            client=ModbusClientMock(mock_data=mock_data),
+            energy_meters=[],
+            result_queue=result_queue,
+        )
+        with self.assertLogs('energymeter2mqtt', level='INFO'):
+            worker.start()
+            time.sleep(0.1)
+            self.assertTrue(worker.is_alive())  # Waits for a reload, instead of dying
+
+            # All energy meters added and removed by hot reloads:
+            worker.reload([energy_meter])
+            energy_meter, register2values = result_queue.get(timeout=5)
+            self.assertEqual(register2values[35], 230.0)
+
+            worker.reload([])
+            time.sleep(0.1)
+            self.assertTrue(worker.is_alive())
+            self.assertEqual(worker.scheduler.jobs(), [])
+
+            worker.stop()
+            worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
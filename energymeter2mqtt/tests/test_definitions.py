@@ -1,10 +1,27 @@
+import os
+import tempfile
+from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
 from ha_services.ha_data.validators import ValidationError, validate_sensor
 
 from energymeter2mqtt.user_settings import DEFINITION_FILES_PATH, parse_definition
 
 
+DEFINITION = """
+[connection]
+baudrate = 19200
+bytesize = 8
+parity = "N"
+stopbits = 2
+
+[[parameters]]
+register = 28
+name = "{name}"
+"""
+
+
 class DefinitionTestCase(TestCase):
     def test_validate_all_definitions(self):
         entries = DEFINITION_FILES_PATH.glob('*.toml')
@@ -21,3 +38,26 @@ class DefinitionTestCase(TestCase):
                     self.fail(
                         f'ValidationError for "{sensor_definition["name"]}":\n{err}'
                     )
+
+    def test_definition_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir, 'test_meter.toml')
+            path.write_text(DEFINITION.format(name='Energy'))
+            with patch('energymeter2mqtt.user_settings.DEFINITION_FILES_PATH', Path(temp_dir)):
+                with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+                    definitions = parse_definition('test_meter')
+                    self.assertEqual(parse_definition('test_meter'), definitions)
+                self.assertEqual(len(logs.output), 1)  # parsed only once
+                self.assertEqual(definitions['parameters'][0]['name'], 'Energy')
+
+                path.write_text(DEFINITION.format(name='Changed'))
+                stat = path.stat()
+                os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+                with self.assertLogs('energymeter2mqtt', level='INFO'):
+                    definitions = parse_definition('test_meter')
+                self.assertEqual(definitions['parameters'][0]['name'], 'Changed')
+
+                path.write_text(DEFINITION.format(name='Changed').replace('register = 28', 'register = "28"'))
+                os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000))
+                with self.assertRaisesRegex(AssertionError, 'Invalid register'), self.assertLogs('energymeter2mqtt'):
+                    parse_definition('test_meter')
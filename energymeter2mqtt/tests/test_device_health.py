@@ -0,0 +1,53 @@
+import queue
+import time
+from unittest import TestCase
+
+from energymeter2mqtt.api import get_modbus_client
+from energymeter2mqtt.bus_worker import BusWorker
+from energymeter2mqtt.tests.test_api import simulated_meters
+from energymeter2mqtt.user_settings import AdaptiveTimeoutSettings, EnergyMeter
+
+
+class DeviceHealthTestCase(TestCase):
+    def test_skip_dead_energy_meter(self):
+        with simulated_meters(transport='rtu-over-tcp', device_ids=(1,)) as simulator:
+            energy_meters = [
+                EnergyMeter(
+                    transport='rtu-over-tcp',
+                    host='127.0.0.1',
+                    tcp_port=simulator.port,
+                    device_id=device_id,
+                    timeout=0.3,
+                    retries=1,
+                    poll_interval=0.1,
+                )
+                for device_id in (1, 2)  # Device id 2 doesn't respond
+            ]
+            client = get_modbus_client(energy_meters[0], energy_meters[0].get_definitions(), verbosity=0)
+            result_queue = queue.Queue()
+            worker = BusWorker(
+                bus=energy_meters[0].bus,
+                client=client,
+                energy_meters=energy_meters,
+                result_queue=result_queue,
+                adaptive_timeout=AdaptiveTimeoutSettings(min_samples=5, failure_threshold=2),
+            )
+            with self.assertLogs('energymeter2mqtt', level='WARNING') as logs:
+                worker.start()
+                time.sleep(2.5)
+                worker.stop()
+                worker.join()
+            client.close()
+
+        self.assertIn('Skip 127.0.0.1:', '\n'.join(logs.output))
+
+        device_ids = [energy_meter.device_id for energy_meter, _ in result_queue.queue]
+        self.assertEqual(set(device_ids), {1})
+        # Without skipping device id 2, every poll run would take 2 x 0.3 sec. -> ~4 reads
+        self.assertGreater(len(device_ids), 10)
+
+        healthy = worker.device_health.device_id2health[1]
+        self.assertLess(healthy.get_timeout(), 0.3)
+        dead = worker.device_health.device_id2health[2]
+        self.assertGreaterEqual(dead.failures, 2)
+        self.assertEqual(dead.get_retries(), 0)
@@ -0,0 +1,71 @@
+import queue
+from unittest import TestCase
+
+from pymodbus.client import ModbusTcpClient
+
+from energymeter2mqtt.api import get_modbus_client
+from energymeter2mqtt.bus_worker import BusWorker
+from energymeter2mqtt.gateway import start_gateway
+from energymeter2mqtt.metrics import GATEWAY_REQUESTS
+from energymeter2mqtt.register_cache import RegisterCache
+from energymeter2mqtt.tests.test_api import simulated_meters
+from energymeter2mqtt.user_settings import EnergyMeter, GatewaySettings
+
+
+class GatewayTestCase(TestCase):
+    def test_gateway(self):
+        with simulated_meters(device_ids=(1, 2)) as simulator:
+            energy_meter = EnergyMeter(transport='tcp', host='127.0.0.1', tcp_port=simulator.port, poll_interval=600)
+            client = get_modbus_client(energy_meter, energy_meter.get_definitions(), verbosity=0)
+            self.addCleanup(client.close)
+
+            register_cache = RegisterCache()
+            result_queue = queue.Queue()
+            worker = BusWorker(
+                bus=energy_meter.bus,
+                client=client,
+                energy_meters=[energy_meter],
+                result_queue=result_queue,
+                register_cache=register_cache,
+            )
+            with self.assertLogs('energymeter2mqtt', level='INFO'):
+                worker.start()
+                self.addCleanup(worker.join)
+                self.addCleanup(worker.stop)
+                _, register2values = result_queue.get(timeout=10)  # The first poll run is done
+                self.assertEqual(register2values[35], 250.0)
+
+                gateway_thread = start_gateway(
+                    settings=GatewaySettings(port=0),
+                    bus2worker={worker.bus: worker},
+                    register_cache=register_cache,
+                )
+            self.addCleanup(gateway_thread.stop)
+
+            scada_client = ModbusTcpClient('127.0.0.1', port=gateway_thread.port, timeout=5, retries=0)
+            self.addCleanup(scada_client.close)
+            bus = simulator.context[1].bus
+            bus_requests = bus.requests
+
+            # Polled registers are answered from the last read:
+            response = scada_client.read_holding_registers(address=35, count=2, device_id=1)
+            self.assertEqual(response.registers, [250, 0])
+            self.assertEqual(bus.requests, bus_requests)
+            self.assertEqual(GATEWAY_REQUESTS.get(1, 'cache'), 1)
+
+            # Other reads are send to the bus by the worker:
+            response = scada_client.read_holding_registers(address=35, count=1, device_id=2)
+            self.assertEqual(response.registers, [250])
+            self.assertEqual(bus.requests, bus_requests + 1)
+            self.assertEqual(GATEWAY_REQUESTS.get(2, 'forwarded'), 1)
+
+            response = scada_client.read_holding_registers(address=1000, count=1, device_id=2)
+            self.assertTrue(response.isError())
+            self.assertEqual(response.exception_code, 2)  # Illegal address response of the energy meter
+            self.assertEqual(bus.requests, bus_requests + 2)
+
+            # Energy meters are read-only:
+            response = scada_client.write_register(address=35, value=1, device_id=1)
+            self.assertTrue(response.isError())
+            self.assertEqual(response.exception_code, 1)  # Illegal function
+            self.assertEqual(bus.requests, bus_requests + 2)
@@ -0,0 +1,169 @@
+import copy
+import os
+import queue
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from ha_services.mqtt4homeassistant.data_classes import MqttSettings
+
+from energymeter2mqtt.bus_worker import BusWorker
+from energymeter2mqtt.hot_reload import FileWatcher, SettingsReloader
+from energymeter2mqtt.tests.test_mqtt_handler import get_handler
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, ValueBufferSettings
+
+
+def touch(path: Path, offset: int):
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset * 1_000_000))
+
+
+class HotReloadTestCase(TestCase):
+    def test_file_watcher(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            settings_path = Path(temp_dir, 'settings.toml')
+            settings_path.touch()
+            definition_path = Path(temp_dir, 'definition.toml')
+
+            watcher = FileWatcher([settings_path, definition_path])
+            self.assertEqual(watcher.changed(), [])
+
+            touch(settings_path, offset=1)
+            definition_path.touch()
+            self.assertEqual(watcher.changed(), [settings_path, definition_path])
+            self.assertEqual(watcher.changed(), [])
+
+            definition_path.unlink()
+            watcher.set_paths([settings_path, definition_path])
+            self.assertEqual(watcher.changed(), [definition_path])
+
+    def test_bus_worker_reload(self):
+        energy_meter1 = EnergyMeter(device_id=1)
+        energy_meter2 = EnergyMeter(device_id=2)
+        worker = BusWorker(
+            bus=energy_meter1.bus,
+            client=None,
+            energy_meters=[energy_meter1],
+            result_queue=queue.Queue(),
+        )
+        with self.assertLogs('energymeter2mqtt', level='INFO'):
+            worker.apply_energy_meters([energy_meter1], now=0)
+        jobs1 = worker.scheduler.jobs()
+        self.assertEqual({job.energy_meter.device_id for job in jobs1}, {1})
+
+        # Unchanged energy meters keep their jobs:
+        with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+            worker.apply_energy_meters([energy_meter1, energy_meter2], now=1)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Add /dev/ttyUSB0 (device id: 2)', logs.output[0])
+        self.assertEqual([job for job in worker.scheduler.jobs() if job.energy_meter.device_id == 1], jobs1)
+
+        # Changed settings of an energy meter: Only this one is rescheduled:
+        changed_energy_meter1 = EnergyMeter(device_id=1, poll_interval=2)
+        with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+            worker.apply_energy_meters([changed_energy_meter1, energy_meter2], now=2)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('Remove /dev/ttyUSB0 (device id: 1)', logs.output[0])
+        self.assertIn('Add /dev/ttyUSB0 (device id: 1)', logs.output[1])
+        intervals = {job.interval for job in worker.scheduler.jobs() if job.energy_meter.device_id == 1}
+        self.assertEqual(intervals, {2})
+
+        with self.assertLogs('energymeter2mqtt', level='INFO'):
+            worker.apply_energy_meters([energy_meter2], now=3)
+        self.assertEqual({job.energy_meter.device_id for job in worker.scheduler.jobs()}, {2})
+
+    def test_update_sensors(self):
+        energy_meter = EnergyMeter()
+        definitions = energy_meter.get_definitions()
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='hot_reload_test'),
+            energy_meter=energy_meter,
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        with patch.object(EnergyMeter, 'get_definitions', return_value=definitions):
+            handler = get_handler(user_settings)
+        meter_device = handler.meter_devices[(energy_meter.bus, energy_meter.device_id)]
+        voltage_sensor = meter_device.register2sensor[35]
+        current_sensor = meter_device.register2sensor[36]
+
+        new_definitions = copy.deepcopy(definitions)
+        parameters = [parameter for parameter in new_definitions['parameters'] if parameter['register'] != 37]
+        for parameter in parameters:
+            if parameter['register'] == 36:  # Current
+                parameter['scale'] = 0.01
+        new_definitions['parameters'] = parameters
+
+        with patch.object(EnergyMeter, 'get_definitions', return_value=new_definitions):
+            with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+                handler.update_energy_meters([energy_meter])
+        self.assertIn("MQTT device 'saia_pcd_ald1d5fd': 2 parameters changed", '\n'.join(logs.output))
+
+        self.assertIs(meter_device.register2sensor[35], voltage_sensor)  # unchanged
+        self.assertIsNot(meter_device.register2sensor[36], current_sensor)  # recreated with the new scale
+        self.assertNotIn(37, meter_device.register2sensor)
+
+        # Home Assistant removes the entity of the removed power sensor:
+        self.assertEqual(
+            handler.mqtt_client.messages,
+            [
+                {
+                    'topic': 'homeassistant/sensor/hot_reload_test-saia_pcd_ald1d5fd'
+                    '/hot_reload_test-saia_pcd_ald1d5fd-power/config',
+                    'payload': '',
+                    'qos': 0,
+                    'retain': True,
+                }
+            ],
+        )
+        self.assertNotIn('hot_reload_test-saia_pcd_ald1d5fd-power', meter_device.mqtt_device.components)
+
+        # Values of removed energy meters are skipped:
+        with self.assertLogs('energymeter2mqtt', level='INFO'):
+            handler.update_energy_meters([])
+        self.assertEqual(handler.meter_devices, {})
+        handler(energy_meter, {35: 230})
+        self.assertEqual(handler.mqtt_client.get_state_messages(), [])
+
+    def test_reloader(self):
+        energy_meter = EnergyMeter(device_id=1)
+        user_settings = UserSettings(energy_meter=energy_meter)
+        new_user_settings = UserSettings(
+            energy_meter=energy_meter,
+            additional_energy_meters=[{'device_id': 2}, {'port': '/dev/ttyUSB1', 'device_id': 1}],
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            settings_path = Path(temp_dir, 'settings.toml')
+            settings_path.touch()
+
+            handler = MagicMock()
+            worker = MagicMock()
+            reloader = SettingsReloader(
+                settings_path=settings_path,
+                load_settings=lambda: new_user_settings,
+                user_settings=user_settings,
+                energymeter_mqtt_handler=handler,
+                bus2worker={'/dev/ttyUSB0': worker},
+                result_queue=queue.Queue(),
+                verbosity=0,
+            )
+            reloader.next_check = 0
+            self.assertFalse(reloader.check())
+
+            touch(settings_path, offset=1)
+            reloader.next_check = 0
+            with (
+                patch('energymeter2mqtt.hot_reload.get_modbus_client'),
+                patch('energymeter2mqtt.hot_reload.BusWorker') as bus_worker_mock,
+                self.assertLogs('energymeter2mqtt'),
+            ):
+                self.assertTrue(reloader.check())
+
+        new_energy_meters = new_user_settings.get_energy_meters()
+        handler.update_energy_meters.assert_called_once_with(new_energy_meters)
+        worker.reload.assert_called_once_with(new_energy_meters[:2])
+
+        # A new worker polls the new bus:
+        self.assertEqual(list(reloader.bus2worker), ['/dev/ttyUSB0', '/dev/ttyUSB1'])
+        self.assertEqual(bus_worker_mock.call_args.kwargs['energy_meters'], new_energy_meters[2:])
+        bus_worker_mock.return_value.start.assert_called_once_with()
@@ -0,0 +1,116 @@
+import http.client
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from energymeter2mqtt.api import read_values
+from energymeter2mqtt.decode_plan import compile_decode_plan
+from energymeter2mqtt.last_values import LAST_VALUES
+from energymeter2mqtt.metrics import MODBUS_ERRORS, MODBUS_READ_SECONDS, MODBUS_RETRIES, start_metrics_server
+from energymeter2mqtt.tests.test_api import ModbusClientMock, create_local_connection
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+class ResponseModbusClientMock:
+    def __init__(self, response):
+        self.response = response
+
+    def read_holding_registers(self, **kwargs):
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class MetricsTestCase(TestCase):
+    def test_read_values_metrics(self):
+        decode_plan = compile_decode_plan([{'register': 28, 'reg_count': 2, 'scale': 0.01}])
+
+        client = ModbusClientMock(mock_data={28: [1, 0]})
+        read_values(client=client, decode_plan=decode_plan, device_id=1, bus='test-ok')
+        self.assertEqual(MODBUS_READ_SECONDS.values[('test-ok', 1, 28)][2], 1)  # observation count
+
+        response = ExceptionResponse(0x03, exception_code=6)
+        client = ResponseModbusClientMock(response)
+        with self.assertLogs('energymeter2mqtt', level='ERROR'):
+            self.assertEqual(read_values(client=client, decode_plan=decode_plan, device_id=1, bus='test-err'), {})
+        self.assertEqual(MODBUS_ERRORS.get('test-err', 1, 28, 'exception_6'), 1)
+
+        client = ResponseModbusClientMock(ModbusIOException('No response'))
+        with self.assertRaises(ModbusIOException):
+            read_values(client=client, decode_plan=decode_plan, device_id=2, bus='test-err')
+        self.assertEqual(MODBUS_ERRORS.get('test-err', 2, 28, 'timeout'), 1)
+        self.assertEqual(MODBUS_READ_SECONDS.values[('test-err', 2, 28)][2], 1)
+
+        client = ModbusClientMock(mock_data={28: [1]})
+        with self.assertLogs('energymeter2mqtt', level='ERROR'):
+            self.assertEqual(read_values(client=client, decode_plan=decode_plan, device_id=3, bus='test-err'), {})
+        self.assertEqual(MODBUS_ERRORS.get('test-err', 3, 28, 'incomplete'), 1)
+
+    def test_retries(self):
+        decode_plan = compile_decode_plan([{'register': 35}])
+        response = ReadHoldingRegistersResponse(registers=[230])
+        response.retries = 2
+        client = ResponseModbusClientMock(response)
+        register2values = read_values(client=client, decode_plan=decode_plan, device_id=1, bus='test-retry')
+        self.assertEqual(register2values, {35: 230})
+        self.assertEqual(MODBUS_RETRIES.get('test-retry', 1), 2)
+
+    def test_metrics_server(self):
+        MODBUS_ERRORS.inc('/dev/ttyTEST', 1, 28, 'timeout')
+
+        server = start_metrics_server(host='127.0.0.1', port=0)
+        try:
+            port = server.server_address[1]
+            with patch('socket.create_connection', create_local_connection):
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', '/metrics')
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                self.assertIn('text/plain', response.getheader('Content-Type'))
+                body = response.read().decode('UTF-8')
+
+                connection.request('GET', '/foo')
+                response = connection.getresponse()
+                response.read()
+                self.assertEqual(response.status, 404)
+                connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertIn('# TYPE energymeter2mqtt_modbus_read_seconds histogram', body)
+        self.assertIn('# TYPE energymeter2mqtt_poll_overruns_total counter', body)
+        self.assertIn(
+            'energymeter2mqtt_modbus_errors_total{bus="/dev/ttyTEST",device_id="1",register="28",error="timeout"} 1',
+            body,
+        )
+
+    def test_values_endpoint(self):
+        energy_meter = EnergyMeter(port='/dev/ttyVALUES')
+        self.addCleanup(LAST_VALUES.remove, energy_meter)
+        LAST_VALUES.update(energy_meter, {35: 230, 37: 1.5})
+
+        server = start_metrics_server(host='127.0.0.1', port=0)
+        try:
+            port = server.server_address[1]
+            with patch('socket.create_connection', create_local_connection):
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', '/values')
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response.getheader('Content-Type'), 'application/json')
+                rows = json.loads(response.read())
+                connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        rows = [row for row in rows if row['bus'] == '/dev/ttyVALUES']
+        self.assertEqual(
+            [(row['device_id'], row['register'], row['value'], row['quality']) for row in rows],
+            [(1, 35, 230, 'good'), (1, 37, 1.5, 'good')],
+        )
@@ -0,0 +1,320 @@
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from ha_services.mqtt4homeassistant.data_classes import MqttSettings
+from ha_services.mqtt4homeassistant.mocks.mqtt_client_mock import MqttClientMock
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, MQTTMessageInfo
+
+from energymeter2mqtt.mqtt_handler import EnergyMeterMqttHandler
+from energymeter2mqtt.user_settings import EnergyMeter, PublishSettings, UserSettings, ValueBufferSettings
+
+
+class LoopMqttClientMock(MqttClientMock):
+    connected = True
+    publish_rc = MQTT_ERR_SUCCESS  # e.g.: MQTT_ERR_NO_CONN, if the connection is lost while publishing
+
+    def loop_start(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def publish(self, **kwargs) -> MQTTMessageInfo:
+        super().publish(**kwargs)
+        info = MQTTMessageInfo(mid=len(self.messages))
+        info.rc = self.publish_rc
+        if info.rc == MQTT_ERR_SUCCESS:
+            info._set_as_published()
+        return info
+
+
+def get_handler(user_settings: UserSettings) -> EnergyMeterMqttHandler:
+    value_buffer = user_settings.value_buffer
+    # Never replay and delete the buffered values of the developer machine:
+    assert not value_buffer.enabled or value_buffer.path != ValueBufferSettings.path, 'Use a temp. value buffer!'
+    with patch('energymeter2mqtt.mqtt_handler.get_connected_client', return_value=LoopMqttClientMock()):
+        return EnergyMeterMqttHandler(user_settings=user_settings, verbosity=0)
+
+
+class EnergyMeterMqttHandlerTestCase(TestCase):
+    def test_multiple_energy_meters(self):
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='multi_meter_test'),
+            energy_meter=EnergyMeter(port='/dev/ttyUSB0', device_id=1),
+            additional_energy_meters=[{'device_id': 2}, {'port': '/dev/ttyUSB1', 'device_id': 1}],
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        handler = get_handler(user_settings)
+
+        self.assertEqual(
+            [meter_device.mqtt_device.uid for meter_device in handler.meter_devices.values()],
+            [
+                'multi_meter_test-saia_pcd_ald1d5fd',
+                'multi_meter_test-saia_pcd_ald1d5fd_2',
+                'multi_meter_test-saia_pcd_ald1d5fd_1',
+            ],
+        )
+
+        energy_meter = user_settings.get_energy_meters()[1]
+        handler(energy_meter, {35: 230})
+        self.assertEqual(
+            handler.mqtt_client.get_state_messages(),
+            [
+                {
+                    'topic': (
+                        'homeassistant/sensor/multi_meter_test-saia_pcd_ald1d5fd_2'
+                        '/multi_meter_test-saia_pcd_ald1d5fd_2-voltage/state'
+                    ),
+                    'payload': 230,
+                    'qos': 0,
+                    'retain': False,
+                }
+            ],
+        )
+
+    def test_publish_on_change(self):
+        energy_meter = EnergyMeter()
+        definitions = energy_meter.get_definitions()
+        for parameter in definitions['parameters']:
+            if parameter['register'] == 35:  # Voltage
+                parameter.update(deadband='1%', max_silence_seconds=60)
+
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='publish_on_change_test'),
+            energy_meter=energy_meter,
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        with patch.object(EnergyMeter, 'get_definitions', return_value=definitions):
+            handler = get_handler(user_settings)
+
+        published = []
+        with patch('time.monotonic') as monotonic_mock:
+            for now, voltage in ((0, 230), (10, 231), (20, 233), (30, 234), (80, 234), (90, 234)):
+                monotonic_mock.return_value = now
+                handler.mqtt_client.messages.clear()
+                handler(energy_meter, {35: voltage, 37: 100})
+                published.append((now, [message['payload'] for message in handler.mqtt_client.get_state_messages()]))
+
+        self.assertEqual(
+            published,
+            [
+                (0, [230, 100]),  # First values
+                (10, [100]),  # Voltage changed less than 1%
+                (20, [233, 100]),  # Changed more than 1%
+                (30, [100]),
+                (80, [234, 100]),  # Heartbeat after 60 seconds silence
+                (90, [100]),
+            ],
+        )
+
+    def test_fast_poll_interval(self):
+        energy_meter = EnergyMeter(poll_interval=0.2)
+        definitions = energy_meter.get_definitions()
+        for parameter in definitions['parameters']:
+            if parameter['register'] == 28:  # Energy Counter Total
+                parameter['poll_interval'] = 10
+
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='fast_poll_test'),
+            energy_meter=energy_meter,
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        with patch.object(EnergyMeter, 'get_definitions', return_value=definitions):
+            handler = get_handler(user_settings)
+        [meter_device] = handler.meter_devices.values()
+        self.assertEqual(meter_device.register2sensor[37].throttle_sec, 0.1)  # Half of the poll interval
+        self.assertEqual(meter_device.register2sensor[28].throttle_sec, 1)  # Default of ha_services
+
+        # Every read value is published:
+        published = []
+        with patch('time.monotonic') as monotonic_mock:
+            for now, power in ((0, 100), (0.2, 101), (0.4, 102)):
+                monotonic_mock.return_value = now
+                handler.mqtt_client.messages.clear()
+                handler(energy_meter, {37: power})
+                published.append([message['payload'] for message in handler.mqtt_client.get_state_messages()])
+        self.assertEqual(published, [[100], [101], [102]])
+
+        # A hot reload applies a changed poll interval also to the unchanged parameters:
+        energy_meter = EnergyMeter(poll_interval=10)
+        with patch.object(EnergyMeter, 'get_definitions', return_value=definitions):
+            self.assertEqual(meter_device.update(energy_meter=energy_meter, mqtt_client=handler.mqtt_client), set())
+        self.assertEqual(meter_device.register2sensor[37].throttle_sec, 1)
+
+    def test_aggregate_window(self):
+        energy_meter = EnergyMeter()
+        definitions = energy_meter.get_definitions()
+        for parameter in definitions['parameters']:
+            if parameter['register'] == 37:  # Power
+                parameter['aggregate_window'] = 10
+
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='aggregate_test'),
+            energy_meter=energy_meter,
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        with patch.object(EnergyMeter, 'get_definitions', return_value=definitions):
+            handler = get_handler(user_settings)
+
+        with patch('time.monotonic') as monotonic_mock:
+            for now, power in ((0, 100), (2, 200), (4, 100)):
+                monotonic_mock.return_value = now
+                handler(energy_meter, {37: power})
+            self.assertEqual(handler.mqtt_client.get_state_messages(), [])
+
+            monotonic_mock.return_value = 10
+            handler(energy_meter, {37: 100})
+
+        self.assertEqual(
+            {
+                message['topic'].rsplit('/', 2)[-2]: message['payload']
+                for message in handler.mqtt_client.get_state_messages()
+            },
+            {
+                'aggregate_test-saia_pcd_ald1d5fd-power': 100,
+                'aggregate_test-saia_pcd_ald1d5fd-power_mean': 125.0,
+                'aggregate_test-saia_pcd_ald1d5fd-power_min': 100,
+                'aggregate_test-saia_pcd_ald1d5fd-power_max': 200,
+                'aggregate_test-saia_pcd_ald1d5fd-power_twa': 120.0,
+            },
+        )
+
+    def test_value_buffer(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            user_settings = UserSettings(
+                mqtt=MqttSettings(main_uid='value_buffer_test'),
+                value_buffer=ValueBufferSettings(path=f'{temp_dir}/buffer.sqlite3', replay_batch_size=3),
+            )
+            energy_meter = user_settings.energy_meter
+            handler = get_handler(user_settings)
+
+            handler.mqtt_client.connected = False
+            with self.assertLogs('energymeter2mqtt', level='WARNING'):
+                with patch('time.time', return_value=100.0):
+                    handler(energy_meter, {28: 1.5, 35: 230})
+                with patch('time.time', return_value=110.0):
+                    handler(energy_meter, {28: 1.6, 35: 231})
+            self.assertEqual(handler.mqtt_client.messages, [])
+            self.assertEqual(len(handler.value_buffer), 4)
+
+            # Values of a removed energy meter:
+            handler.value_buffer.store(bus=energy_meter.bus, device_id=9, timestamp=120.0, register2values={35: 1})
+
+            def get_payloads():
+                payloads = [
+                    (message['topic'].rsplit('/', 2)[-2:], message['payload'])
+                    for message in handler.mqtt_client.messages
+                    if not message['topic'].endswith('/config')
+                ]
+                handler.mqtt_client.messages.clear()
+                return payloads
+
+            # The connection is lost again while replaying: Nothing is removed from the buffer
+            handler.mqtt_client.connected = True
+            handler.mqtt_client.publish_rc = MQTT_ERR_NO_CONN
+            with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+                handler(energy_meter, {})
+            self.assertEqual(
+                logs.output,
+                [
+                    'WARNING:energymeter2mqtt.mqtt_handler:'
+                    '3 buffered values not acknowledged by the broker: Publish them again later',
+                    'INFO:energymeter2mqtt.mqtt_handler:0 buffered values published, 0 skipped, 5 left',
+                ],
+            )
+            self.assertEqual(len(handler.value_buffer), 5)
+            handler.mqtt_client.messages.clear()
+
+            # After reconnect: The buffered values are published with their read time, before the current values:
+            handler.mqtt_client.publish_rc = MQTT_ERR_SUCCESS
+            with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+                handler(energy_meter, {28: 1.7})
+            replay_messages = [
+                message for message in handler.mqtt_client.messages if message['topic'].endswith('/replay')
+            ]
+            self.assertEqual([message['qos'] for message in replay_messages], [1, 1])  # At least once
+            self.assertEqual(
+                logs.output,
+                ['INFO:energymeter2mqtt.mqtt_handler:3 buffered values published, 0 skipped, 2 left'],
+            )
+            self.assertEqual(
+                get_payloads(),
+                [
+                    (
+                        ['value_buffer_test-saia_pcd_ald1d5fd-energy_counter_total', 'replay'],
+                        '[{"timestamp": 100.0, "value": 1.5}, {"timestamp": 110.0, "value": 1.6}]',
+                    ),
+                    (
+                        ['value_buffer_test-saia_pcd_ald1d5fd-voltage', 'replay'],
+                        '[{"timestamp": 100.0, "value": 230.0}]',
+                    ),
+                    (['value_buffer_test-saia_pcd_ald1d5fd-energy_counter_total', 'state'], 1.7),
+                ],
+            )
+
+            with self.assertLogs('energymeter2mqtt', level='INFO') as logs:
+                handler(energy_meter, {35: 232})
+            self.assertEqual(
+                logs.output,
+                ['INFO:energymeter2mqtt.mqtt_handler:1 buffered values published, 1 skipped, 1 left'],
+            )
+            self.assertEqual(
+                get_payloads(),
+                [
+                    (
+                        ['value_buffer_test-saia_pcd_ald1d5fd-voltage', 'replay'],
+                        '[{"timestamp": 110.0, "value": 231.0}]',
+                    ),
+                    (['value_buffer_test-saia_pcd_ald1d5fd-voltage', 'state'], 232),
+                ],
+            )
+
+            # The values of the removed energy meter are kept, but not published again:
+            handler(energy_meter, {37: 100})
+            self.assertEqual(get_payloads(), [(['value_buffer_test-saia_pcd_ald1d5fd-power', 'state'], 100)])
+            self.assertEqual(
+                handler.value_buffer.get_batch(limit=10),
+                [(5, 120.0, energy_meter.bus, 9, 35, 1.0)],
+            )
+
+    def test_json_state(self):
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='json_state_test'),
+            publish=PublishSettings(json_state=True, qos=1, retain=True),
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        energy_meter = user_settings.energy_meter
+        handler = get_handler(user_settings)
+
+        with patch('time.monotonic', return_value=0):
+            handler.collect(energy_meter, {35: 230, 37: 100})
+            handler.collect(energy_meter, {28: 1.5})
+            self.assertEqual(handler.mqtt_client.messages, [])
+            handler.flush()
+
+        # All values of the energy meter in one message:
+        self.assertEqual(
+            handler.mqtt_client.get_state_messages(),
+            [
+                {
+                    'topic': 'homeassistant/sensor/json_state_test-saia_pcd_ald1d5fd/state',
+                    'payload': '{"energy_counter_total": 1.5, "power": 100, "voltage": 230}',
+                    'qos': 1,
+                    'retain': True,
+                }
+            ],
+        )
+        config = {payload['unique_id']: payload for payload in handler.mqtt_client.get_config_payload()}
+        voltage_config = config['json_state_test-saia_pcd_ald1d5fd-voltage']
+        self.assertEqual(voltage_config['state_topic'], 'homeassistant/sensor/json_state_test-saia_pcd_ald1d5fd/state')
+        self.assertEqual(voltage_config['value_template'], '{{ value_json.voltage }}')
+
+        # The state contains always all last values:
+        handler.mqtt_client.messages.clear()
+        with patch('time.monotonic', return_value=10):
+            handler(energy_meter, {37: 200})
+        self.assertEqual(
+            [message['payload'] for message in handler.mqtt_client.get_state_messages()],
+            ['{"energy_counter_total": 1.5, "power": 200, "voltage": 230}'],
+        )
@@ -0,0 +1,24 @@
+import io
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+from energymeter2mqtt.probe_usb_ports import print_parameter_values
+from energymeter2mqtt.tests.test_api import ModbusClientMock
+
+
+class ProbeUsbPortsTestCase(TestCase):
+    def test_print_parameter_values(self):
+        parameters = [
+            {'register': 28, 'reg_count': 2, 'name': 'Energy Counter Total', 'scale': 0.01, 'uom': 'kWh'},
+            {'register': 30, 'data_type': 'int16', 'name': 'Power'},
+            {'register': 40, 'reg_count': 2, 'data_type': 'float32', 'word_order': 'big', 'name': 'Voltage'},
+        ]
+        client = ModbusClientMock(mock_data={28: [1, 1, 0xFFFE], 40: [0x4366, 0x199A]})
+        with redirect_stdout(io.StringIO()) as stdout:
+            print_parameter_values(client, parameters, device_id=1, verbosity=1)
+        output = stdout.getvalue()
+
+        # Same values as published:
+        self.assertIn('Energy Counter Total (Register dez: 28 hex: 001c, count=2) 655.37 kWh', output)
+        self.assertIn('Power (Register dez: 30 hex: 001e, count=1) -2', output)
+        self.assertIn('Voltage (Register dez: 40 hex: 0028, count=2) 230.10000610351562', output)
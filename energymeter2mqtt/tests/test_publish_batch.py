@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from ha_services.mqtt4homeassistant.mocks.mqtt_client_mock import MqttClientMock
+from paho.mqtt.client import MQTTMessageInfo
+
+from energymeter2mqtt.publish_batch import PublishBatch
+
+
+class PendingMqttClientMock(MqttClientMock):
+    """
+    Messages are completed only by complete_all(), like a slow broker.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.infos = []
+
+    def publish(self, **kwargs) -> MQTTMessageInfo:
+        self.messages.append(kwargs)
+        info = MQTTMessageInfo(mid=len(self.messages))
+        self.infos.append(info)
+        return info
+
+    def complete_all(self):
+        for info in self.infos:
+            info._set_as_published()
+
+
+class PublishBatchTestCase(TestCase):
+    def test_coalesce(self):
+        client = PendingMqttClientMock()
+        batch = PublishBatch(client, max_inflight=10, timeout=1)
+        batch.publish(topic='a/state', payload=1)
+        batch.publish(topic='b/state', payload={'voltage': 230})
+        batch.publish(topic='a/state', payload=2, qos=1)
+        batch.publish(topic='b/state', payload={'power': 100})
+        self.assertEqual(len(batch), 2)
+
+        self.assertEqual(batch.flush(), 2)
+        self.assertEqual(
+            client.messages,
+            [
+                {'topic': 'a/state', 'payload': 2, 'qos': 1, 'retain': False},
+                {'topic': 'b/state', 'payload': '{"power": 100, "voltage": 230}', 'qos': 0, 'retain': False},
+            ],
+        )
+        self.assertEqual(batch.flush(), 0)
+
+    def test_inflight_window(self):
+        client = PendingMqttClientMock()
+        batch = PublishBatch(client, max_inflight=2, timeout=0.01)
+        for number in range(3):
+            batch.publish(topic=f'{number}/state', payload=number)
+
+        # The third message waits for the completion of the first one:
+        with self.assertLogs('energymeter2mqtt', level='WARNING') as logs:
+            batch.flush()
+        self.assertEqual(
+            logs.output, ['WARNING:energymeter2mqtt.publish_batch:MQTT message 1 not published after 0.01 sec.']
+        )
+        self.assertEqual(len(client.messages), 3)
+        self.assertEqual([info.mid for info in batch.inflight], [2, 3])
+
+        # Completed messages leave the window, without waiting:
+        client.complete_all()
+        batch.publish(topic='4/state', payload=4)
+        batch.publish(topic='5/state', payload=5)
+        batch.flush()
+        self.assertEqual([info.mid for info in batch.inflight], [4, 5])
@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from energymeter2mqtt.scheduler import PollScheduler, group_by_energy_meter
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+class PollSchedulerTestCase(TestCase):
+    def test_merge_due_parameters(self):
+        energy_meter1 = EnergyMeter(device_id=1)
+        energy_meter2 = EnergyMeter(device_id=2)
+
+        scheduler = PollScheduler()
+        scheduler.add(energy_meter1, [{'register': 28}, {'register': 37, 'poll_interval': 0.5}], now=0)
+        scheduler.add(energy_meter2, [{'register': 28}, {'register': 37, 'poll_interval': 0.5}], now=0)
+
+        def get_due(now):
+            jobs = scheduler.pop_due(now=now)
+            return [
+                (energy_meter.device_id, [parameter['register'] for job in jobs for parameter in job.parameters])
+                for energy_meter, jobs in group_by_energy_meter(jobs)
+            ]
+
+        self.assertEqual(get_due(now=0), [(1, [28, 37]), (2, [28, 37])])
+        self.assertEqual(get_due(now=0.5), [(1, [37]), (2, [37])])
+        self.assertEqual(get_due(now=0.9), [])
+        self.assertEqual(get_due(now=10), [(1, [37, 28]), (2, [37, 28])])
+
+    def test_overruns(self):
+        scheduler = PollScheduler()
+        scheduler.add(EnergyMeter(poll_interval=1), [{'register': 28}], now=0)
+        self.assertEqual(len(scheduler.pop_due(now=0)), 1)
+        self.assertEqual(len(scheduler.pop_due(now=1.1)), 1)
+
+        # A slow bus read: The runs due at 2...9 are skipped
+        (job,) = scheduler.pop_due(now=9.5)
+        self.assertEqual(scheduler.next_due(), 10)
+
+        stats = job.stats
+        self.assertEqual(stats.runs, 3)
+        self.assertEqual(stats.overruns, 7)
+        self.assertAlmostEqual(stats.period, 4.75)
+        self.assertAlmostEqual(stats.jitter, 7.6 / 3)
+        self.assertAlmostEqual(stats.max_jitter, 7.5)
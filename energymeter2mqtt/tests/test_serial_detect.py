@@ -0,0 +1,86 @@
+import asyncio
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from energymeter2mqtt.api import get_modbus_client
+from energymeter2mqtt.async_publish import get_async_modbus_client
+from energymeter2mqtt.serial_cache import SerialConnectionCache
+from energymeter2mqtt.serial_detect import detect_ports, probe_connection
+from energymeter2mqtt.tests.test_api import simulated_meters
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+METER_CONNECTION = {'baudrate': 2400, 'bytesize': 8, 'parity': 'E', 'stopbits': 1}
+
+
+async def get_async_client(energy_meter: EnergyMeter, definitions: dict):
+    return get_async_modbus_client(energy_meter, definitions)  # Needs a running event loop
+
+
+class SerialDetectTestCase(TestCase):
+    def test_probe_connection(self):
+        with simulated_meters(transport='rtu-over-tcp', device_ids=(1,)) as simulator:
+            port = f'socket://127.0.0.1:{simulator.port}'  # pyserial URL handler
+            connection = {'baudrate': 9600, 'bytesize': 8, 'parity': 'N', 'stopbits': 1}
+            self.assertTrue(probe_connection(port, connection, device_id=1, address=28, timeout=0.2))
+            self.assertFalse(probe_connection(port, connection, device_id=2, address=28, timeout=0.2))
+
+    def test_detect_and_cache(self):
+        probes = []
+
+        def probe(port, connection, **kwargs):
+            probes.append((port, connection))
+            return port == '/dev/ttyUSB1' and connection == METER_CONNECTION
+
+        definitions = EnergyMeter().get_definitions()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_path = Path(temp_dir, 'serial_connections.json')
+            cache = SerialConnectionCache(cache_path)
+            with self.assertLogs('energymeter2mqtt', level='INFO'):
+                port2connection = detect_ports(
+                    ports=['/dev/ttyUSB0', '/dev/ttyUSB1'],
+                    name='saia_pcd_ald1d5fd',
+                    definitions=definitions,
+                    device_id=1,
+                    timeout=0.1,
+                    cache=cache,
+                    probe=probe,
+                )
+            self.assertEqual(port2connection, {'/dev/ttyUSB0': None, '/dev/ttyUSB1': METER_CONNECTION})
+            self.assertEqual(cache.load(), {'/dev/ttyUSB1 saia_pcd_ald1d5fd': METER_CONNECTION})
+
+            # The next detection starts with the cached settings:
+            probes.clear()
+            with self.assertLogs('energymeter2mqtt', level='INFO'):
+                detect_ports(
+                    ports=['/dev/ttyUSB1'],
+                    name='saia_pcd_ald1d5fd',
+                    definitions=definitions,
+                    device_id=1,
+                    timeout=0.1,
+                    cache=cache,
+                    probe=probe,
+                )
+            self.assertEqual(probes, [('/dev/ttyUSB1', METER_CONNECTION)])
+
+            # The clients use the cached settings, instead of the definition:
+            with (
+                patch('energymeter2mqtt.serial_cache.SERIAL_CACHE_PATH', str(cache_path)),
+                self.assertLogs('energymeter2mqtt', level='WARNING') as logs,
+            ):
+                client = get_modbus_client(EnergyMeter(port='/dev/ttyUSB1'), definitions, verbosity=0)
+                async_client = asyncio.run(get_async_client(EnergyMeter(port='/dev/ttyUSB1'), definitions))
+            for comm_params in (client.comm_params, async_client.comm_params):
+                self.assertEqual(comm_params.baudrate, 2400)
+                self.assertEqual(comm_params.parity, 'E')
+                self.assertEqual(comm_params.stopbits, 1)
+            self.assertEqual(len(logs.output), 2)
+            self.assertIn('Use detected serial settings', logs.output[0])
+
+            # ...but only for the same definition on this port:
+            with patch('energymeter2mqtt.serial_cache.SERIAL_CACHE_PATH', str(cache_path)):
+                client = get_modbus_client(EnergyMeter(port='/dev/ttyUSB0'), definitions, verbosity=0)
+                self.assertEqual(cache.get('/dev/ttyUSB1', name='other_meter'), None)
+            self.assertEqual(client.comm_params.baudrate, definitions['connection']['baudrate'])
@@ -0,0 +1,76 @@
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+from ha_services.mqtt4homeassistant import mqtt as ha_mqtt
+from ha_services.mqtt4homeassistant.data_classes import MqttSettings
+
+from energymeter2mqtt.mqtt_handler import EnergyMeterMqttHandler
+from energymeter2mqtt.sharding import Shard, Supervisor, get_shards, set_mqtt_client_id_suffix
+from energymeter2mqtt.tests.test_mqtt_handler import LoopMqttClientMock
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, ValueBufferSettings
+
+
+def crashing_worker(*, verbosity: int, shard: Shard):
+    sys.exit(3)
+
+
+class ShardingTestCase(TestCase):
+    def test_supervisor_restarts_crashed_workers(self):
+        energy_meters = [EnergyMeter(port='/dev/ttyUSB0'), EnergyMeter(port='/dev/ttyUSB1')]
+        supervisor = Supervisor(
+            shards=get_shards(energy_meters, workers=2),
+            target=crashing_worker,
+            verbosity=0,
+            restart_delay=10,
+        )
+        try:
+            with self.assertLogs('energymeter2mqtt', level='INFO'):
+                supervisor.check(now=0)
+            processes = list(supervisor.number2process.values())
+            self.assertEqual(len(processes), 2)
+            for process in processes:
+                process.join(timeout=30)
+                self.assertEqual(process.exitcode, 3)
+
+            # Restarted after the delay:
+            with self.assertLogs('energymeter2mqtt', level='ERROR') as logs:
+                supervisor.check(now=1)
+            self.assertEqual(
+                logs.output,
+                [
+                    'ERROR:energymeter2mqtt.sharding:Worker 0 exited with code 3',
+                    'ERROR:energymeter2mqtt.sharding:Worker 1 exited with code 3',
+                ],
+            )
+            self.assertEqual(supervisor.number2process, {})
+            with self.assertLogs('energymeter2mqtt', level='INFO'):
+                supervisor.check(now=11)
+            self.assertEqual(len(supervisor.number2process), 2)
+            self.assertEqual(supervisor.restarts, 2)
+        finally:
+            supervisor.stop()
+
+    def test_shard_mqtt_devices(self):
+        user_settings = UserSettings(
+            mqtt=MqttSettings(main_uid='sharding_test'),
+            energy_meter=EnergyMeter(port='/dev/ttyUSB0', device_id=1),
+            additional_energy_meters=[{'port': '/dev/ttyUSB1', 'device_id': 2}],
+            value_buffer=ValueBufferSettings(enabled=False),
+        )
+        shard = Shard(number=1, buses=frozenset({'/dev/ttyUSB1'}))
+        with patch('energymeter2mqtt.mqtt_handler.get_connected_client', return_value=LoopMqttClientMock()):
+            handler = EnergyMeterMqttHandler(user_settings=user_settings, verbosity=0, shard=shard)
+
+        # Same uid as without sharding:
+        self.assertEqual(
+            {key: meter_device.mqtt_device.uid for key, meter_device in handler.meter_devices.items()},
+            {('/dev/ttyUSB1', 2): 'sharding_test-saia_pcd_ald1d5fd_2'},
+        )
+
+    def test_mqtt_client_id(self):
+        get_client_id = ha_mqtt.get_client_id
+        self.addCleanup(setattr, ha_mqtt, 'get_client_id', get_client_id)
+
+        set_mqtt_client_id_suffix('worker 1')
+        self.assertEqual(ha_mqtt.get_client_id(), f'{get_client_id()} worker 1')
@@ -0,0 +1,54 @@
+import time
+from unittest import TestCase
+
+from energymeter2mqtt.api import get_ha_values, get_modbus_client
+from energymeter2mqtt.tests.test_api import simulated_meters
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+class SimulatorTestCase(TestCase):
+    def get_client(self, simulator, **kwargs):
+        energy_meter = EnergyMeter(transport='tcp', host='127.0.0.1', tcp_port=simulator.port, **kwargs)
+        client = get_modbus_client(energy_meter, energy_meter.get_definitions(), verbosity=0)
+        self.addCleanup(client.close)
+        return energy_meter, client
+
+    def test_many_device_ids(self):
+        with simulated_meters(device_ids=range(1, 11)) as simulator:
+            energy_meter, client = self.get_client(simulator)
+            parameters = energy_meter.get_definitions()['parameters']
+            for device_id in range(1, 11):
+                register2values = get_ha_values(client=client, parameters=parameters, device_id=device_id, max_gap=5)
+                self.assertEqual(
+                    register2values,
+                    {28: 0.01, 30: 0.01, 35: 250.0, 36: 0, 37: 0.0, 38: 0.0, 39: 0.0},
+                )
+
+            # Unknown device id -> no response from the "gateway":
+            self.assertEqual(get_ha_values(client=client, parameters=parameters, device_id=11), {})
+
+    def test_latency_and_baudrate(self):
+        with simulated_meters(latency=0.05, baudrate=9600) as simulator:
+            energy_meter, client = self.get_client(simulator)
+            self.assertAlmostEqual(simulator.context[1].bus.get_transfer_time(count=9), 31 * 11 / 9600)
+
+            parameters = energy_meter.get_definitions()['parameters']
+            start = time.monotonic()
+            get_ha_values(client=client, parameters=parameters, device_id=1)
+            duration = time.monotonic() - start
+            # Two block reads: 28-31 and 35-39
+            self.assertEqual(simulator.context[1].bus.requests, 2)
+            self.assertGreater(duration, 2 * 0.05 + (17 + 23) * 11 / 9600)
+
+    def test_error_injection(self):
+        with simulated_meters(error_rate=0.5, seed=1) as simulator:
+            energy_meter, client = self.get_client(simulator, retries=0)
+            parameters = energy_meter.get_definitions()['parameters']
+            values_count = 0
+            for _ in range(10):
+                values_count += len(get_ha_values(client=client, parameters=parameters, device_id=1))
+
+            bus = simulator.context[1].bus
+            self.assertEqual(bus.requests, 20)  # Two block reads per call
+            self.assertGreater(bus.errors, 0)
+            self.assertLess(values_count, 10 * 7)
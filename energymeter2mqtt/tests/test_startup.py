@@ -0,0 +1,27 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+
+STARTUP_CODE = """
+import sys, time
+start = time.perf_counter()
+import energymeter2mqtt.cli_app
+print(time.perf_counter() - start)
+print(','.join(sorted(sys.modules)))
+"""
+
+
+class StartupTestCase(TestCase):
+    def test_cli_import_time(self):
+        # Measure in a fresh process, without the typeguard import hook of the tests:
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_CODE], text=True)
+        duration, modules = output.splitlines()
+
+        # The heavy packages are imported only by the commands that need them:
+        top_level_modules = {module.split('.')[0] for module in modules.split(',')}
+        self.assertNotIn('pymodbus', top_level_modules)
+        self.assertNotIn('paho', top_level_modules)
+        self.assertNotIn('energymeter2mqtt.api', modules.split(','))
+
+        self.assertLess(float(duration), 3)
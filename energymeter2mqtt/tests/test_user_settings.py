@@ -1,9 +1,13 @@
 import dataclasses
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 
+import tomlkit
 from bx_py_utils.test_utils.snapshot import assert_snapshot
+from cli_base.toml_settings.api import TomlSettings
 
-from energymeter2mqtt.user_settings import EnergyMeter
+from energymeter2mqtt.user_settings import EnergyMeter, UserSettings, get_toml_settings, get_user_settings
 
 
 class UserSettingsTestCase(TestCase):
@@ -21,3 +25,43 @@ class UserSettingsTestCase(TestCase):
         assert_snapshot(got=definitions)
 
         assert_snapshot(got=dataclasses.asdict(energy_meter))
+
+    def test_additional_energy_meters(self):
+        document = tomlkit.parse(
+            '[[additional_energy_meters]]\ndevice_id = 2\n\n'
+            '[[additional_energy_meters]]\nport = "/dev/ttyUSB1"\ndevice_id = 3\n'
+        )
+        user_settings = UserSettings(additional_energy_meters=document['additional_energy_meters'])
+        self.assertEqual(
+            [(energy_meter.port, energy_meter.device_id) for energy_meter in user_settings.get_energy_meters()],
+            [('/dev/ttyUSB0', 1), ('/dev/ttyUSB0', 2), ('/dev/ttyUSB1', 3)],
+        )
+
+    def test_append_additional_energy_meters(self):
+        with (
+            tempfile.TemporaryDirectory() as temp_dir,
+            patch.object(TomlSettings, 'settings_directories', (temp_dir,)),
+        ):
+            toml_settings = get_toml_settings()
+            self.assertTrue(toml_settings.file_path.is_relative_to(temp_dir))
+            with patch('cli_base.toml_settings.api.open_editor_for'):
+                toml_settings.open_in_editor()  # Creates the default settings file
+
+            default_content = toml_settings.file_path.read_text(encoding='UTF-8')
+            self.assertNotIn('additional_energy_meters =', default_content)
+            content = default_content + (
+                '\n\n[[additional_energy_meters]]\ndevice_id = 2\n\n'
+                '[[additional_energy_meters]]\nport = "/dev/ttyUSB1"\ndevice_id = 3\n'
+            )
+            toml_settings.file_path.write_text(content, encoding='UTF-8')
+
+            user_settings = get_user_settings(verbosity=0)
+            self.assertEqual(
+                [(energy_meter.port, energy_meter.device_id) for energy_meter in user_settings.get_energy_meters()],
+                [('/dev/ttyUSB0', 1), ('/dev/ttyUSB0', 2), ('/dev/ttyUSB1', 3)],
+            )
+            self.assertEqual(toml_settings.file_path.read_text(encoding='UTF-8'), content)  # Not changed
+
+            # An empty list is harmless:
+            toml_settings.file_path.write_text(f'additional_energy_meters = []\n{default_content}', encoding='UTF-8')
+            self.assertEqual(len(get_user_settings(verbosity=0).get_energy_meters()), 1)
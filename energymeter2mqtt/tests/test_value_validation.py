@@ -0,0 +1,70 @@
+import queue
+from unittest import TestCase
+from unittest.mock import patch
+
+from energymeter2mqtt.bus_worker import BusWorker
+from energymeter2mqtt.metrics import VALUE_REJECTIONS
+from energymeter2mqtt.register_cache import RegisterCache
+from energymeter2mqtt.tests.test_api import ModbusClientMock
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+class ValueValidationTestCase(TestCase):
+    def test_reread_rejected_values(self):
+        energy_meter = EnergyMeter(port='/dev/ttyUSB7')
+        client = ModbusClientMock(mock_data={})
+        worker = BusWorker(
+            bus=energy_meter.bus,
+            client=client,
+            energy_meters=[energy_meter],
+            result_queue=queue.Queue(),
+            register_cache=RegisterCache(),
+        )
+
+        with patch('time.monotonic', return_value=0):
+            register2values = {28: 1000.0, 35: 230}
+            worker.validate(energy_meter, register2values, raw_registers={})
+        self.assertEqual(register2values, {28: 1000.0, 35: 230})
+        self.assertEqual(client.calls, [])
+
+        # A torn read is read once again:
+        client.mock_data[28] = [0x86A5, 0x1]  # 100005 * 0.01 kWh
+        with patch('time.monotonic', return_value=10), self.assertLogs('energymeter2mqtt', level='WARNING') as logs:
+            register2values = {28: 43950.0, 35: 231}
+            raw_registers = {28: [0x0FF8, 0x43], 35: [231]}
+            worker.validate(energy_meter, register2values, raw_registers=raw_registers)
+            worker.update_register_cache(energy_meter, register2values, raw_registers=raw_registers)
+        self.assertEqual(register2values, {28: 1000.05, 35: 231})
+        # The Modbus gateway serves the registers of the accepted re-read:
+        self.assertEqual(
+            worker.register_cache.get(bus='/dev/ttyUSB7', device_id=1, address=28, count=2, max_age=10, now=10),
+            [0x86A5, 0x1],
+        )
+        self.assertEqual(client.calls, [{'address': 28, 'count': 2, 'device_id': 1}])
+        self.assertEqual(
+            logs.output,
+            [
+                'WARNING:energymeter2mqtt.value_validation:'
+                'Reject 43950.0 of /dev/ttyUSB7 (device id: 1) register 28: rate'
+            ],
+        )
+
+        # Implausible values are not published:
+        client.mock_data[28] = [5, 0x10]
+        client.mock_data[35] = [400]
+        with patch('time.monotonic', return_value=20), self.assertLogs('energymeter2mqtt', level='WARNING') as logs:
+            register2values = {28: 0.0, 35: 400}
+            raw_registers = {28: [0, 0], 35: [400]}
+            worker.validate(energy_meter, register2values, raw_registers=raw_registers)
+            worker.update_register_cache(energy_meter, register2values, raw_registers=raw_registers)
+        self.assertEqual(register2values, {})
+        # ...and never the registers of rejected values:
+        self.assertEqual(
+            worker.register_cache.get(bus='/dev/ttyUSB7', device_id=1, address=35, count=1, max_age=20, now=20),
+            [231],
+        )
+        self.assertEqual(len(logs.output), 4)
+
+        self.assertEqual(VALUE_REJECTIONS.get('/dev/ttyUSB7', 1, 28, 'rate'), 2)  # torn read + implausible re-read
+        self.assertEqual(VALUE_REJECTIONS.get('/dev/ttyUSB7', 1, 28, 'decrease'), 1)
+        self.assertEqual(VALUE_REJECTIONS.get('/dev/ttyUSB7', 1, 35, 'max_value'), 2)
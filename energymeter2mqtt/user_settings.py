@@ -1,8 +1,10 @@
+import copy
 import dataclasses
+import functools
 import logging
 import sys
 import tomllib
-from pprint import pformat
+from pathlib import Path
 
 from bx_py_utils.path import assert_is_file
 from cli_base.systemd.data_classes import BaseSystemdServiceInfo, BaseSystemdServiceTemplateContext
@@ -18,18 +20,53 @@ logger = logging.getLogger(__name__)
 
 DEFINITION_FILES_PATH = BASE_PATH / 'definitions'
 
+TRANSPORT_SERIAL = 'serial'  # Modbus RTU via serial port, e.g.: RS485-USB-Adapter
+TRANSPORT_TCP = 'tcp'  # Modbus TCP, e.g.: via Modbus TCP gateway
+TRANSPORT_RTU_OVER_TCP = 'rtu-over-tcp'  # Modbus RTU frames via TCP, e.g.: via transparent serial server
+TRANSPORTS = (TRANSPORT_SERIAL, TRANSPORT_TCP, TRANSPORT_RTU_OVER_TCP)
 
-def parse_definition(name: str) -> dict:
-    definition_file_path = DEFINITION_FILES_PATH / f'{name}.toml'
-    logger.info('Loaded definitions from %s', definition_file_path)
 
-    assert_is_file(definition_file_path)
+def validate_definitions(definitions: dict, *, path: Path):
+    connection = definitions.get('connection')
+    assert isinstance(connection, dict), f'No [connection] in {path}'
+    for key in ('baudrate', 'bytesize', 'parity', 'stopbits'):
+        assert key in connection, f'[connection] without {key!r} in {path}'
+
+    parameters = definitions.get('parameters')
+    assert parameters, f'No [[parameters]] in {path}'
+    registers = set()
+    for parameter in parameters:
+        register = parameter.get('register')
+        assert isinstance(register, int), f'Invalid register in {path}: {parameter=}'
+        assert 'name' in parameter, f'Parameter without name in {path}: {parameter=}'
+        assert register not in registers, f'Register {register} defined twice in {path}'
+        registers.add(register)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_definition(definition_file_path: Path, mtime_ns: int) -> dict:
+    logger.info('Load definitions from %s', definition_file_path)
     content = definition_file_path.read_text(encoding='UTF-8')
     definitions = tomllib.loads(content)
-    logger.info('definitions: %s', pformat(definitions))
+    validate_definitions(definitions, path=definition_file_path)
     return definitions
 
 
+def get_definition_path(name: str) -> Path:
+    return DEFINITION_FILES_PATH / f'{name}.toml'
+
+
+def parse_definition(name: str) -> dict:
+    """
+    Returns the validated definitions. The file is parsed only once, until it's modified.
+    Every caller gets a copy, so the cached definitions can't be modified.
+    """
+    definition_file_path = get_definition_path(name)
+    assert_is_file(definition_file_path)
+    definitions = _load_definition(definition_file_path, definition_file_path.stat().st_mtime_ns)
+    return copy.deepcopy(definitions)
+
+
 @dataclasses.dataclass
 class EnergyMeter:
     """
@@ -40,17 +77,116 @@ class EnergyMeter:
     manufacturer: str = 'Saia'
     verbose_name: str = 'PCD ALD1D5FD'
 
+    # One of: "serial", "tcp" or "rtu-over-tcp"
+    # "port" is used for "serial", "host" and "tcp_port" for the other ones.
+    transport: str = TRANSPORT_SERIAL
     port: str = '/dev/ttyUSB0'
+    host: str = ''
+    tcp_port: int = 502
+
     device_id: int = 0x001  # Modbus address (Was "slave_id" in the past)
 
     timeout: float = 0.5
     retries: int = 3
 
+    # Read all parameters every X seconds (float, e.g.: 0.5 is allowed).
+    # Can be changed per parameter via "poll_interval" in the definition file.
+    poll_interval: float = 10.0
+
+    # Read registers of several parameters with one request,
+    # if not more than this number of unused registers are between them:
+    max_read_gap: int = 0
+
+    @property
+    def bus(self) -> str:
+        """
+        Identify the connection: The serial port or "host:port" of the TCP gateway.
+        All energy meters on the same bus share one Modbus client.
+        """
+        if self.transport == TRANSPORT_SERIAL:
+            return self.port
+        return f'{self.host}:{self.tcp_port}'
+
     def get_definitions(self) -> dict:
         definitions = parse_definition(self.name)
         return definitions
 
 
+@dataclasses.dataclass
+class ValueBufferSettings:
+    """
+    Store the values on disk, while the MQTT broker is not reachable and publish them after reconnect.
+    """
+
+    enabled: bool = True
+    path: str = '~/.cache/energymeter2mqtt/value_buffer.sqlite3'
+    max_rows: int = 100_000  # The oldest values are removed, if the buffer is full
+    replay_batch_size: int = 500  # Publish max. X buffered values per poll cycle after reconnect
+
+    def get_path(self) -> Path:
+        return Path(self.path).expanduser()
+
+
+@dataclasses.dataclass
+class PublishSettings:
+    """
+    All MQTT messages of one poll cycle are published in one batch.
+    With "json_state" all values of an energy meter are published as one JSON object,
+    Home Assistant extracts the values via "value_template".
+    """
+
+    qos: int = 0  # QoS of the state messages
+    retain: bool = False  # Retain the state messages
+    json_state: bool = False
+    max_inflight: int = 100  # Max. published messages waiting for completion
+    timeout: float = 5.0  # Max. seconds to wait for the completion of a message
+    queue_size: int = 1000  # Max. reads waiting to be published
+    overflow: str = 'coalesce'  # If the queue is full: "coalesce" (latest value per register wins) or "drop-oldest"
+
+
+@dataclasses.dataclass
+class AdaptiveTimeoutSettings:
+    """
+    Derive the response timeout of every energy meter from its observed response times
+    and skip energy meters that fail repeatedly, with an exponential backoff.
+    The "timeout" of the energy meter is used as upper limit.
+    """
+
+    enabled: bool = True
+    factor: float = 3.0  # timeout = p99 of the response times x factor
+    min_timeout: float = 0.05
+    min_samples: int = 20  # Use the static timeout until X response times are known
+    window: int = 200  # Number of recent response times used for the statistics
+    failure_threshold: int = 3  # Skip a energy meter after X failed reads in a row
+    max_backoff: float = 300  # Max. seconds to skip a failing energy meter
+
+
+@dataclasses.dataclass
+class MetricsSettings:
+    """
+    Serve Prometheus metrics (Modbus read latency, errors, retries, poll overruns, publish latency)
+    via HTTP on http://<host>:<port>/metrics and the last read values as JSON on http://<host>:<port>/values
+    """
+
+    enabled: bool = False
+    host: str = '127.0.0.1'
+    port: int = 9112
+
+
+@dataclasses.dataclass
+class GatewaySettings:
+    """
+    Modbus TCP server to share the buses with other Modbus clients (e.g.: SCADA tools).
+    Reads of polled registers are answered from the last read, if it's not older than "max_age" seconds.
+    All other reads are send to the bus between the poll runs. Write requests are rejected.
+    """
+
+    enabled: bool = False
+    host: str = '127.0.0.1'
+    port: int = 5020
+    max_age: float = 10
+
+
 @dataclasses.dataclass
 class SystemdServiceTemplateContext(BaseSystemdServiceTemplateContext):
     """
@@ -71,14 +207,49 @@ class SystemdServiceInfo(BaseSystemdServiceInfo):
 
 
 @dataclasses.dataclass
-class UserSettings:
+class BaseUserSettings:
     """
-    User settings for inverter-connect
+    User settings for energymeter2mqtt
+
+    More energy meters can be added via "[[additional_energy_meters]]" tables.
+    All values that are not set there, are taken from the "[energy_meter]" section, e.g.:
+
+        [[additional_energy_meters]]
+        device_id = 2
     """
 
     systemd: dataclasses = dataclasses.field(default_factory=SystemdServiceInfo)
     mqtt: dataclasses = dataclasses.field(default_factory=MqttSettings)
     energy_meter: dataclasses = dataclasses.field(default_factory=EnergyMeter)
+    publish: dataclasses = dataclasses.field(default_factory=PublishSettings)
+    value_buffer: dataclasses = dataclasses.field(default_factory=ValueBufferSettings)
+    metrics: dataclasses = dataclasses.field(default_factory=MetricsSettings)
+    gateway: dataclasses = dataclasses.field(default_factory=GatewaySettings)
+    adaptive_timeout: dataclasses = dataclasses.field(default_factory=AdaptiveTimeoutSettings)
+
+
+@dataclasses.dataclass
+class UserSettings(BaseUserSettings):
+    """
+    The settings from the settings file, incl. the "[[additional_energy_meters]]" tables.
+    """
+
+    # Not handled by TomlSettings, because it would write a "additional_energy_meters = []" key
+    # and appended "[[additional_energy_meters]]" tables would be a duplicate key:
+    additional_energy_meters: list = dataclasses.field(default_factory=list)
+
+    def get_energy_meters(self) -> list[EnergyMeter]:
+        energy_meters = [self.energy_meter]
+
+        additional_energy_meters = self.additional_energy_meters
+        if hasattr(additional_energy_meters, 'unwrap'):
+            # A tomlkit array of tables from the user settings file
+            additional_energy_meters = additional_energy_meters.unwrap()
+
+        for overwrites in additional_energy_meters:
+            energy_meters.append(dataclasses.replace(self.energy_meter, **overwrites))
+
+        return energy_meters
 
 
 ###########################################################################################################
@@ -88,7 +259,7 @@ def get_toml_settings() -> TomlSettings:
     toml_settings = TomlSettings(
         dir_name=SETTINGS_DIR_NAME,
         file_name=SETTINGS_FILE_NAME,
-        settings_dataclass=UserSettings(),
+        settings_dataclass=BaseUserSettings(),
         not_exist_exit_code=None,  # Don't sys.exit() if settings file not present, yet.
     )
     return toml_settings
@@ -96,5 +267,10 @@ def get_toml_settings() -> TomlSettings:
 
 def get_user_settings(verbosity: int) -> UserSettings:
     toml_settings: TomlSettings = get_toml_settings()
-    user_settings: UserSettings = toml_settings.get_user_settings(debug=verbosity > 0)
-    return user_settings
+    base_settings: BaseUserSettings = toml_settings.get_user_settings(debug=verbosity > 0)
+
+    document = tomllib.loads(toml_settings.file_path.read_text(encoding='UTF-8'))
+    return UserSettings(
+        **{field.name: getattr(base_settings, field.name) for field in dataclasses.fields(base_settings)},
+        additional_energy_meters=document.get('additional_energy_meters', []),
+    )
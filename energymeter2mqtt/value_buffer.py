@@ -0,0 +1,94 @@
+import sqlite3
+from pathlib import Path
+
+
+class ValueBuffer:
+    """
+    Store-and-forward buffer for values that can't be published, because the MQTT broker is not reachable.
+
+    The values are stored in a SQLite database in WAL mode. Only the newest `max_rows` values are kept.
+    The database is created on the first store(), so nothing is written while the broker is reachable.
+
+    >>> value_buffer = ValueBuffer(path=':memory:', max_rows=3)
+    >>> value_buffer.store(bus='/dev/ttyUSB0', device_id=1, timestamp=1, register2values={28: 1.5, 35: 230})
+    >>> value_buffer.store(bus='/dev/ttyUSB0', device_id=1, timestamp=2, register2values={28: 1.6, 35: 231})
+    >>> len(value_buffer)
+    3
+    >>> rows = value_buffer.get_batch(limit=2)
+    >>> rows
+    [(2, 1.0, '/dev/ttyUSB0', 1, 35, 230.0), (3, 2.0, '/dev/ttyUSB0', 1, 28, 1.6)]
+    >>> value_buffer.remove(ids=[3])
+    >>> value_buffer.get_batch(limit=2)
+    [(2, 1.0, '/dev/ttyUSB0', 1, 35, 230.0), (4, 2.0, '/dev/ttyUSB0', 1, 35, 231.0)]
+    >>> value_buffer.get_batch(limit=2, after_id=2)
+    [(4, 2.0, '/dev/ttyUSB0', 1, 35, 231.0)]
+    >>> value_buffer.is_empty(after_id=4)
+    True
+    """
+
+    def __init__(self, *, path: str | Path, max_rows: int):
+        assert max_rows > 0, f'Invalid {max_rows=}'
+        self.path = path
+        self.max_rows = max_rows
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            # Used from the publishing thread/event loop only, but this may not be the creating thread:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS buffered_values ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' timestamp REAL NOT NULL,'
+                ' bus TEXT NOT NULL,'
+                ' device_id INTEGER NOT NULL,'
+                ' register INTEGER NOT NULL,'
+                ' value REAL NOT NULL'
+                ')'
+            )
+        return self._connection
+
+    def store(self, *, bus: str, device_id: int, timestamp: float, register2values: dict):
+        with self.connection as connection:
+            connection.executemany(
+                'INSERT INTO buffered_values (timestamp, bus, device_id, register, value) VALUES (?, ?, ?, ?, ?)',
+                [(timestamp, bus, device_id, register, value) for register, value in register2values.items()],
+            )
+            # Evict the oldest values:
+            connection.execute(
+                'DELETE FROM buffered_values WHERE id <= (SELECT MAX(id) FROM buffered_values) - ?',
+                (self.max_rows,),
+            )
+
+    def _exists(self) -> bool:
+        return self._connection is not None or Path(self.path).exists()
+
+    def __len__(self):
+        if not self._exists():
+            return 0
+        return self.connection.execute('SELECT COUNT(*) FROM buffered_values').fetchone()[0]
+
+    def is_empty(self, *, after_id: int = 0) -> bool:
+        if not self._exists():
+            return True
+        query = 'SELECT 1 FROM buffered_values WHERE id > ? LIMIT 1'
+        return self.connection.execute(query, (after_id,)).fetchone() is None
+
+    def get_batch(self, *, limit: int, after_id: int = 0) -> list[tuple]:
+        """
+        Returns the oldest values after "after_id" as (id, timestamp, bus, device_id, register, value)
+        """
+        return self.connection.execute(
+            'SELECT id, timestamp, bus, device_id, register, value FROM buffered_values'
+            ' WHERE id > ? ORDER BY id LIMIT ?',
+            (after_id, limit),
+        ).fetchall()
+
+    def remove(self, *, ids: list[int]):
+        with self.connection as connection:
+            connection.executemany('DELETE FROM buffered_values WHERE id = ?', [(row_id,) for row_id in ids])
@@ -0,0 +1,256 @@
+import logging
+
+from energymeter2mqtt.decode_plan import DATA_TYPES, DEFAULT_DATA_TYPES, DecodeBlock, compile_decode_plan
+from energymeter2mqtt.metrics import COUNTER_ROLLOVERS, VALUE_REJECTIONS
+from energymeter2mqtt.read_plan import get_register_count
+from energymeter2mqtt.user_settings import EnergyMeter
+
+
+logger = logging.getLogger(__name__)
+
+
+MONOTONIC_STATE_CLASSES = ('total', 'total_increasing')
+ROLLOVER_MARGIN = 0.1  # A decrease is a rollover, if the counter wrapped by less than X of its range
+REBASE_AFTER = 3  # Accept a jump of the value, after X consistent values in a row
+
+# Results of ValueValidator.check():
+OK = 'ok'
+ROLLOVER = 'rollover'
+REBASE = 'rebase'
+ACCEPTED = (OK, ROLLOVER, REBASE)
+
+
+class ValueValidator:
+    """
+    Plausibility checks of the values of one parameter.
+    Returns a accepted result (ok, rollover, rebase) or the reason for the rejection.
+
+    >>> validator = ValueValidator(min_value=0, max_rate=1, monotonic=True)
+    >>> validator.check(1000.0, now=0)
+    'ok'
+    >>> validator.check(1005.0, now=10)
+    'ok'
+    >>> validator.check(43950.0, now=20)  # e.g.: a torn read of the two words
+    'rate'
+    >>> validator.check(1004.0, now=30)
+    'decrease'
+    >>> validator.check(-1, now=40)
+    'min_value'
+    >>> validator.check(1010.0, now=40)
+    'ok'
+
+    A monotonic counter that wraps around:
+    >>> validator = ValueValidator(monotonic=True, rollover=655.36)
+    >>> validator.check(655.3, now=0)
+    'ok'
+    >>> validator.check(0.1, now=10)
+    'rollover'
+
+    The new value is accepted, if the counter jumps for real (e.g.: replaced energy meter):
+    >>> validator = ValueValidator(monotonic=True)
+    >>> validator.check(1000, now=0)
+    'ok'
+    >>> [validator.check(value, now=0) for value in (5, 6, 7, 8)]
+    ['decrease', 'decrease', 'rebase', 'ok']
+    """
+
+    def __init__(
+        self,
+        *,
+        min_value: int | float | None = None,
+        max_value: int | float | None = None,
+        max_rate: int | float | None = None,  # Max. change per second
+        resolution: int | float = 0,  # Allowed change in addition to max_rate, e.g.: one count of a counter
+        monotonic: bool = False,
+        rollover: int | float | None = None,  # Range of a monotonic counter, that wraps around to 0
+    ):
+        assert max_rate is None or max_rate > 0, f'Invalid {max_rate=}'
+        self.min_value = min_value
+        self.max_value = max_value
+        self.max_rate = max_rate
+        self.resolution = resolution
+        self.monotonic = monotonic
+        self.rollover = rollover
+
+        self.last_value = None
+        self.last_time = None
+
+        # Consistent rejected values in a row:
+        self.rejected_value = None
+        self.rejected_time = None
+        self.rejections = 0
+
+    def check_change(self, value, *, now, last_value, last_time) -> str:
+        change = value - last_value
+        result = OK
+        if self.monotonic and change < 0:
+            if self.rollover is None or change + self.rollover > self.rollover * ROLLOVER_MARGIN:
+                return 'decrease'
+            change += self.rollover
+            result = ROLLOVER
+        if self.max_rate is not None and abs(change) > self.max_rate * (now - last_time) + self.resolution:
+            return 'rate'
+        return result
+
+    def check(self, value, *, now) -> str:
+        if self.min_value is not None and value < self.min_value:
+            return 'min_value'
+        if self.max_value is not None and value > self.max_value:
+            return 'max_value'
+
+        if self.last_value is None:
+            result = OK
+        else:
+            result = self.check_change(value, now=now, last_value=self.last_value, last_time=self.last_time)
+
+        if result not in ACCEPTED:
+            if self.rejected_value is not None and (
+                self.check_change(value, now=now, last_value=self.rejected_value, last_time=self.rejected_time)
+                in ACCEPTED
+            ):
+                self.rejections += 1
+            else:
+                self.rejections = 1
+            self.rejected_value = value
+            self.rejected_time = now
+            if self.rejections < REBASE_AFTER:
+                return result
+            result = REBASE
+
+        self.last_value = value
+        self.last_time = now
+        self.rejected_value = None
+        self.rejections = 0
+        return result
+
+
+def get_rollover(parameter: dict) -> float | None:
+    """
+    The range of unsigned integer counters, e.g.: a 32-bit counter with scale 0.01 wraps at 42949672.96
+
+    >>> get_rollover({'register': 28, 'reg_count': 2, 'scale': 0.01})
+    42949672.96
+    >>> get_rollover({'register': 28, 'reg_count': 2, 'data_type': 'float32'}) is None
+    True
+    """
+    count = get_register_count(parameter)
+    data_type = parameter.get('data_type') or DEFAULT_DATA_TYPES.get(count)
+    if data_type not in DATA_TYPES or not data_type.startswith('uint'):
+        return None
+    return 2 ** (16 * count) * parameter.get('scale', 1)
+
+
+def get_value_validator(parameter: dict) -> ValueValidator | None:
+    """
+    Create the ValueValidator from the definition parameter:
+    "min_value", "max_value", "max_rate" (max. change per second) and "monotonic"
+    (default: true for the state classes "total" and "total_increasing").
+    """
+    monotonic = parameter.get('monotonic', parameter.get('state_class') in MONOTONIC_STATE_CLASSES)
+    min_value = parameter.get('min_value')
+    max_value = parameter.get('max_value')
+    max_rate = parameter.get('max_rate')
+    if not monotonic and min_value is None and max_value is None and max_rate is None:
+        return None
+    return ValueValidator(
+        min_value=min_value,
+        max_value=max_value,
+        max_rate=max_rate,
+        resolution=parameter.get('scale', 0),
+        monotonic=monotonic,
+        rollover=get_rollover(parameter) if monotonic else None,
+    )
+
+
+class EnergyMeterValidator:
+    """
+    The ValueValidators of all parameters of one energy meter.
+    """
+
+    def __init__(self, energy_meter: EnergyMeter):
+        self.energy_meter = energy_meter
+        self.register2parameter = {}
+        self.register2validator = {}
+        for parameter in energy_meter.get_definitions()['parameters']:
+            if validator := get_value_validator(parameter):
+                self.register2parameter[parameter['register']] = parameter
+                self.register2validator[parameter['register']] = validator
+        self.decode_plans = {}
+
+    def validate(self, register2values: dict, *, now) -> dict:
+        """
+        Remove all implausible values from "register2values". Returns the rejection reasons by register.
+        """
+        energy_meter = self.energy_meter
+        rejected = {}
+        for register, value in list(register2values.items()):
+            validator = self.register2validator.get(register)
+            if validator is None:
+                continue
+            last_value = validator.last_value
+            result = validator.check(value, now=now)
+            if result == OK:
+                continue
+            if result == ROLLOVER:
+                logger.info(
+                    'Counter rollover of %s (device id: %i) register %i: %r -> %r',
+                    energy_meter.bus,
+                    energy_meter.device_id,
+                    register,
+                    last_value,
+                    value,
+                )
+                COUNTER_ROLLOVERS.inc(energy_meter.bus, energy_meter.device_id, register)
+            elif result == REBASE:
+                logger.warning(
+                    'Accept %r of %s (device id: %i) register %i, after %i consistent values',
+                    value,
+                    energy_meter.bus,
+                    energy_meter.device_id,
+                    register,
+                    REBASE_AFTER,
+                )
+            else:
+                logger.warning(
+                    'Reject %r of %s (device id: %i) register %i: %s',
+                    value,
+                    energy_meter.bus,
+                    energy_meter.device_id,
+                    register,
+                    result,
+                )
+                VALUE_REJECTIONS.inc(energy_meter.bus, energy_meter.device_id, register, result)
+                del register2values[register]
+                rejected[register] = result
+        return rejected
+
+    def get_decode_plan(self, registers) -> tuple[DecodeBlock, ...]:
+        """
+        The decode plan to read the given (rejected) registers once again.
+        """
+        key = tuple(sorted(registers))
+        try:
+            return self.decode_plans[key]
+        except KeyError:
+            parameters = [self.register2parameter[register] for register in key]
+            decode_plan = self.decode_plans[key] = compile_decode_plan(parameters)
+            return decode_plan
+
+
+class ValidatorRegistry:
+    """
+    The EnergyMeterValidator of all energy meters on one bus, created on demand.
+    """
+
+    def __init__(self):
+        self.device_id2validator = {}
+
+    def get(self, energy_meter: EnergyMeter) -> EnergyMeterValidator:
+        try:
+            return self.device_id2validator[energy_meter.device_id]
+        except KeyError:
+            validator = self.device_id2validator[energy_meter.device_id] = EnergyMeterValidator(energy_meter)
+            return validator
+
+    def remove(self, energy_meter: EnergyMeter):
+        self.device_id2validator.pop(energy_meter.device_id, None)